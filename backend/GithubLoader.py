@@ -1,86 +1,403 @@
 from git import Repo
-from langchain.document_loaders import GitLoader
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import mmap
 import os
 import shutil
 import tempfile
-from dotenv import load_dotenv
+import threading
+import time
+from summary_cache import CACHE_DIR, git_blob_sha
+from clients import load_env
+from metrics import log_event
 
-load_dotenv()
+load_env()
 
+# Bare, blobless mirrors of every loaded repository, updated with a fetch on reuse
+MIRROR_DIR = os.getenv("GIT_MIRROR_DIR", os.path.join(CACHE_DIR, "mirrors"))
+CHECKOUT_PREFIX = "github_repo_"
+# Threads reading files of a checkout
+LOADER_READ_WORKERS = int(os.getenv("LOADER_READ_WORKERS", "16"))
+# Larger files are skipped (bundles, fixtures, data dumps)
+LOADER_MAX_FILE_BYTES = int(os.getenv("LOADER_MAX_FILE_BYTES", str(1024 * 1024)))
+# Files of at least this size are read through mmap
+LOADER_MMAP_BYTES = int(os.getenv("LOADER_MMAP_BYTES", str(256 * 1024)))
+# A NUL byte in the first bytes of a file marks it as binary
+_SNIFF_BYTES = 8192
+# Files per read task; one task per file costs more in scheduling than reading small files does
+_READ_BATCH = 64
 
-def file_filter(file_path):
-    """Filter out files that don't need AI summaries"""
-    
-    # Directories to exclude
-    exclude_dirs = [
-        "node_modules/", ".git/", "dist/", "build/", "__pycache__/",
-        "venv/", "env/", ".venv/", "vendor/", "target/",
-        ".next/", "out/", "coverage/", ".pytest_cache/"
-    ]
+# Directories to exclude
+EXCLUDE_DIRS = [
+    "node_modules/", ".git/", "dist/", "build/", "__pycache__/",
+    "venv/", "env/", ".venv/", "vendor/", "target/",
+    ".next/", "out/", "coverage/", ".pytest_cache/"
+]
+
+# File patterns to exclude
+EXCLUDE_PATTERNS = [
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml",
+    "Gemfile.lock", "composer.lock", "Cargo.lock"
+]
+
+# File extensions to exclude
+EXCLUDE_EXTENSIONS = [
+    # Binary/Media
+    ".png", ".jpg", ".jpeg", ".gif", ".svg", ".ico", ".webp",
+    ".mp4", ".avi", ".mov", ".mp3", ".wav",
+    ".pdf", ".zip", ".tar", ".gz", ".7z",
     
-    # File patterns to exclude
-    exclude_patterns = [
-        "package-lock.json", "yarn.lock", "pnpm-lock.yaml",
-        "Gemfile.lock", "composer.lock", "Cargo.lock"
-    ]
+    # Documentation (already readable)
+    ".md", ".txt", ".rst",
     
-    # File extensions to exclude
-    exclude_extensions = [
-        # Binary/Media
-        ".png", ".jpg", ".jpeg", ".gif", ".svg", ".ico", ".webp",
-        ".mp4", ".avi", ".mov", ".mp3", ".wav",
-        ".pdf", ".zip", ".tar", ".gz", ".7z",
-        
-        # Documentation (already readable)
-        ".md", ".txt", ".rst",
-        
-        # Config/Data files
-        ".json", ".yaml", ".yml", ".toml", ".ini", ".xml",
-        ".csv", ".tsv",
-        
-        # Compiled/Generated
-        ".pyc", ".pyo", ".class", ".o", ".so", ".dll", ".exe",
-        ".wasm", ".map",
-        
-        # Database
-        ".db", ".sqlite", ".sqlite3"
-    ]
+    # Config/Data files
+    ".json", ".yaml", ".yml", ".toml", ".ini", ".xml",
+    ".csv", ".tsv",
     
-    # Check directory exclusions
-    for exclude_dir in exclude_dirs:
-        if exclude_dir in file_path:
-            return False
+    # Compiled/Generated
+    ".pyc", ".pyo", ".class", ".o", ".so", ".dll", ".exe",
+    ".wasm", ".map",
     
-    # Check file pattern exclusions
-    file_name = file_path.split("/")[-1]
-    if file_name in exclude_patterns:
+    # Database
+    ".db", ".sqlite", ".sqlite3"
+]
+
+
+_EXCLUDED_DIR_NAMES = frozenset(d.strip("/") for d in EXCLUDE_DIRS)
+# The .git of a worktree checkout is a file pointing to the mirror
+_EXCLUDED_FILE_NAMES = frozenset(EXCLUDE_PATTERNS) | {".git"}
+_EXCLUDED_EXTENSIONS = tuple(EXCLUDE_EXTENSIONS)
+
+
+def _include_file_name(file_name: str) -> bool:
+    return file_name not in _EXCLUDED_FILE_NAMES and not file_name.lower().endswith(_EXCLUDED_EXTENSIONS)
+
+
+def file_filter(file_path):
+    """
+    Filter out files that don't need AI summaries. Takes a path relative to
+    the repository root; directories are matched by whole path component,
+    so `rebuild/` is kept while `build/` is excluded.
+    """
+    parts = file_path.replace(os.sep, "/").split("/")
+    if not _EXCLUDED_DIR_NAMES.isdisjoint(parts[:-1]):
         return False
-    
-    # Check extension exclusions
-    for ext in exclude_extensions:
-        if file_path.endswith(ext):
-            return False
-    
-    return True
+    return _include_file_name(parts[-1])
+
+
+def sparse_checkout_patterns():
+    """
+    Non-cone sparse-checkout patterns derived from the exclude rules, so
+    excluded files are never fetched or written to disk
+    """
+    patterns = ["/*"]
+    patterns += [f"!{d}" for d in EXCLUDE_DIRS if d != ".git/"]
+    patterns += [f"!{name}" for name in EXCLUDE_PATTERNS]
+    patterns += [f"!*{ext}" for ext in EXCLUDE_EXTENSIONS]
+    return patterns
+
+
+# One lock per mirror directory, held while it is updated, checked out from or removed
+_mirror_locks = {}
+_mirror_locks_lock = threading.Lock()
+# Checkouts still being read by an indexing run; cleanup_checkouts leaves them alone
+_live_checkouts = set()
+_live_checkouts_lock = threading.Lock()
+
+
+def _path_lock(path: str) -> threading.Lock:
+    with _mirror_locks_lock:
+        return _mirror_locks.setdefault(path, threading.Lock())
+
+
+def _mirror_lock(url: str) -> threading.Lock:
+    return _path_lock(mirror_path(url))
+
+
+def mirror_path(url: str) -> str:
+    return os.path.join(MIRROR_DIR, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".git")
+
+
+def update_mirror(url: str) -> Repo:
+    """
+    Clone a bare, blobless mirror of the repository, or fetch into the
+    existing one. Blobs are fetched lazily, only for files that are checked out.
+    Callers must hold the mirror lock for the url.
+    """
+    path = mirror_path(url)
+    if os.path.isdir(path):
+        repo = Repo(path)
+        try:
+            repo.git.fetch("origin", "--prune", "--filter=blob:none")
+            os.utime(path)
+            return repo
+        except Exception as e:
+            print(f"Fetching mirror of {url} failed, recloning: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(MIRROR_DIR, exist_ok=True)
+    return Repo.clone_from(url, to_path=path, mirror=True, filter="blob:none")
+
+
+def open_mirror(url: str) -> Repo:
+    """
+    Return the up-to-date mirror of the repository (e.g. to read its history)
+    """
+    with _mirror_lock(url):
+        return update_mirror(url)
+
+
+def cleanup_checkouts(max_age: float = 3600, mirror_max_age: float = 7 * 24 * 3600):
+    """
+    Remove checkouts older than max_age seconds and mirrors that were not
+    used for mirror_max_age seconds. Meant to be run on a schedule.
+    Checkouts still in use by this process are kept, however old.
+    """
+    now = time.time()
+    removed = 0
+    tmp_dir = tempfile.gettempdir()
+    with _live_checkouts_lock:
+        live = set(_live_checkouts)
+    for name in os.listdir(tmp_dir):
+        path = os.path.join(tmp_dir, name)
+        if not name.startswith(CHECKOUT_PREFIX) or path in live:
+            continue
+        try:
+            stale = now - os.path.getmtime(path) > max_age
+        except OSError:
+            continue
+        if stale:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    if os.path.isdir(MIRROR_DIR):
+        for name in os.listdir(MIRROR_DIR):
+            path = os.path.join(MIRROR_DIR, name)
+            # Not while the mirror is fetched into or checked out from
+            with _path_lock(path):
+                try:
+                    stale = now - os.path.getmtime(path) > mirror_max_age
+                except OSError:
+                    continue
+                if stale:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+                    continue
+                try:
+                    # Forget worktrees whose checkout directory was removed
+                    Repo(path).git.worktree("prune")
+                except Exception as e:
+                    print(f"Error pruning worktrees of {path}: {e}")
+    return removed
+
+
+class LoadedFile:
+    __slots__ = ("page_content", "metadata")
+
+    def __init__(self, page_content: str, metadata: dict):
+        self.page_content = page_content
+        self.metadata = metadata
+
+
+def _read_text(path: str):
+    """
+    Raw content of a text file, or None and the reason it was skipped
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if size > LOADER_MAX_FILE_BYTES:
+            return None, "too_large"
+        head = os.read(fd, _SNIFF_BYTES)
+        if b"\0" in head:
+            return None, "binary"
+        if len(head) < _SNIFF_BYTES:
+            return head, None
+        if size >= LOADER_MMAP_BYTES:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:], None
+        chunks = [head]
+        while True:
+            chunk = os.read(fd, max(size - len(head), _SNIFF_BYTES))
+            if not chunk:
+                return b"".join(chunks), None
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+
+
+class RepositoryFileLoader:
+    def __init__(self, repo_path: str):
+        """
+        Loads the text files of a checkout: walks it with os.scandir, pruning
+        excluded directories, and reads files on a thread pool. Files come out
+        in walk order with the same metadata LangChain's GitLoader produced,
+        plus the blob SHA.
+        """
+        self.repo_path = repo_path
+
+    def _walk(self):
+        """
+        Repository-relative paths of the included files, sorted per directory
+        """
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                with os.scandir(os.path.join(self.repo_path, rel_dir)) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError as e:
+                print(f"Error listing {rel_dir or self.repo_path}: {e}")
+                continue
+            subdirs = []
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in _EXCLUDED_DIR_NAMES:
+                        subdirs.append(rel_path)
+                elif entry.is_file(follow_symlinks=False) and _include_file_name(entry.name):
+                    yield rel_path
+            stack.extend(reversed(subdirs))
+
+    def _load_file(self, rel_path: str):
+        data, reason = _read_text(os.path.join(self.repo_path, rel_path))
+        if data is None:
+            return None, reason
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError:
+            return None, "binary"
+        file_name = rel_path.rsplit("/", 1)[-1]
+        return LoadedFile(text, {
+            "source": rel_path,
+            "file_path": rel_path,
+            "file_name": file_name,
+            "file_type": os.path.splitext(file_name)[1],
+            "blob_sha": git_blob_sha(data),
+        }), None
+
+    def _load_batch(self, rel_paths):
+        results = []
+        for rel_path in rel_paths:
+            try:
+                results.append(self._load_file(rel_path))
+            except OSError as e:
+                print(f"Error reading file {rel_path}: {e}")
+                results.append((None, "error"))
+        return results
+
+    def _batches(self):
+        batch = []
+        for rel_path in self._walk():
+            batch.append(rel_path)
+            if len(batch) == _READ_BATCH:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def lazy_load(self):
+        started = time.perf_counter()
+        loaded = 0
+        skipped = Counter()
+        # Bounded number of batches in flight, so a slow consumer keeps memory flat
+        window = LOADER_READ_WORKERS * 2
+        executor = ThreadPoolExecutor(max_workers=LOADER_READ_WORKERS, thread_name_prefix="codepulse-loader")
+        pending = deque()
+
+        def take():
+            docs = []
+            for doc, reason in pending.popleft().result():
+                if doc is None:
+                    skipped[reason] += 1
+                else:
+                    docs.append(doc)
+            return docs
+
+        try:
+            for batch in self._batches():
+                pending.append(executor.submit(self._load_batch, batch))
+                if len(pending) >= window:
+                    for doc in take():
+                        loaded += 1
+                        yield doc
+            while pending:
+                for doc in take():
+                    loaded += 1
+                    yield doc
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            log_event(
+                "files_loaded", files=loaded, skipped=dict(skipped),
+                seconds=round(time.perf_counter() - started, 3),
+            )
+
+    def load(self):
+        return list(self.lazy_load())
 
 
 class GithubLoader:
-    def __init__(self):
+    def __init__(self, mode: str = None):
         """
         this class is responsible for loading in a github repository
+
+        mode "mirror" (default) keeps a blobless bare mirror per repository and
+        checks out a sparse worktree from it; mode "shallow" does a one-off
+        depth 1, blobless, sparse clone
         """
+        self.mode = mode or os.getenv("GIT_CLONE_MODE", "mirror")
+        self.head_commit = None
+        self.tmp_path = None
+        self._mirror = None
 
     def load(self, url: str):
-        # Use a unique temporary directory for each clone
-        tmp_path = tempfile.mkdtemp(prefix="github_repo_")
-        repo = Repo.clone_from(
-            url,
-            to_path=tmp_path,
-        )
-        branch = repo.head.reference
-
-        loader = GitLoader(repo_path=tmp_path, branch=branch, file_filter=file_filter)
-        return loader
+        """
+        Check out the repository into a new temporary directory and return a
+        loader for its files. The caller must call cleanup() when done (the
+        checkout is removed right away if the checkout fails).
+        """
+        # Use a unique temporary directory for each checkout
+        tmp_path = tempfile.mkdtemp(prefix=CHECKOUT_PREFIX)
+        self.tmp_path = tmp_path
+        with _live_checkouts_lock:
+            _live_checkouts.add(tmp_path)
+        try:
+            if self.mode == "shallow":
+                repo = Repo.clone_from(
+                    url,
+                    to_path=tmp_path,
+                    depth=1,
+                    filter="blob:none",
+                    no_checkout=True,
+                )
+            else:
+                with _mirror_lock(url):
+                    self._mirror = update_mirror(url)
+                    self._mirror.git.worktree("add", "--no-checkout", "--detach", tmp_path, "HEAD")
+                repo = Repo(tmp_path)
+            repo.git.sparse_checkout("set", "--no-cone", *sparse_checkout_patterns())
+            repo.git.checkout("HEAD")
+            self.head_commit = repo.head.commit.hexsha
+        except BaseException:
+            self.cleanup()
+            raise
+
+        return RepositoryFileLoader(tmp_path)
+
+    def cleanup(self):
+        """
+        Remove the checkout created by load() and its worktree registration
+        """
+        if self.tmp_path is None:
+            return
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        if self._mirror is not None:
+            try:
+                self._mirror.git.worktree("prune")
+            except Exception as e:
+                print(f"Error pruning worktrees: {e}")
+        with _live_checkouts_lock:
+            _live_checkouts.discard(self.tmp_path)
+        self.tmp_path = None
 
 
 # github_loader = GithubLoader()
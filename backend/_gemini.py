@@ -1,193 +1,279 @@
-from dotenv import load_dotenv
 import os
-import google.generativeai as genai
-import asyncio
-from typing import List
-
-load_dotenv()
-
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-# Initialize Groq client
-try:
-    from groq import Groq
-    groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    groq_available = True
-    print("Groq client initialized successfully")
-except Exception as e:
-    print(f"Warning: Groq not available: {e}")
-    groq_available = False
-    groq_client = None
-
-# Request queue to prevent rate limiting
-# Limit concurrent Groq requests to avoid hitting 6000 TPM limit
-groq_semaphore = asyncio.Semaphore(2)  # Max 2 concurrent requests
-groq_request_queue = asyncio.Queue()
-
-
-# Initialize Weaviate client
-try:
-    import weaviate
-    from weaviate.classes.config import Configure, Property, DataType
-    
-    client = weaviate.connect_to_weaviate_cloud(
-        cluster_url="https://opbbo1qysuwd9s67rowxg.c0.asia-southeast1.gcp.weaviate.cloud",
-        auth_credentials=weaviate.auth.AuthApiKey(os.getenv("WEAVIATE_API_KEY")),
-    )
-    weaviate_available = True
-    print("Weaviate client initialized successfully")
-except Exception as e:
-    print(f"Warning: Weaviate not available: {e}")
-    weaviate_available = False
-    client = None
+from typing import AsyncIterator, List, Optional
+from summary_cache import SummaryCache, git_blob_sha, cache_key
+from embedding_batcher import EmbeddingBatcher
+from rate_limiter import get_limiter, estimate_tokens
+from ttl_cache import TTLCache
+from context_packer import CONTEXT_BUDGETS, CONTEXT_CANDIDATES, pack_context
+from lexical_index import LexicalIndex, looks_lexical, reciprocal_rank_fusion
+from metrics import timed, record_cache, record_tokens, log_event
+from clients import registry, load_env, run_blocking
+from single_flight import ask_flights, namespace_write_locks
+import logging
+
+load_env()
+
+# Model and prompt version used for file summaries; bump the prompt version
+# whenever the summary prompt changes so cached summaries are regenerated
+SUMMARY_MODEL = "llama-3.1-8b-instant"
+SUMMARY_PROMPT_VERSION = "v1"
+# Model used for commit summaries
+COMMIT_SUMMARY_MODEL = "llama-3.1-8b-instant"
+
+# Gemini's most basic embedding model
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_DIMENSION = 768  # Standard embedding dimension
+
+# Persistent cache of file summaries keyed by git blob SHA, model and prompt version
+summary_cache = SummaryCache()
+
+# Cache of query embeddings keyed by embedding model and normalized query text
+query_embedding_cache = TTLCache(
+    maxsize=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", str(24 * 3600))),
+)
+
+# SDK clients are created on first use (see clients.py)
+async def get_genai():
+    return await registry.aget("genai")
+
+
+async def get_groq():
+    """
+    Shared Groq client, or None if Groq is not available
+    """
+    return await registry.atry_get("groq")
+
+
+def get_vector_store():
+    """
+    Vector store (Weaviate Cloud or the embedded local store, see VECTOR_STORE)
+    """
+    return registry.get("vector_store")
+
+
+async def get_vector_store_async():
+    return await registry.aget("vector_store")
+
+
+# Shared per-provider rate limiters (requests and tokens per minute)
+groq_limiter = get_limiter("groq")
+gemini_limiter = get_limiter("gemini")
+embedding_limiter = get_limiter("gemini_embedding")
+
+
+def _groq_usage(response):
+    usage = response.usage
+    record_tokens("groq", usage.prompt_tokens, usage.completion_tokens)
+    return usage.total_tokens
+
+
+def _gemini_usage(response):
+    usage = response.usage_metadata
+    record_tokens("gemini", usage.prompt_token_count, usage.candidates_token_count)
+    return usage.total_token_count
+
+
+# Local BM25 keyword index, searched alongside the vector store
+lexical_index = LexicalIndex()
+# Answer identifier-style queries from the keyword index alone when it has matches
+LEXICAL_SKIPS_EMBEDDING = os.getenv("LEXICAL_SKIPS_EMBEDDING", "true").lower() == "true"
+
+
+def collection_exists(namespace: str) -> bool:
+    """
+    Check whether the vector store has a collection for the given namespace
+    (and the namespace has a lexical index, so both hold the same files)
+    """
+    vector_store = get_vector_store()
+    if not vector_store.available:
+        return False
+    try:
+        return vector_store.namespace_exists(namespace) and lexical_index.exists(namespace)
+    except Exception as e:
+        print(f"Error checking collection: {e}")
+        return False
 
 
 def ensure_collection_exists(namespace: str):
     """
-    Ensure the Weaviate collection exists for the given namespace (repository)
+    Ensure the vector store collection exists for the given namespace (repository)
     """
-    if not weaviate_available or client is None:
-        print("Weaviate not available, skipping collection creation")
+    vector_store = get_vector_store()
+    if not vector_store.available:
+        print("Vector store not available, skipping collection creation")
         return False
     
     try:
-        # Sanitize namespace to create valid Weaviate collection name
-        # Remove all special characters: :, ., -, /
-        sanitized = namespace.replace(':', '_').replace('.', '_').replace('-', '_').replace('/', '_')
-        collection_name = f"CodeDoc_{sanitized}"
-        
-        # Check if collection exists
-        if client.collections.exists(collection_name):
-            print(f"Collection {collection_name} already exists")
-            return True
-        
-        # Create collection with proper schema
-        client.collections.create(
-            name=collection_name,
-            properties=[
-                Property(name="source", data_type=DataType.TEXT),
-                Property(name="content", data_type=DataType.TEXT),
-                Property(name="summary", data_type=DataType.TEXT),
-            ],
-            # Configure vectorizer to use custom embeddings
-            vectorizer_config=Configure.Vectorizer.none(),
-        )
-        print(f"Created collection: {collection_name}")
-        return True
+        return vector_store.ensure_namespace(namespace)
     except Exception as e:
         print(f"Error creating collection: {e}")
         return False
 
 
-async def store_embeddings(documents: list, namespace: str):
+async def store_embeddings(
+    documents: list,
+    namespace: str,
+    removed_sources: Optional[list] = None,
+    keep_sources: Optional[list] = None,
+):
     """
-    Store document embeddings in Weaviate
-    documents: list of documents with metadata including 'source', 'content', 'summary', and 'embedding'
+    Store document embeddings in the vector store
+    documents: list of documents (file chunks) with metadata including 'source', 'content',
+        'summary', 'embedding' and the chunk's 'chunk', 'start_line' and 'end_line'.
+        They replace every previously stored chunk of their sources.
     namespace: repository identifier
+    removed_sources: sources that no longer exist in the repository and should be deleted
+    keep_sources: when given, every object not belonging to these sources is deleted
+        (used when there is no previous index state to diff against)
+
+    Only the files being written are replaced, so the collection is never
+    emptied while a re-index is running. The lexical index is updated the same
+    way, even when the vector store is unavailable. Writes to one namespace are
+    serialized (a replace is a delete followed by an insert).
     """
-    if not weaviate_available or client is None:
-        print("Weaviate not available, skipping embedding storage")
+    async with namespace_write_locks.hold(namespace):
+        return await _store_embeddings(documents, namespace, removed_sources, keep_sources)
+
+
+async def _store_embeddings(
+    documents: list, namespace: str, removed_sources: Optional[list], keep_sources: Optional[list]
+) -> bool:
+    try:
+        if documents:
+            await run_blocking(lexical_index.replace, namespace, documents)
+        if removed_sources:
+            await run_blocking(lexical_index.delete_sources, namespace, removed_sources)
+        if keep_sources is not None:
+            await run_blocking(lexical_index.prune, namespace, set(keep_sources))
+    except Exception as e:
+        print(f"Error updating lexical index: {e}")
+
+    vector_store = await get_vector_store_async()
+    if not vector_store.available:
+        print("Vector store not available, skipping embedding storage")
         return False
     
     try:
-        # Sanitize namespace to create valid Weaviate collection name
-        sanitized = namespace.replace(':', '_').replace('.', '_').replace('-', '_').replace('/', '_')
-        collection_name = f"CodeDoc_{sanitized}"
-        collection = client.collections.get(collection_name)
+        if documents:
+            with timed("vector_store_write"):
+                if not await run_blocking(vector_store.replace, namespace, documents):
+                    return False
         
-        # Delete existing documents for this namespace (fresh start)
-        try:
-            collection.data.delete_many(where=None)
-            print(f"Cleared existing documents from {collection_name}")
-        except Exception as e:
-            print(f"Note: Could not clear collection (might be empty): {e}")
+        if removed_sources:
+            await run_blocking(vector_store.delete_sources, namespace, removed_sources)
+            print(f"Deleted {len(removed_sources)} removed files from {namespace}")
         
-        # Batch insert documents
-        with collection.batch.dynamic() as batch:
-            for doc in documents:
-                batch.add_object(
-                    properties={
-                        "source": doc.get("source", ""),
-                        "content": doc.get("content", "")[:10000],  # Limit content size
-                        "summary": doc.get("summary", ""),
-                    },
-                    vector=doc.get("embedding", [])
-                )
+        if keep_sources is not None:
+            pruned = await run_blocking(
+                vector_store.prune, namespace, set(keep_sources)
+            )
+            if pruned:
+                print(f"Pruned {pruned} stale documents from {namespace}")
         
-        print(f"Stored {len(documents)} documents in Weaviate")
+        log_event("stored", logging.DEBUG, namespace=namespace, documents=len(documents), store=vector_store.name)
         return True
     except Exception as e:
         print(f"Error storing embeddings: {e}")
         return False
 
 
-async def retrieve_relevant_docs(query: str, namespace: str, limit: int = 5):
+async def retrieve_relevant_docs(
+    query: str, namespace: str, limit: int = 5, include_vectors: bool = False
+):
     """
-    Retrieve relevant documents from Weaviate using vector similarity search
+    Retrieve relevant documents with hybrid search: BM25 keyword results from
+    the local lexical index fused (reciprocal rank fusion) with vector similarity results.
+    Queries naming code (identifiers, file names) that have keyword matches skip the
+    embedding API; when embeddings are unavailable the keyword results are used alone.
+    include_vectors: also return each document's 'embedding' (used for re-ranking)
     """
-    if not weaviate_available or client is None:
-        print("Weaviate not available, cannot retrieve documents")
-        return []
+    with timed("retrieval"):
+        return await _retrieve_relevant_docs(query, namespace, limit, include_vectors)
+
+
+async def _retrieve_relevant_docs(query: str, namespace: str, limit: int, include_vectors: bool):
+    try:
+        with timed("lexical_search"):
+            lexical_docs = await run_blocking(lexical_index.search, namespace, query, limit)
+    except Exception as e:
+        print(f"Error searching lexical index: {e}")
+        lexical_docs = []
+
+    if lexical_docs and LEXICAL_SKIPS_EMBEDDING and looks_lexical(query):
+        log_event("retrieved", namespace=namespace, keyword=len(lexical_docs), vector=0, embedding_skipped=True)
+        return lexical_docs
+
+    vector_store = await get_vector_store_async()
+    if not vector_store.available:
+        print(f"Vector store not available, retrieved {len(lexical_docs)} documents by keyword")
+        return lexical_docs
     
     try:
-        # Sanitize namespace to create valid Weaviate collection name
-        sanitized = namespace.replace(':', '_').replace('.', '_').replace('-', '_').replace('/', '_')
-        collection_name = f"CodeDoc_{sanitized}"
-        
         # Check if collection exists
-        if not client.collections.exists(collection_name):
-            print(f"Collection {collection_name} does not exist")
-            return []
+        if not await run_blocking(vector_store.namespace_exists, namespace):
+            print(f"Collection for {namespace} does not exist")
+            return lexical_docs
         
         # Get query embedding - this may raise QUOTA_EXCEEDED
-        query_embedding = await getEmbeddings(query)
+        query_embedding = await getQueryEmbedding(query)
         
         # Search for similar documents
-        collection = client.collections.get(collection_name)
-        results = collection.query.near_vector(
-            near_vector=query_embedding,
-            limit=limit,
-            return_properties=["source", "content", "summary"]
-        )
-        
-        # Extract documents
-        docs = []
-        for item in results.objects:
-            docs.append({
-                "source": item.properties.get("source", ""),
-                "content": item.properties.get("content", ""),
-                "summary": item.properties.get("summary", ""),
-            })
-        
-        print(f"Retrieved {len(docs)} relevant documents")
-        return docs
+        with timed("vector_search"):
+            vector_docs = await run_blocking(
+                vector_store.search, namespace, query_embedding, limit, include_vectors
+            )
     except Exception as e:
         if "QUOTA_EXCEEDED" in str(e):
+            if lexical_docs:
+                print(f"Embedding quota exceeded, retrieved {len(lexical_docs)} documents by keyword")
+                return lexical_docs
             # Re-raise quota errors so ask() can handle them
             raise
         print(f"Error retrieving documents: {e}")
-        return []
+        return lexical_docs
 
+    docs = reciprocal_rank_fusion([vector_docs, lexical_docs], limit)
+    log_event("retrieved", namespace=namespace, keyword=len(lexical_docs), vector=len(vector_docs), fused=len(docs))
+    return docs
 
-async def getEmbeddings(text: str) -> List[float]:
+
+async def _embed_batch(texts: List[str]) -> List[List[float]]:
     """
-    Get embeddings for the given text using Gemini's embedding model
+    Embed a batch of texts with a single Gemini request
     """
-    try:
-        # Use Gemini's most basic embedding model (text-embedding-004)
-        # Clean the text
-        cleaned_text = text.replace("\n", " ").strip()
-        
-        # Generate embeddings using the basic model
-        result = await asyncio.to_thread(
-            genai.embed_content,
-            model="models/text-embedding-004",
-            content=cleaned_text,
-            task_type="retrieval_document"
+    tokens = sum(estimate_tokens(text) for text in texts)
+    genai = await get_genai()
+    with timed("embedding"):
+        result = await embedding_limiter.run(
+            lambda: genai.embed_content_async(
+                model=EMBEDDING_MODEL,
+                content=texts,
+                task_type="retrieval_document"
+            ),
+            estimated_tokens=tokens,
         )
-        
-        return result['embedding']
+    record_tokens("gemini_embedding", sent=tokens)
+    return result['embedding']
+
+
+# Batches embedding requests (up to 100 texts per call), merges identical texts
+# already in flight and limits the number of concurrent batch requests
+embedding_batcher = EmbeddingBatcher(
+    _embed_batch,
+    max_batch_size=100,
+    max_concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", "4")),
+)
+
+
+async def getEmbeddingsBatch(texts: List[str]) -> List[List[float]]:
+    """
+    Get embeddings for many texts at once using Gemini's batch embedding API
+    """
+    try:
+        # Clean the texts
+        cleaned_texts = [text.replace("\n", " ").strip() for text in texts]
+        return await embedding_batcher.embed(cleaned_texts)
     except Exception as e:
         error_str = str(e)
         if "quota" in error_str.lower() or "429" in error_str:
@@ -196,30 +282,86 @@ async def getEmbeddings(text: str) -> List[float]:
             raise Exception("QUOTA_EXCEEDED") from e
         else:
             print(f"Error getting embeddings: {e}")
-            # Return a default embedding vector for other errors
-            return [0.0] * 768  # Standard embedding dimension
+            # Return default embedding vectors for other errors
+            return [[0.0] * EMBEDDING_DIMENSION for _ in texts]
+
+
+async def getEmbeddings(text: str) -> List[float]:
+    """
+    Get embeddings for the given text using Gemini's embedding model
+    Concurrent calls are coalesced into batch requests
+    """
+    embeddings = await getEmbeddingsBatch([text])
+    return embeddings[0]
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+
+async def getQueryEmbedding(query: str) -> List[float]:
+    """
+    Get the embedding of a search query, served from the query embedding cache when possible
+    """
+    query = _normalize_query(query)
+    key = (EMBEDDING_MODEL, query.casefold())
+    embedding = query_embedding_cache.get(key)
+    record_cache("query_embedding", embedding is not None)
+    if embedding is None:
+        embedding = await getEmbeddings(query)
+        # Don't cache the placeholder vector returned on errors
+        if any(embedding):
+            query_embedding_cache.set(key, embedding)
+    return embedding
+
+
+async def warm_query_embeddings(queries: List[str]):
+    """
+    Precompute the embeddings of frequent queries (sent as a single batch request)
+    """
+    queries = [_normalize_query(query) for query in queries]
+    missing = [query for query in queries if (EMBEDDING_MODEL, query.casefold()) not in query_embedding_cache]
+    if not missing:
+        return
+    try:
+        embeddings = await getEmbeddingsBatch(missing)
+    except Exception as e:
+        print(f"Could not precompute query embeddings: {e}")
+        return
+    for query, embedding in zip(missing, embeddings):
+        if any(embedding):
+            query_embedding_cache.set((EMBEDDING_MODEL, query.casefold()), embedding)
+    print(f"Precomputed embeddings for {len(missing)} frequent queries")
 
 
-async def getSummary(source: str, code: str) -> str:
+async def getSummary(
+    source: str, code: str, blob_sha: Optional[str] = None, outline: Optional[str] = None
+) -> str:
     """
     Generate a summary of the code file using Groq (for documentation)
-    Uses semaphore to prevent rate limiting
+    Requests are paced by the shared Groq rate limiter
+    Summaries are cached on disk by content, so unchanged files never hit Groq again
+    outline: functions/classes of the file with line ranges; for files over the
+        prompt limit it describes the part of the file that is cut off
     """
-    print("getting summary for", source)
-    if len(code) > 10000:
+    truncated = len(code) > 10000
+    outline = outline if truncated else None
+    prompt_version = SUMMARY_PROMPT_VERSION + ("+outline" if outline else "")
+    key = cache_key(blob_sha or git_blob_sha(code), SUMMARY_MODEL, prompt_version)
+    cached = await run_blocking(summary_cache.get, key)
+    record_cache("summary", cached is not None)
+    if cached is not None:
+        return cached
+
+    if truncated:
         code = code[:10000]
     
-    max_retries = 3
-    retry_delay = 1
-    
-    for attempt in range(max_retries):
-        try:
-            if not groq_available or groq_client is None:
-                raise Exception("Groq not available")
-            
-            # Use semaphore to limit concurrent requests
-            async with groq_semaphore:
-                prompt = f"""You are an intelligent senior software engineer who specialise in onboarding junior software engineers onto projects.
+    try:
+        groq_client = await get_groq()
+        if groq_client is None:
+            raise Exception("Groq not available")
+        
+        prompt = f"""You are an intelligent senior software engineer who specialise in onboarding junior software engineers onto projects.
 
 You are onboarding a junior software engineer and explaining to them the purpose of the {source} file
 here is the code:
@@ -227,64 +369,93 @@ here is the code:
 {code}
 ---
 give a summary no more than 100 words of the code above"""
-
-                response = await asyncio.to_thread(
-                    groq_client.chat.completions.create,
-                    model="llama-3.1-8b-instant",  # Lighter, faster model
+        if outline:
+            prompt += f"""
+The file is longer than the excerpt above; the rest of it contains:
+{outline}"""
+
+        max_tokens = 150
+        with timed("summary"):
+            response = await groq_limiter.run(
+                lambda: groq_client.chat.completions.create(
+                    model=SUMMARY_MODEL,  # Lighter, faster model
                     messages=[{"role": "user", "content": prompt}],
                     temperature=0.3,
-                    max_tokens=150
-                )
-                
-                print("got back summary from Groq", source)
-                return response.choices[0].message.content
-            
-        except Exception as e:
-            error_str = str(e)
-            if "rate_limit" in error_str.lower() or "429" in error_str:
-                if attempt < max_retries - 1:
-                    # Try to extract wait time from error message
-                    # Error format: "Please try again in 18.24s"
-                    import re
-                    match = re.search(r'try again in ([\d.]+)s', error_str)
-                    if match:
-                        wait_time = float(match.group(1)) + 1  # Add 1s buffer
-                    else:
-                        wait_time = retry_delay * (2 ** attempt)
-                    
-                    print(f"⚠️ Rate limit for {source}, retrying in {wait_time:.1f}s...")
-                    await asyncio.sleep(wait_time)
-                    continue
-            print(f"Error getting summary for {source}: {e}")
-            return f"Unable to generate summary for {source}"
-    
-    return f"Unable to generate summary for {source}"
+                    max_tokens=max_tokens
+                ),
+                estimated_tokens=estimate_tokens(prompt) + max_tokens,
+                usage=_groq_usage,
+            )
+        
+        summary = response.choices[0].message.content
+        await run_blocking(summary_cache.set, key, summary)
+        return summary
+    except Exception as e:
+        print(f"Error getting summary for {source}: {e}")
+        return f"Unable to generate summary for {source}"
+
+
+def _build_prompt(query: str, context: str) -> str:
+    return f"""You are Dionysus, an intelligent AI assistant specialized in helping developers understand codebases.
+
+You have access to a specific codebase and should answer questions based on the actual code context provided below.
+
+{context}
+
+User Question: {query}
+
+Instructions:
+- Answer the question based on the code context provided above
+- If the context contains relevant information, use it to provide specific, accurate answers
+- Include file names and code snippets when relevant
+- Format your response in HTML with proper tags for readability
+- If you cannot find relevant information in the context, say so honestly and provide general guidance
+- Be helpful, clear, and concise
+
+Answer:"""
 
 
+GEMINI_ANSWER_MODEL = "gemini-2.5-flash"
+GROQ_ANSWER_MODEL = "llama-3.1-8b-instant"  # Lighter model for Q/A
+GROQ_ANSWER_MAX_TOKENS = 2000
+# Output tokens a Gemini answer is expected to use (no max is set), charged to the limiter up front
+GEMINI_OUTPUT_TOKENS = int(os.getenv("GEMINI_OUTPUT_TOKENS", "1000"))
+
+GROQ_BANNER = """<div style="padding: 10px; background-color: #e8f5e9; border-left: 4px solid #4caf50; margin-bottom: 15px;">
+<small>ℹ️ <strong>Powered by Groq</strong> - Gemini quota exceeded, using Groq as failsafe</small>
+</div>
+
+"""
+
 
-async def ask(query: str, namespace: str) -> str:
+async def _ask_context(query: str, namespace: str):
     """
-    Answer questions about the codebase using Gemini (with Groq failsafe)
+    Retrieve the context for a question. Returns (documents, query embedding, note):
+    the documents are packed per model; when there are none, note is the
+    context to use instead.
     """
+    # Over-fetch candidates from the vector store; they are re-ranked when packed
+    relevant_docs = []
+    query_embedding = None
+    quota_exceeded = False
     try:
-        print(f"Asking: {query} for namespace: {namespace}")
-        
-        # Try to retrieve relevant documents from Weaviate
-        relevant_docs = []
-        quota_exceeded = False
-        try:
-            relevant_docs = await retrieve_relevant_docs(query, namespace, limit=5)
-        except Exception as retrieval_error:
-            if "QUOTA_EXCEEDED" in str(retrieval_error):
-                print("⚠️ Embedding quota exceeded, proceeding without context")
-                quota_exceeded = True
-            else:
-                raise  # Re-raise other errors
-        
-        # Build context from retrieved documents
-        context = ""
-        if quota_exceeded:
-            context = """⚠️ Note: The Gemini API embedding quota has been exceeded. I cannot retrieve specific code context at this moment, but I'll provide a general answer.
+        relevant_docs = await retrieve_relevant_docs(
+            query, namespace, limit=CONTEXT_CANDIDATES, include_vectors=True
+        )
+        # Only needed for re-ranking vector results; it is cached by retrieval
+        if any(doc.get("embedding") for doc in relevant_docs):
+            query_embedding = await getQueryEmbedding(query)
+    except Exception as retrieval_error:
+        if "QUOTA_EXCEEDED" in str(retrieval_error):
+            print("⚠️ Embedding quota exceeded, proceeding without context")
+            quota_exceeded = True
+        else:
+            raise  # Re-raise other errors
+    
+    # Build context from retrieved documents
+    context = ""
+    if quota_exceeded:
+        context = """⚠️ Note: The Gemini API embedding quota has been exceeded. I cannot retrieve specific code context at this moment, but I'll provide a general answer.
 
 To restore full functionality:
 - Wait for the quota to reset (typically per minute/hour/day limits)
@@ -294,94 +465,60 @@ To restore full functionality:
 For now, I'll provide a general answer based on common software development practices.
 
 """
-        elif relevant_docs:
-            context = "Here is relevant code context from the repository:\\n\\n"
-            for i, doc in enumerate(relevant_docs, 1):
-                context += f"--- File: {doc['source']} ---\\n"
-                context += f"Summary: {doc['summary']}\\n"
-                context += f"Content:\\n{doc['content'][:2000]}\\n\\n"  # Limit content to avoid token limits
-        else:
-            if not weaviate_available:
-                context = """Note: The vector database (Weaviate) is currently not available. This might be due to:
+    elif relevant_docs:
+        context = None
+    else:
+        if not get_vector_store().available:
+            context = """Note: The vector database (Weaviate) is currently not available. This might be due to:
 - Network connectivity issues
 - Incorrect Weaviate cluster URL
 - Missing or invalid WEAVIATE_API_KEY
 
 To enable full context-aware Q&A functionality, please:
-1. Verify your Weaviate cluster URL in _gemini.py
+1. Verify WEAVIATE_URL in the .env file (or set VECTOR_STORE=local to use the embedded store)
 2. Check your WEAVIATE_API_KEY in the .env file
 3. Ensure you have network access to the Weaviate cloud instance
 
 For now, I'll provide a general answer based on common software development practices.
 
 """
-            else:
-                context = "Note: No specific code context was found in the vector database. The repository might not have been indexed yet.\\n\\n"
-        
-        prompt = f"""You are Dionysus, an intelligent AI assistant specialized in helping developers understand codebases.
-
-You have access to a specific codebase and should answer questions based on the actual code context provided below.
+        else:
+            context = "Note: No specific code context was found in the vector database. The repository might not have been indexed yet.\\n\\n"
+    return relevant_docs, query_embedding, context
 
-{context}
 
-User Question: {query}
+def _ask_prompt(query: str, retrieved, model: str, context_stats: dict) -> str:
+    """
+    Prompt for the given answering model ("gemini" or "groq"), with the
+    retrieved documents packed into the model's context budget
+    """
+    relevant_docs, query_embedding, context = retrieved
+    if context is not None:
+        return _build_prompt(query, context)
+    packed, stats = pack_context(relevant_docs, query_embedding, CONTEXT_BUDGETS[model])
+    context_stats.clear()
+    context_stats.update(stats, model=model)
+    log_event("context_packed", **context_stats)
+    return _build_prompt(query, packed)
 
-Instructions:
-- Answer the question based on the code context provided above
-- If the context contains relevant information, use it to provide specific, accurate answers
-- Include file names and code snippets when relevant
-- Format your response in HTML with proper tags for readability
-- If you cannot find relevant information in the context, say so honestly and provide general guidance
-- Be helpful, clear, and concise
 
-Answer:"""
+def _is_quota_error(error: Exception) -> bool:
+    error_str = str(error)
+    return "quota" in error_str.lower() or "429" in error_str
 
-        # Try Gemini first
-        try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = await asyncio.to_thread(
-                model.generate_content,
-                prompt
-            )
-            print("Got back answer from Gemini")
-            return response.text
-        except Exception as gemini_error:
-            error_str = str(gemini_error)
-            # If quota exceeded, fallback to Groq
-            if "quota" in error_str.lower() or "429" in error_str:
-                print("⚠️ Gemini quota exceeded, falling back to Groq")
-                if groq_available and groq_client is not None:
-                    # Use semaphore to prevent rate limiting on Groq failsafe
-                    async with groq_semaphore:
-                        response = await asyncio.to_thread(
-                            groq_client.chat.completions.create,
-                            model="llama-3.1-8b-instant",  # Lighter model for Q/A
-                            messages=[{"role": "user", "content": prompt}],
-                            temperature=0.5,
-                            max_tokens=2000
-                        )
-                    print("Got back answer from Groq (failsafe)")
-                    # Add a note that Groq was used
-                    groq_answer = response.choices[0].message.content
-                    return f"""<div style="padding: 10px; background-color: #e8f5e9; border-left: 4px solid #4caf50; margin-bottom: 15px;">
-<small>ℹ️ <strong>Powered by Groq</strong> - Gemini quota exceeded, using Groq as failsafe</small>
-</div>
 
-{groq_answer}"""
-                else:
-                    raise  # Re-raise if Groq not available
-            else:
-                raise  # Re-raise non-quota errors
-                
-    except Exception as e:
-        error_str = str(e)
-        print(f"Error answering query: {e}")
-        import traceback
-        traceback.print_exc()
-        
-        # Provide more specific error messages
-        if "quota" in error_str.lower() or "429" in error_str:
-            return """<div style="padding: 20px; background-color: #fff3cd; border-left: 4px solid #ffc107;">
+def _error_answer(e: Exception) -> str:
+    """
+    Answer shown to the user when a question could not be answered
+    """
+    error_str = str(e)
+    print(f"Error answering query: {e}")
+    import traceback
+    traceback.print_exc()
+    
+    # Provide more specific error messages
+    if "quota" in error_str.lower() or "429" in error_str:
+        return """<div style="padding: 20px; background-color: #fff3cd; border-left: 4px solid #ffc107;">
 <h3>⚠️ API Quota Exceeded</h3>
 <p>I'm currently unable to process your question because the Gemini API quota has been exceeded.</p>
 <p><strong>What this means:</strong> The free tier of Gemini API has limits on requests per minute/hour/day.</p>
@@ -392,21 +529,173 @@ Answer:"""
 <li>Consider upgrading your API plan for higher quotas</li>
 </ul>
 </div>"""
-        elif "api" in error_str.lower() and "key" in error_str.lower():
-            return """<div style="padding: 20px; background-color: #f8d7da; border-left: 4px solid #dc3545;">
+    elif "api" in error_str.lower() and "key" in error_str.lower():
+        return """<div style="padding: 20px; background-color: #f8d7da; border-left: 4px solid #dc3545;">
 <h3>❌ API Key Error</h3>
 <p>There seems to be an issue with the Gemini API key. Please check that your GEMINI_API_KEY is correctly set in the .env file.</p>
 </div>"""
-        else:
-            return "I'm sorry, but I encountered an error while processing your question. Please try again or contact support if the issue persists."
+    else:
+        return "I'm sorry, but I encountered an error while processing your question. Please try again or contact support if the issue persists."
+
+
+async def ask(query: str, namespace: str, context_stats: Optional[dict] = None) -> str:
+    """
+    Answer questions about the codebase using Gemini (with Groq failsafe)
+    Retrieved code is packed into a per-model token budget (CONTEXT_BUDGETS)
+    context_stats: when given, filled with the packing stats of the answering
+        model (tokens used, documents used, duplicates dropped)
+    Identical questions about the same namespace asked while one is being
+    answered share its answer.
+    """
+    async def answer():
+        stats = {}
+        return await _answer(query, namespace, stats), stats
+
+    key = (namespace, _normalize_query(query).casefold())
+    text, stats = await ask_flights.do(key, answer)
+    if context_stats is not None:
+        context_stats.update(stats)
+    return text
+
+
+async def _answer(query: str, namespace: str, context_stats: dict) -> str:
+    try:
+        log_event("ask", namespace=namespace, query=query)
+        retrieved = await _ask_context(query, namespace)
+
+        # Try Gemini first
+        try:
+            prompt = _ask_prompt(query, retrieved, "gemini", context_stats)
+            model = (await get_genai()).GenerativeModel(GEMINI_ANSWER_MODEL)
+            # No retries: on quota errors fall back to Groq straight away
+            with timed("generation_gemini"):
+                response = await gemini_limiter.run(
+                    lambda: model.generate_content_async(prompt),
+                    estimated_tokens=estimate_tokens(prompt) + GEMINI_OUTPUT_TOKENS,
+                    max_retries=1,
+                    usage=_gemini_usage,
+                )
+            return response.text
+        except Exception as gemini_error:
+            # If quota exceeded, fallback to Groq
+            if not _is_quota_error(gemini_error):
+                raise  # Re-raise non-quota errors
+            print("⚠️ Gemini quota exceeded, falling back to Groq")
+            groq_client = await get_groq()
+            if groq_client is None:
+                raise  # Re-raise if Groq not available
+            # Use the shared limiter to prevent rate limiting on Groq failsafe
+            prompt = _ask_prompt(query, retrieved, "groq", context_stats)
+            with timed("generation_groq"):
+                response = await groq_limiter.run(
+                    lambda: groq_client.chat.completions.create(
+                        model=GROQ_ANSWER_MODEL,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.5,
+                        max_tokens=GROQ_ANSWER_MAX_TOKENS
+                    ),
+                    estimated_tokens=estimate_tokens(prompt) + GROQ_ANSWER_MAX_TOKENS,
+                    usage=_groq_usage,
+                )
+            # Add a note that Groq was used
+            return GROQ_BANNER + response.choices[0].message.content
+                
+    except Exception as e:
+        return _error_answer(e)
+
 
+async def ask_stream(
+    query: str, namespace: str, context_stats: Optional[dict] = None
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of ask(): yields the answer in pieces as they are generated.
+    The Groq failsafe streams too, after the "Powered by Groq" banner.
+    context_stats: filled like in ask(), plus the answering 'provider'
+    """
+    if context_stats is None:
+        context_stats = {}
+    started = False
+    try:
+        log_event("ask", namespace=namespace, query=query, stream=True)
+        retrieved = await _ask_context(query, namespace)
 
-def summarise_commit(diff: str) -> str:
+        try:
+            prompt = _ask_prompt(query, retrieved, "gemini", context_stats)
+            model = (await get_genai()).GenerativeModel(GEMINI_ANSWER_MODEL)
+            # The stream is opened under the limiter, so a 429 surfaces here
+            chunks = await gemini_limiter.run(
+                lambda: model.generate_content_async(prompt, stream=True),
+                estimated_tokens=estimate_tokens(prompt) + GEMINI_OUTPUT_TOKENS,
+                max_retries=1,
+            )
+            context_stats["provider"] = "gemini"
+            received = 0
+            with timed("generation_gemini_stream"):
+                async for chunk in chunks:
+                    text = _gemini_chunk_text(chunk)
+                    if text:
+                        started = True
+                        received += len(text)
+                        yield text
+            # Streamed responses carry no usage; record estimates
+            record_tokens("gemini", estimate_tokens(prompt), received // 4)
+            return
+        except Exception as gemini_error:
+            # Only fall back before any of the answer has been sent
+            if started or not _is_quota_error(gemini_error):
+                raise
+            print("⚠️ Gemini quota exceeded, falling back to Groq (streaming)")
+            groq_client = await get_groq()
+            if groq_client is None:
+                raise
+
+        prompt = _ask_prompt(query, retrieved, "groq", context_stats)
+        chunks = await groq_limiter.run(
+            lambda: groq_client.chat.completions.create(
+                model=GROQ_ANSWER_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.5,
+                max_tokens=GROQ_ANSWER_MAX_TOKENS,
+                stream=True,
+            ),
+            estimated_tokens=estimate_tokens(prompt) + GROQ_ANSWER_MAX_TOKENS,
+        )
+        context_stats["provider"] = "groq"
+        started = True
+        received = 0
+        try:
+            yield GROQ_BANNER
+            with timed("generation_groq_stream"):
+                async for chunk in chunks:
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        received += len(text)
+                        yield text
+        finally:
+            # Give the pooled connection back even if the consumer went away mid-answer
+            await chunks.close()
+        record_tokens("groq", estimate_tokens(prompt), received // 4)
+    except Exception as e:
+        if started:
+            raise
+        yield _error_answer(e)
+
+
+def _gemini_chunk_text(chunk) -> str:
+    # .text raises for chunks without text parts (e.g. the final safety chunk)
+    try:
+        return chunk.text
+    except (ValueError, AttributeError):
+        return ""
+
+
+async def summarise_commit(diff: str) -> str:
     """
     Summarize a git commit diff using Groq (for documentation)
     """
     try:
-        if not groq_available or groq_client is None:
+        groq_client = await get_groq()
+        if groq_client is None:
             raise Exception("Groq not available")
         
         prompt = f"""You are an expert programmer, and you are trying to summarize a git diff.
@@ -443,13 +732,59 @@ Please summarise the following diff file:
 
 {diff}"""
 
-        response = groq_client.chat.completions.create(
-            model="llama-3.1-8b-instant",  # Lighter model
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-            max_tokens=500
+        max_tokens = 500
+        response = await groq_limiter.run(
+            lambda: groq_client.chat.completions.create(
+                model=COMMIT_SUMMARY_MODEL,  # Lighter model
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                max_tokens=max_tokens
+            ),
+            estimated_tokens=estimate_tokens(prompt) + max_tokens,
+            usage=_groq_usage,
         )
         return response.choices[0].message.content
     except Exception as e:
         print(f"Error summarizing commit: {e}")
-        return "Unable to summarize commit changes"
\ No newline at end of file
+        return "Unable to summarize commit changes"
+
+
+async def combine_commit_summaries(summaries: List[str]) -> str:
+    """
+    Merge the summaries of the parts of a large commit diff into one summary using Groq
+    """
+    try:
+        groq_client = await get_groq()
+        if groq_client is None:
+            raise Exception("Groq not available")
+
+        parts = "\n\n".join(summaries)
+        prompt = f"""You are an expert programmer. The diff of one git commit was too large to summarize at once,
+so it was split into parts and each part was summarized as a list of comments, one change per line,
+with the affected files in square brackets.
+
+Merge the part summaries below into a single summary of the whole commit in the same format:
+- Combine comments that describe the same change and list all of their files
+- Keep the most important changes first
+- Write at most 10 comments
+
+Part summaries:
+
+{parts}"""
+
+        max_tokens = 500
+        response = await groq_limiter.run(
+            lambda: groq_client.chat.completions.create(
+                model=COMMIT_SUMMARY_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                max_tokens=max_tokens
+            ),
+            estimated_tokens=estimate_tokens(prompt) + max_tokens,
+            usage=_groq_usage,
+        )
+        return response.choices[0].message.content
+    except Exception as e:
+        # The part summaries are still a usable answer
+        print(f"Error combining commit summaries: {e}")
+        return "\n".join(summaries)
\ No newline at end of file
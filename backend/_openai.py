@@ -1,21 +1,30 @@
-from dotenv import load_dotenv
 import os
-import openai
-import weaviate
+from clients import registry, load_env
 
-load_dotenv()
+load_env()
 
-weaviate.init(
-    api_key=os.getenv("WEAVIATE_API_KEY"),
-    environment="asia-southeast1-gcp-free",
-)
-index = weaviate.Index("chatpdf")
 
+def _openai():
+    import openai
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+
+def _index():
+    import weaviate
+    weaviate.init(
+        api_key=os.getenv("WEAVIATE_API_KEY"),
+        environment="asia-southeast1-gcp-free",
+    )
+    return weaviate.Index("chatpdf")
+
+
+registry.register("openai", _openai)
+registry.register("openai_index", _index)
 
 
 async def getEmbeddings(text):
+    openai = await registry.aget("openai")
     response = await openai.Embedding.acreate(
         input=text.replace("\n", ""), model="text-embedding-ada-002"
     )
@@ -25,6 +34,7 @@ async def getEmbeddings(text):
 
 async def getSummary(source, code):
     print("getting summary for", source)
+    openai = await registry.aget("openai")
     if len(code) > 10000:
         code = code[:10000]
     response = await openai.ChatCompletion.acreate(
@@ -53,6 +63,8 @@ async def getSummary(source, code):
 
 async def ask(query, namespace):
     query_vector = await getEmbeddings("what is this project about?")
+    index = await registry.aget("openai_index")
+    openai = await registry.aget("openai")
     query_response = index.query(
         namespace=namespace,
         top_k=10,
@@ -96,6 +108,7 @@ async def ask(query, namespace):
 
 
 def summarise_commit(diff):
+    openai = registry.get("openai")
     response = openai.ChatCompletion.create(
         model="gpt-3.5-turbo-16k",
         messages=[
@@ -1,98 +1,299 @@
-# Start by making sure the `assemblyai` package is installed.
-from dotenv import load_dotenv
+import asyncio
+import hashlib
+import json
 import os
+import re
+import time
+from typing import List, Optional
+from _gemini import (
+    GEMINI_OUTPUT_TOKENS, getEmbeddingsBatch, getQueryEmbedding, get_genai, gemini_limiter, _gemini_usage,
+    _gemini_chunk_text,
+)
+from rate_limiter import estimate_tokens
+from summary_cache import CACHE_DIR, SummaryCache, cache_key
+from vector_store import LocalVectorStore
+from transcripts import MEETING_SEGMENT_CHARS, MEETING_SEGMENT_SECONDS, get_transcriber, segment_transcript
+from single_flight import SingleFlight
+from clients import run_blocking
+from metrics import timed, record_cache, log_event
 
-load_dotenv()
-import google.generativeai as genai
-from _gemini import getEmbeddings
+# Chapters (summarized and embedded in parallel) cover this many seconds of a meeting
+MEETING_CHAPTER_SECONDS = int(os.getenv("MEETING_CHAPTER_SECONDS", "600"))
+# Chapters processed at the same time
+MEETING_CONCURRENCY = int(os.getenv("MEETING_CONCURRENCY", "4"))
+# Transcript segments sent with a meeting question
+MEETING_TOP_K = int(os.getenv("MEETING_TOP_K", "6"))
+# Per-meeting vector indexes of transcript segments
+MEETING_INDEX_DIR = os.getenv("MEETING_INDEX_DIR", os.path.join(CACHE_DIR, "meetings"))
+# Bump whenever segmenting or chapter summaries change so cached meetings are processed again
+MEETING_PIPELINE_VERSION = "v1"
+MEETING_MODEL = "gemini-flash-latest"
 
-load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# Processed meetings (segments and chapters) keyed by URL hash and pipeline settings
+meeting_cache = SummaryCache(table="meetings")
+# Raw transcripts, stored as soon as they arrive: a recording is only ever paid
+# for once, even when indexing it fails and is retried
+transcript_cache = SummaryCache(table="meeting_transcripts")
+meeting_index = LocalVectorStore(MEETING_INDEX_DIR)
+# A meeting is transcribed and indexed once, however many requests arrive for it
+meeting_flights = SingleFlight("meeting")
 
 
-def serialise_url(url):
-    return url.replace("/", "_")
+def meeting_id(url: str) -> str:
+    """
+    Key of a meeting's cache entry and vector index: a hash of its URL
+    """
+    return hashlib.sha256(url.strip().encode("utf-8")).hexdigest()[:32]
 
 
-# If not, you can install it by running the following command:
-# pip install -U assemblyai
-#
-# Note: Some macOS users may need to use `pip3` instead of `pip`.
 def ms_to_time(ms):
-    seconds = ms / 1000
-    minutes = seconds / 60
-    seconds = seconds % 60
-    minutes = minutes % 60
+    seconds = int(ms // 1000)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
     # format time
+    if hours:
+        return "%d:%02d:%02d" % (hours, minutes, seconds)
     return "%02d:%02d" % (minutes, seconds)
 
 
-import assemblyai as aai
+def _chapters(segments: List[dict]) -> List[List[dict]]:
+    """
+    Split the segments into consecutive chapters of about MEETING_CHAPTER_SECONDS
+    """
+    chapters = []
+    for segment in segments:
+        if not chapters or segment["end_ms"] - chapters[-1][0]["start_ms"] > MEETING_CHAPTER_SECONDS * 1000:
+            chapters.append([])
+        chapters[-1].append(segment)
+    return chapters
 
-# Replace with your API token
-aai.settings.api_key = os.getenv("AAI_TOKEN")
+
+def _extractive_chapter(text: str) -> dict:
+    """
+    Chapter summary taken from the transcript itself, when the LLM is unavailable
+    """
+    words = " ".join(line.split(": ", 1)[-1] for line in text.splitlines()).split()
+    sentence = re.split(r"(?<=[.!?])\s", " ".join(words[:60]), maxsplit=1)[0]
+    return {
+        "headline": " ".join(words[:8]) + ("..." if len(words) > 8 else ""),
+        "gist": " ".join(sentence.split()[:15]),
+        "summary": " ".join(words[:60]) + ("..." if len(words) > 60 else ""),
+    }
+
+
+async def _summarize_chapter(text: str) -> dict:
+    prompt = f"""Summarize this part of a meeting transcript.
+Reply with JSON only: {{"headline": "<a few words>", "gist": "<one short sentence>", "summary": "<2-3 sentences>"}}
+
+Transcript:
+{text}"""
+    try:
+        model = (await get_genai()).GenerativeModel(MEETING_MODEL)
+        with timed("meeting_chapter_summary"):
+            response = await gemini_limiter.run(
+                lambda: model.generate_content_async(prompt),
+                estimated_tokens=estimate_tokens(prompt) + GEMINI_OUTPUT_TOKENS,
+                usage=_gemini_usage,
+            )
+        match = re.search(r"\{.*\}", response.text, re.DOTALL)
+        chapter = json.loads(match.group(0)) if match else {}
+        if all(isinstance(chapter.get(key), str) and chapter[key] for key in ("headline", "gist", "summary")):
+            return {key: chapter[key] for key in ("headline", "gist", "summary")}
+    except Exception as e:
+        print(f"Error summarizing meeting chapter: {e}")
+    return _extractive_chapter(text)
+
+
+async def _process_chapter(segments: List[dict], semaphore: asyncio.Semaphore):
+    """
+    Summarize one chapter and embed its segments (batched); returns the
+    chapter and the segments' index documents
+    """
+    async with semaphore:
+        text = "\n".join(segment["text"] for segment in segments)
+        summary, embeddings = await asyncio.gather(
+            _summarize_chapter(text),
+            getEmbeddingsBatch([segment["text"] for segment in segments]),
+        )
+    chapter = {"start": ms_to_time(segments[0]["start_ms"]), "end": ms_to_time(segments[-1]["end_ms"]), **summary}
+    documents = [
+        {
+            **segment,
+            "source": "transcript",
+            "chunk": segment["segment"],
+            "start": ms_to_time(segment["start_ms"]),
+            "end": ms_to_time(segment["end_ms"]),
+            "content": segment["text"],
+            "chapter": summary["headline"],
+            "embedding": embedding,
+        }
+        for segment, embedding in zip(segments, embeddings)
+    ]
+    return chapter, documents
+
+
+async def _index_meeting(key: str, segments: List[dict]) -> List[dict]:
+    """
+    Chapters of the meeting; its segments are written to the meeting's vector index
+    """
+    semaphore = asyncio.Semaphore(MEETING_CONCURRENCY)
+    results = await asyncio.gather(*[_process_chapter(chapter, semaphore) for chapter in _chapters(segments)])
+    documents = [document for _, chapter_documents in results for document in chapter_documents]
+    if any(not any(document["embedding"]) for document in documents):
+        # Failed embedding requests come back as zero vectors; index the meeting next time
+        raise RuntimeError("Embedding meeting segments failed")
+    await run_blocking(meeting_index.ensure_namespace, key)
+    if documents:
+        await run_blocking(meeting_index.replace, key, documents)
+    return [chapter for chapter, _ in results]
+
+
+async def prepare_meeting(url: str) -> dict:
+    """
+    Transcribe, segment, summarize and index a meeting, or return it from the
+    cache: a recording is only processed once
+    """
+    key = meeting_id(url)
+    return await meeting_flights.do(key, lambda: _prepare_meeting(url, key))
+
+
+async def _transcribe(transcriber, url: str, key: str) -> List[dict]:
+    """
+    Utterances of the recording, from the transcript cache or the transcriber
+    """
+    entry = cache_key(key, transcriber.name)
+    cached = await run_blocking(transcript_cache.get, entry)
+    record_cache("meeting_transcript", cached is not None)
+    if cached is not None:
+        return json.loads(cached)
+    with timed("meeting_transcription"):
+        utterances = await transcriber.transcribe(url)
+    await run_blocking(transcript_cache.set, entry, json.dumps(utterances))
+    return utterances
+
+
+async def _prepare_meeting(url: str, key: str) -> dict:
+    transcriber = get_transcriber()
+    entry = cache_key(
+        key, transcriber.name, MEETING_PIPELINE_VERSION,
+        f"{MEETING_SEGMENT_SECONDS}:{MEETING_SEGMENT_CHARS}:{MEETING_CHAPTER_SECONDS}",
+    )
+    cached = await run_blocking(meeting_cache.get, entry)
+    record_cache("meeting", cached is not None)
+    if cached is not None:
+        meeting = json.loads(cached)
+        if meeting_index.namespace_exists(key):
+            return meeting
+        # The index was removed: embed the cached segments again, without transcribing
+        meeting["chapters"] = await _index_meeting(key, meeting["segments"])
+        return meeting
+
+    started = time.perf_counter()
+    utterances = await _transcribe(transcriber, url, key)
+    segments = segment_transcript(utterances)
+    with timed("meeting_indexing"):
+        chapters = await _index_meeting(key, segments)
+    meeting = {"meeting_id": key, "segments": segments, "chapters": chapters}
+    await run_blocking(meeting_cache.set, entry, json.dumps(meeting))
+    log_event(
+        "meeting_indexed", meeting=key, transcriber=transcriber.name, utterances=len(utterances),
+        segments=len(segments), chapters=len(chapters), seconds=round(time.perf_counter() - started, 2),
+    )
+    return meeting
 
 
 async def transcribe_file(url):
-    # For now, return a simplified response since we're focusing on getting the server running
-    # TODO: Implement full AssemblyAI integration once dependencies are resolved
     try:
-        # import assemblyai as aai
-        # config = aai.TranscriptionConfig(auto_chapters=True)
-        # transcriber = aai.Transcriber(config=config)
-        # transcript = transcriber.transcribe(url)
-        # ... existing logic ...
-        
-        # Simplified return for testing
-        summaries = [
-            {
-                "start": "00:00",
-                "end": "05:00",
-                "gist": "Meeting introduction and agenda overview",
-                "headline": "Introduction",
-                "summary": "Team members introduced themselves and reviewed the meeting agenda. Discussed project timeline and deliverables.",
-            },
-            {
-                "start": "05:00",
-                "end": "15:00",
-                "gist": "Technical discussion about implementation",
-                "headline": "Technical Planning",
-                "summary": "Detailed discussion about technical architecture, API design, and database schema. Team agreed on technology stack.",
-            }
-        ]
-        return summaries
+        meeting = await prepare_meeting(url)
+        return meeting["chapters"]
     except Exception as e:
         print(f"Error in transcribe_file: {e}")
         return [{"start": "00:00", "end": "00:00", "gist": "Error processing audio", "headline": "Error", "summary": "Unable to process the audio file"}]
 
 
-async def ask_meeting(url, query, quote):
-    # Simplified version for testing - TODO: implement full vector search
+async def relevant_segments(url: str, query: str, quote: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+    """
+    The meeting's transcript segments closest to the question (and quote), in
+    chronological order; empty if the meeting cannot be transcribed
+    """
     try:
-        model = genai.GenerativeModel('gemini-flash-latest')
-        
-        prompt = f"""
+        meeting = await prepare_meeting(url)
+        embedding = await getQueryEmbedding(f"{quote}\n{query}" if quote else query)
+        with timed("meeting_retrieval"):
+            segments = await run_blocking(
+                meeting_index.search, meeting["meeting_id"], embedding, limit or MEETING_TOP_K
+            )
+    except Exception as e:
+        print(f"Error retrieving meeting segments: {e}")
+        return []
+    return sorted(segments, key=lambda segment: segment["start_ms"])
+
+
+def _meeting_prompt(query, quote, segments):
+    if segments:
+        excerpts = "\n\n".join(f"[{segment['start']} - {segment['end']}]\n{segment['content']}" for segment in segments)
+    else:
+        excerpts = "(no transcript available)"
+    return f"""
 AI assistant is a brand new, powerful, human-like artificial intelligence.
 The traits of AI include expert knowledge, helpfulness, cleverness, and articulateness.
 AI is a well-behaved and well-mannered individual.
 AI is always friendly, kind, and inspiring, and he is eager to provide vivid and thoughtful responses to the user.
 AI has the sum of all knowledge in their brain, and is able to accurately answer nearly any question about any topic in conversation.
 
+START TRANSCRIPT EXCERPTS
+{excerpts}
+END TRANSCRIPT EXCERPTS
+
 I am asking a question in regards to this quote in the meeting: {quote}
 here is the question: {query}
 
-Note: This is a simplified response as the vector database integration is being updated. 
-Please provide a general answer based on the quote and question provided."""
+Answer from the transcript excerpts and mention the timestamps you rely on. If the
+excerpts do not contain the answer, say so."""
+
+
+async def ask_meeting(url, query, quote):
+    try:
+        segments = await relevant_segments(url, query, quote)
+        model = (await get_genai()).GenerativeModel(MEETING_MODEL)
+
+        prompt = _meeting_prompt(query, quote, segments)
+
+        with timed("generation_meeting"):
+            response = await gemini_limiter.run(
+                lambda: model.generate_content_async(prompt),
+                estimated_tokens=estimate_tokens(prompt) + GEMINI_OUTPUT_TOKENS,
+                usage=_gemini_usage,
+            )
 
-        import asyncio
-        response = await asyncio.to_thread(
-            model.generate_content,
-            prompt
-        )
-        
-        print("got back answer for", query)
         answer = response.text
         return answer
     except Exception as e:
         print(f"Error in ask_meeting: {e}")
         return "I'm sorry, but I encountered an error while processing your question."
+
+
+async def ask_meeting_stream(url, query, quote):
+    """
+    Streaming variant of ask_meeting(): yields the answer in pieces as they are generated
+    """
+    started = False
+    try:
+        segments = await relevant_segments(url, query, quote)
+        model = (await get_genai()).GenerativeModel(MEETING_MODEL)
+        prompt = _meeting_prompt(query, quote, segments)
+        chunks = await gemini_limiter.run(
+            lambda: model.generate_content_async(prompt, stream=True),
+            estimated_tokens=estimate_tokens(prompt) + GEMINI_OUTPUT_TOKENS,
+        )
+        with timed("generation_meeting_stream"):
+            async for chunk in chunks:
+                text = _gemini_chunk_text(chunk)
+                if text:
+                    started = True
+                    yield text
+    except Exception as e:
+        if started:
+            raise
+        print(f"Error in ask_meeting_stream: {e}")
+        yield "I'm sorry, but I encountered an error while processing your question."
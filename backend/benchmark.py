@@ -0,0 +1,529 @@
+"""
+Offline ingestion benchmark.
+
+Runs generate_documentation and ask against synthetic git repositories with
+Groq, Gemini and the vector store replaced by local fakes (configurable
+latency, jitter, rate limits and failure rates), and writes a JSON report
+with wall time, peak RSS, requests per stage and throughput.
+
+    python benchmark.py --sizes 100 1000 10000 --output benchmark_report.json
+    python benchmark.py --sizes 100 --baseline benchmark_report.json
+
+Every size runs in its own process, so peak RSS and caches are per run.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+BENCHMARK_QUESTIONS = [
+    "What does the serialise_github_url function do?",
+    "How are background jobs scheduled?",
+    "Where is the configuration loaded?",
+    "How does the project handle errors from the API?",
+    "What is HttpClient used for?",
+]
+
+
+class FakeRateLimitError(Exception):
+    pass
+
+
+class FakeProvider:
+    def __init__(self, name, latency, jitter, requests_per_minute, failure_rate, seed):
+        """
+        Stand-in for a remote API: sleeps for latency +/- jitter seconds, answers
+        429 above requests_per_minute and fails a fraction of the requests
+        """
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.requests_per_minute = requests_per_minute
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._window = deque()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.tokens = 0
+
+    def _admit(self, tokens: int):
+        """
+        Count a request against the rate limit; returns its latency and whether it fails
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0] > 60:
+                self._window.popleft()
+            if len(self._window) >= self.requests_per_minute:
+                self.rate_limited += 1
+                retry_after = 60 - (now - self._window[0])
+                raise FakeRateLimitError(
+                    f"Error code: 429 - rate limit reached, please try again in {retry_after:.2f}s"
+                )
+            self._window.append(now)
+            self.requests += 1
+            self.tokens += tokens
+            fail = self._random.random() < self.failure_rate
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        return delay, fail
+
+    async def call(self, tokens: int):
+        delay, fail = self._admit(tokens)
+        await asyncio.sleep(delay)
+        if fail:
+            self._fail()
+
+    def call_blocking(self, tokens: int = 0):
+        """
+        call() for synchronous clients, which the app runs on its blocking executor
+        """
+        delay, fail = self._admit(tokens)
+        time.sleep(delay)
+        if fail:
+            self._fail()
+
+    def _fail(self):
+        with self._lock:
+            self.failures += 1
+        raise RuntimeError(f"{self.name}: simulated 503 Service Unavailable")
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "failures": self.failures,
+            "tokens": self.tokens,
+        }
+
+
+class FakeVectorStore:
+    name = "fake"
+    available = True
+
+    def __init__(self, provider: FakeProvider, store):
+        """
+        Stand-in for Weaviate: documents are kept in the given local store, but
+        every operation first waits for the provider's latency and fails like
+        its requests do
+        """
+        self.provider = provider
+        self.store = store
+
+    def namespace_exists(self, namespace):
+        self.provider.call_blocking()
+        return self.store.namespace_exists(namespace)
+
+    def ensure_namespace(self, namespace):
+        self.provider.call_blocking()
+        return self.store.ensure_namespace(namespace)
+
+    def upsert(self, namespace, documents):
+        self.provider.call_blocking()
+        return self.store.upsert(namespace, documents)
+
+    def delete_sources(self, namespace, sources):
+        self.provider.call_blocking()
+        return self.store.delete_sources(namespace, sources)
+
+    def replace(self, namespace, documents):
+        self.provider.call_blocking()
+        return self.store.replace(namespace, documents)
+
+    def prune(self, namespace, keep_sources):
+        self.provider.call_blocking()
+        return self.store.prune(namespace, keep_sources)
+
+    def search(self, namespace, vector, limit=5, include_vectors=False):
+        self.provider.call_blocking()
+        return self.store.search(namespace, vector, limit, include_vectors)
+
+    def close(self):
+        self.store.close()
+
+
+def _fake_vector(text: str, dimension: int):
+    import numpy as np
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dimension).astype("float32").tolist()
+
+
+def _answer_text(words: int) -> str:
+    return " ".join(["lorem"] * words)
+
+
+def install_fakes(providers: dict, dimension: int):
+    """
+    Register the fakes as the Gemini and Groq clients and the vector store
+    """
+    from clients import registry
+    from vector_store import LocalVectorStore
+
+    async def embed_content_async(model, content, task_type=None):
+        texts = content if isinstance(content, list) else [content]
+        await providers["gemini_embedding"].call(sum(len(text) // 4 for text in texts))
+        vectors = [_fake_vector(text, dimension) for text in texts]
+        return {"embedding": vectors if isinstance(content, list) else vectors[0]}
+
+    class FakeStream:
+        def __init__(self, items):
+            self._items = items
+
+        async def __aiter__(self):
+            for item in self._items:
+                yield item
+
+        async def close(self):
+            pass
+
+    class FakeGenerativeModel:
+        def __init__(self, name, *args, **kwargs):
+            self.name = name
+
+        async def generate_content_async(self, prompt, stream=False):
+            await providers["gemini"].call(len(prompt) // 4)
+            text = _answer_text(200)
+            usage = SimpleNamespace(
+                prompt_token_count=len(prompt) // 4, candidates_token_count=200,
+                total_token_count=len(prompt) // 4 + 200,
+            )
+            if stream:
+                return FakeStream([SimpleNamespace(text=piece + " ") for piece in text.split(" ")])
+            return SimpleNamespace(text=text, usage_metadata=usage)
+
+    async def create(model, messages, temperature=None, max_tokens=100, stream=False):
+        prompt = messages[-1]["content"]
+        await providers["groq"].call(len(prompt) // 4 + max_tokens)
+        text = _answer_text(min(max_tokens, 100))
+        if stream:
+            return FakeStream([
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece + " "))])
+                for piece in text.split(" ")
+            ])
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+            usage=SimpleNamespace(
+                prompt_tokens=len(prompt) // 4, completion_tokens=100,
+                total_tokens=len(prompt) // 4 + 100,
+            ),
+        )
+
+    registry.override("genai", SimpleNamespace(
+        embed_content_async=embed_content_async, GenerativeModel=FakeGenerativeModel
+    ))
+    registry.override("groq", SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    ))
+    registry.override("vector_store", FakeVectorStore(providers["vector_store"], LocalVectorStore()))
+
+
+def _python_file(rng: random.Random, index: int) -> str:
+    lines = ["import os", "import json", ""]
+    for f in range(rng.randint(2, 12)):
+        lines.append(f"def handler_{index}_{f}(payload, retries={rng.randint(1, 5)}):")
+        lines.append(f'    """Handle request {f} of module {index}"""')
+        for _ in range(rng.randint(3, 25)):
+            lines.append(f"    payload = json.loads(json.dumps(payload)) or {{'k{rng.randint(0, 99)}': {rng.random():.4f}}}")
+        lines.append("    return payload")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _js_file(rng: random.Random, index: int) -> str:
+    lines = ["import { HttpClient } from './http';", ""]
+    for f in range(rng.randint(2, 10)):
+        lines.append(f"export function fetchResource{index}_{f}(client, id) {{")
+        for _ in range(rng.randint(3, 20)):
+            lines.append(f"  const value{rng.randint(0, 99)} = client.get(`/items/${{id}}/{rng.randint(0, 999)}`);")
+        lines.append("  return id;")
+        lines.append("}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def create_synthetic_repo(path: str, files: int, seed: int = 0):
+    """
+    A git repository with the given number of source files (Python and
+    JavaScript with functions of varying size) in nested directories, plus
+    empty package files, copies of every 20th file and files the loader has
+    to filter out
+    """
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    for index in range(files):
+        directory = os.path.join(path, "src", f"pkg{index % 37}", f"mod{index % 11}")
+        os.makedirs(directory, exist_ok=True)
+        if index % 3:
+            name, content = f"module_{index}.py", _python_file(rng, index)
+        else:
+            name, content = f"component_{index}.js", _js_file(rng, index)
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(content)
+        # Trivial and duplicated files, which triage summarizes without the LLM
+        init = os.path.join(path, "src", f"pkg{index % 37}", "__init__.py")
+        if not os.path.exists(init):
+            with open(init, "w") as f:
+                f.write("")
+        if index % 20 == 0:
+            copies = os.path.join(path, "src", "copies")
+            os.makedirs(copies, exist_ok=True)
+            with open(os.path.join(copies, name), "w") as f:
+                f.write(content)
+    # Excluded by the loader's filters
+    os.makedirs(os.path.join(path, "node_modules", "dep"), exist_ok=True)
+    for index in range(max(1, files // 20)):
+        with open(os.path.join(path, "node_modules", "dep", f"index_{index}.js"), "w") as f:
+            f.write("module.exports = {};\n")
+    with open(os.path.join(path, "README.md"), "w") as f:
+        f.write("# Synthetic benchmark repository\n")
+    env = {
+        **os.environ,
+        "GIT_AUTHOR_NAME": "bench", "GIT_AUTHOR_EMAIL": "bench@example.com",
+        "GIT_COMMITTER_NAME": "bench", "GIT_COMMITTER_EMAIL": "bench@example.com",
+    }
+    subprocess.run(["git", "init", "-q", path], check=True, env=env)
+    subprocess.run(["git", "-C", path, "add", "-A"], check=True, env=env)
+    subprocess.run(["git", "-C", path, "commit", "-q", "-m", "synthetic"], check=True, env=env)
+
+
+def _peak_rss_mb() -> dict:
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def _stage_stats() -> dict:
+    """
+    Count and total seconds per stage from the metrics registry
+    """
+    from metrics import STAGE_SECONDS
+    stages = {}
+    for metric in STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            stage = sample.labels.get("stage")
+            if sample.name.endswith("_count"):
+                stages.setdefault(stage, {})["count"] = int(sample.value)
+            elif sample.name.endswith("_sum"):
+                stages.setdefault(stage, {})["seconds"] = round(sample.value, 3)
+    return stages
+
+
+async def _run_one(args, workdir: str) -> dict:
+    repo_path = os.path.join(workdir, "repo")
+    started = time.perf_counter()
+    create_synthetic_repo(repo_path, args.files, args.seed)
+    setup_seconds = time.perf_counter() - started
+
+    providers = {
+        name: FakeProvider(name, args.latency, args.jitter, args.rpm, args.failure_rate, args.seed + i)
+        for i, name in enumerate(("groq", "gemini", "gemini_embedding"))
+    }
+    # The vector store has no request quota, only latency and failures
+    providers["vector_store"] = FakeProvider(
+        "vector_store", args.latency, args.jitter, sys.maxsize, args.failure_rate, args.seed + len(providers)
+    )
+    install_fakes(providers, args.dimension)
+    import main
+    from jobs import Job
+
+    url = f"file://{repo_path}"
+    job = Job("generate_documentation", {"github_url": url})
+    started = time.perf_counter()
+    await main.run_documentation(url, job)
+    index_seconds = time.perf_counter() - started
+    after_index = {name: provider.stats() for name, provider in providers.items()}
+
+    # Every ask is a distinct question: identical concurrent asks would be merged
+    # by single-flight and inflate asks_per_second
+    questions = [
+        f"{BENCHMARK_QUESTIONS[i % len(BENCHMARK_QUESTIONS)]} (question {i + 1})" for i in range(args.asks)
+    ]
+    namespace = main.serialise_github_url(url)
+    started = time.perf_counter()
+    await asyncio.gather(*[main.ask(question, namespace) for question in questions])
+    ask_seconds = time.perf_counter() - started
+
+    reindex_seconds = None
+    if args.reindex:
+        started = time.perf_counter()
+        await main.run_documentation(url, Job("generate_documentation", {"github_url": url}))
+        reindex_seconds = time.perf_counter() - started
+
+    fork = None
+    if args.fork:
+        # A fork shares every blob with the indexed repository
+        fork_path = os.path.join(workdir, "fork")
+        subprocess.run(["git", "clone", "-q", repo_path, fork_path], check=True)
+        before = {name: provider.stats()["requests"] for name, provider in providers.items()}
+        started = time.perf_counter()
+        fork_url = f"file://{fork_path}"
+        await main.run_documentation(fork_url, Job("generate_documentation", {"github_url": fork_url}))
+        fork = {
+            "seconds": round(time.perf_counter() - started, 3),
+            "provider_requests": {
+                name: provider.stats()["requests"] - before[name] for name, provider in providers.items()
+            },
+        }
+
+    files_indexed = job.counters.get("files_changed", 0)
+    return {
+        "files": args.files,
+        "files_indexed": files_indexed,
+        "chunks": job.counters.get("chunks", 0),
+        "llm_calls_avoided": job.counters.get("llm_calls_avoided", 0),
+        "setup_seconds": round(setup_seconds, 3),
+        "index_seconds": round(index_seconds, 3),
+        "reindex_seconds": None if reindex_seconds is None else round(reindex_seconds, 3),
+        "fork": fork,
+        "ask_seconds": round(ask_seconds, 3),
+        "asks": len(questions),
+        "files_per_second": round(files_indexed / index_seconds, 2) if index_seconds else None,
+        "asks_per_second": round(len(questions) / ask_seconds, 2) if ask_seconds else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "provider_requests_indexing": after_index,
+        "provider_requests_total": {name: provider.stats() for name, provider in providers.items()},
+        "stages": _stage_stats(),
+    }
+
+
+def run_one(args):
+    """
+    Benchmark one repository size in this process (called in a subprocess)
+    """
+    workdir = tempfile.mkdtemp(prefix="codepulse_bench_")
+    # Every cache, index and mirror lives in the work directory
+    os.environ.update({
+        "CODEPULSE_CACHE_DIR": os.path.join(workdir, "cache"),
+        "GIT_MIRROR_DIR": os.path.join(workdir, "mirrors"),
+        "VECTOR_STORE": "local",
+        "LOCAL_VECTOR_DIR": os.path.join(workdir, "vectors"),
+        "LEXICAL_INDEX_DIR": os.path.join(workdir, "lexical"),
+        # The shared rate limiters pace requests to the fake providers' limits
+        "GROQ_RPM": str(args.rpm), "GROQ_TPM": str(args.rpm * 10000),
+        "GEMINI_RPM": str(args.rpm), "GEMINI_TPM": str(args.rpm * 10000),
+        "GEMINI_EMBEDDING_RPM": str(args.rpm), "GEMINI_EMBEDDING_TPM": str(args.rpm * 100000),
+        "LOG_LEVEL": "WARNING",
+    })
+    try:
+        result = asyncio.run(_run_one(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(result))
+
+
+def _child_args(args, files: int) -> list:
+    return [
+        sys.executable, os.path.abspath(__file__), "--run-one", "--files", str(files),
+        "--latency", str(args.latency), "--jitter", str(args.jitter), "--rpm", str(args.rpm),
+        "--failure-rate", str(args.failure_rate), "--asks", str(args.asks),
+        "--dimension", str(args.dimension), "--seed", str(args.seed),
+    ] + (["--reindex"] if args.reindex else []) + (["--fork"] if args.fork else [])
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Regressions of the report against a baseline: timings more than
+    tolerance slower, or peak RSS more than tolerance higher, at the same size
+    """
+    previous = {result["files"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get(result["files"])
+        if before is None:
+            continue
+        for key in ("index_seconds", "reindex_seconds", "ask_seconds"):
+            if before.get(key) and result.get(key) and result[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{result['files']} files: {key} {before[key]} -> {result[key]}")
+        old_rss, new_rss = before["peak_rss_mb"]["self"], result["peak_rss_mb"]["self"]
+        if new_rss > old_rss * (1 + tolerance):
+            regressions.append(f"{result['files']} files: peak RSS {old_rss} MB -> {new_rss} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="repository sizes (files)")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake provider latency (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="fake provider latency jitter (seconds)")
+    parser.add_argument("--rpm", type=int, default=60000, help="fake provider requests per minute")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of fake requests that fail")
+    parser.add_argument("--asks", type=int, default=20, help="questions asked after indexing")
+    parser.add_argument("--dimension", type=int, default=768, help="fake embedding dimension")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reindex", action="store_true", help="also time an unchanged re-index")
+    parser.add_argument("--fork", action="store_true", help="also time indexing a fork of the repository")
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--baseline", help="report to compare against; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown vs the baseline")
+    parser.add_argument("--run-one", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--files", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args)
+        return
+
+    report = {
+        "config": {
+            key: getattr(args, key)
+            for key in ("latency", "jitter", "rpm", "failure_rate", "asks", "dimension", "seed", "reindex", "fork")
+        },
+        "python": sys.version.split()[0],
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "results": [],
+    }
+    for files in args.sizes:
+        print(f"Benchmarking {files} files...", file=sys.stderr)
+        child = subprocess.run(
+            _child_args(args, files), capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        if child.returncode != 0:
+            print(child.stderr, file=sys.stderr)
+            report["results"].append({"files": files, "error": child.stderr.strip().splitlines()[-1:]})
+            continue
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        report["results"].append(result)
+        print(
+            f"  indexed {result['files_indexed']} files ({result['chunks']} chunks) in "
+            f"{result['index_seconds']}s ({result['files_per_second']} files/s), "
+            f"{result['asks']} asks in {result['ask_seconds']}s, "
+            f"peak RSS {result['peak_rss_mb']['self']} MB",
+            file=sys.stderr,
+        )
+        if result.get("fork"):
+            print(
+                f"  indexed a fork in {result['fork']['seconds']}s with provider requests "
+                f"{result['fork']['provider_requests']}",
+                file=sys.stderr,
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
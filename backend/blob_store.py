@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from summary_cache import CACHE_DIR
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BlobStore:
+    def __init__(self, path: Optional[str] = None):
+        """
+        Global, content-addressed store of per-file indexing results shared by
+        every repository, keyed by git blob SHA: how a blob splits into chunks
+        and the embedding of each chunk. Namespaces only reference blobs
+        through their index state manifest, so the files of a fork are chunked
+        and embedded once. Embeddings are also keyed by a digest of the embedded
+        text, which includes the file path: a copy at another path reuses the
+        chunks (and the summary) but gets its own vectors.
+        """
+        self.path = path or os.path.join(CACHE_DIR, "blobs.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunk_layouts (
+                blob_sha TEXT NOT NULL,
+                chunker TEXT NOT NULL,
+                units TEXT NOT NULL,
+                PRIMARY KEY (blob_sha, chunker)
+            );
+            CREATE TABLE IF NOT EXISTS embeddings (
+                blob_sha TEXT NOT NULL,
+                model TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (blob_sha, model, digest)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def get_chunks(self, blob_sha: str, chunker: str, content: str) -> Optional[List[dict]]:
+        """
+        Chunks of the blob as recorded by set_chunks, rebuilt from its content
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT units FROM chunk_layouts WHERE blob_sha = ? AND chunker = ?", (blob_sha, chunker)
+            ).fetchone()
+        if row is None:
+            return None
+        lines = content.splitlines(keepends=True)
+        chunks = []
+        for start, end, name in json.loads(row[0]):
+            chunks.append({
+                "chunk": len(chunks),
+                "start_line": start,
+                "end_line": end,
+                "name": name,
+                "content": "".join(lines[start - 1:end]) if lines else content,
+            })
+        return chunks
+
+    def set_chunks(self, blob_sha: str, chunker: str, chunks: List[dict]):
+        """
+        Record the line ranges and names of the chunks; their content is not
+        stored since it is a slice of the blob
+        """
+        units = [[chunk["start_line"], chunk["end_line"], chunk["name"]] for chunk in chunks]
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chunk_layouts (blob_sha, chunker, units) VALUES (?, ?, ?)",
+                (blob_sha, chunker, json.dumps(units)),
+            )
+            self._conn.commit()
+
+    def get_embeddings(self, model: str, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], List[float]]:
+        """
+        Stored embeddings of the given (blob_sha, text digest) pairs; missing ones are left out
+        """
+        found = {}
+        with self._lock:
+            for blob_sha, digest in set(keys):
+                row = self._conn.execute(
+                    "SELECT vector FROM embeddings WHERE blob_sha = ? AND model = ? AND digest = ?",
+                    (blob_sha, model, digest),
+                ).fetchone()
+                if row is not None:
+                    found[(blob_sha, digest)] = np.frombuffer(row[0], dtype=np.float32).tolist()
+        return found
+
+    def set_embeddings(self, model: str, embeddings: Dict[Tuple[str, str], List[float]]):
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (blob_sha, model, digest, vector) VALUES (?, ?, ?, ?)",
+                    [
+                        (blob_sha, model, digest, np.asarray(vector, dtype=np.float32).tobytes())
+                        for (blob_sha, digest), vector in embeddings.items()
+                    ],
+                )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "blobs": self._conn.execute(
+                    "SELECT COUNT(*) FROM (SELECT blob_sha FROM chunk_layouts UNION SELECT blob_sha FROM embeddings)"
+                ).fetchone()[0],
+                "embeddings": self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0],
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+blob_store = BlobStore()
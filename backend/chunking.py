@@ -0,0 +1,191 @@
+import ast
+import os
+import re
+from typing import List, Tuple
+
+# Chunks are split to stay under these limits; oversized units are cut into
+# line windows that overlap by OVERLAP_LINES
+MAX_CHUNK_LINES = int(os.getenv("CHUNK_MAX_LINES", "150"))
+MAX_CHUNK_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "4000"))
+OVERLAP_LINES = int(os.getenv("CHUNK_OVERLAP_LINES", "5"))
+# Units shorter than this are merged with their neighbours
+MIN_CHUNK_LINES = 5
+# Bump whenever chunk boundaries change so stored chunk layouts are recomputed
+CHUNKER_VERSION = "v1"
+
+# Lines starting a top-level declaration in brace/keyword based languages
+_DECLARATION = re.compile(
+    r"^(?:export\s+)?(?:default\s+)?(?:public\s+|private\s+|protected\s+|internal\s+|static\s+|"
+    r"abstract\s+|final\s+|async\s+|pub(?:\([^)]*\))?\s+|unsafe\s+|extern\s+)*"
+    r"(?:function\*?|class|interface|type|enum|struct|trait|impl|fn|func|def|module|namespace|"
+    r"object|record|(?:const|let|var)\s+\w+\s*(?::[^=]+)?=\s*(?:async\s*)?(?:\([^)]*\)|\w+)\s*=>)\b"
+)
+_EXPORTED_BINDING = re.compile(r"^export\s+(?:const|let|var)\s+\w+")
+_KEYWORDS = {
+    "export", "default", "public", "private", "protected", "internal", "static", "abstract",
+    "final", "async", "pub", "unsafe", "extern", "function", "const", "let", "var", "def",
+    "fn", "func",
+}
+_HEURISTIC_EXTENSIONS = {
+    ".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".go", ".rs", ".java", ".kt", ".kts",
+    ".scala", ".swift", ".cs", ".php", ".rb", ".c", ".h", ".cc", ".cpp", ".hpp", ".dart",
+}
+
+
+def _python_units(content: str) -> List[Tuple[int, int, str]]:
+    """
+    Top-level functions and classes of a Python file as (start, end, name)
+    1-based inclusive line ranges; decorators are included
+    """
+    tree = ast.parse(content)
+    units = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            units.append((start, node.end_lineno, node.name))
+            # Split large classes into their methods
+            if isinstance(node, ast.ClassDef) and node.end_lineno - start + 1 > MAX_CHUNK_LINES:
+                units.pop()
+                methods = [
+                    child for child in node.body
+                    if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))
+                ]
+                if not methods:
+                    units.append((start, node.end_lineno, node.name))
+                    continue
+                first = min([methods[0].lineno] + [d.lineno for d in methods[0].decorator_list])
+                units.append((start, first - 1, node.name))
+                for method in methods:
+                    method_start = min([method.lineno] + [d.lineno for d in method.decorator_list])
+                    units.append((method_start, method.end_lineno, f"{node.name}.{method.name}"))
+    return units
+
+
+def _heuristic_units(lines: List[str]) -> List[Tuple[int, int, str]]:
+    """
+    Split on unindented declaration lines; each unit runs up to the next one
+    """
+    starts = []
+    for number, line in enumerate(lines, 1):
+        if line and not line[0].isspace() and (_DECLARATION.match(line) or _EXPORTED_BINDING.match(line)):
+            words = [w for w in re.findall(r"[A-Za-z_$][\w$]*", line) if w not in _KEYWORDS]
+            starts.append((number, " ".join(words[:2])))
+    units = []
+    for i, (start, name) in enumerate(starts):
+        end = starts[i + 1][0] - 1 if i + 1 < len(starts) else len(lines)
+        units.append((start, end, name))
+    return units
+
+
+def _fill_gaps(units: List[Tuple[int, int, str]], total: int) -> List[Tuple[int, int, str]]:
+    """
+    Cover the whole file: lines between units (imports, module-level code)
+    become units of their own
+    """
+    covered = []
+    line = 1
+    for start, end, name in sorted(units):
+        if start < line:
+            start = line
+        if start > end:
+            continue
+        if start > line:
+            covered.append((line, start - 1, ""))
+        covered.append((start, end, name))
+        line = end + 1
+    if line <= total:
+        covered.append((line, total, ""))
+    return covered
+
+
+def _merge_small(units: List[Tuple[int, int, str]]) -> List[Tuple[int, int, str]]:
+    merged = []
+    for start, end, name in units:
+        if merged:
+            prev_start, prev_end, prev_name = merged[-1]
+            small = end - start + 1 < MIN_CHUNK_LINES or prev_end - prev_start + 1 < MIN_CHUNK_LINES
+            if small and end - prev_start + 1 <= MAX_CHUNK_LINES:
+                merged[-1] = (prev_start, end, " ".join(n for n in (prev_name, name) if n))
+                continue
+        merged.append((start, end, name))
+    return merged
+
+
+def _windows(start: int, end: int, lines: List[str]) -> List[Tuple[int, int]]:
+    """
+    Split a line range into windows under the size limits, overlapping by OVERLAP_LINES
+    """
+    windows = []
+    line = start
+    while line <= end:
+        window_end = line
+        chars = len(lines[line - 1])
+        while (
+            window_end < end
+            and window_end - line + 1 < MAX_CHUNK_LINES
+            and chars + len(lines[window_end]) <= MAX_CHUNK_CHARS
+        ):
+            chars += len(lines[window_end])
+            window_end += 1
+        windows.append((line, window_end))
+        if window_end >= end:
+            break
+        line = max(line + 1, window_end + 1 - OVERLAP_LINES)
+    return windows
+
+
+def chunk_file(source: str, content: str) -> List[dict]:
+    """
+    Split a source file into function/class level chunks.
+    Python is parsed with ast; other languages use declaration heuristics,
+    falling back to overlapping line windows. Every chunk records its
+    1-based inclusive line range.
+    """
+    lines = content.splitlines(keepends=True)
+    if not lines:
+        return [{"chunk": 0, "start_line": 1, "end_line": 1, "name": "", "content": content}]
+
+    units = []
+    extension = os.path.splitext(source)[1].lower()
+    if extension in (".py", ".pyi"):
+        try:
+            units = _python_units(content)
+        except (SyntaxError, ValueError):
+            units = []
+    elif extension in _HEURISTIC_EXTENSIONS:
+        units = _heuristic_units([line.rstrip("\n") for line in lines])
+
+    units = _merge_small(_fill_gaps(units, len(lines)))
+
+    chunks = []
+    for start, end, name in units:
+        for window_start, window_end in _windows(start, end, lines):
+            chunks.append({
+                "chunk": len(chunks),
+                "start_line": window_start,
+                "end_line": window_end,
+                "name": name,
+                "content": "".join(lines[window_start - 1:window_end]),
+            })
+    return chunks
+
+
+def chunker_key(source: str) -> str:
+    """
+    Identifies how a file is chunked: its extension picks the parser, and the
+    size limits and chunker version decide the boundaries
+    """
+    extension = os.path.splitext(source)[1].lower()
+    return f"{CHUNKER_VERSION}:{extension}:{MAX_CHUNK_LINES}:{MAX_CHUNK_CHARS}:{OVERLAP_LINES}"
+
+
+def file_outline(chunks: List[dict], after_line: int = 0) -> str:
+    """
+    One line per named chunk starting after the given line, e.g. for
+    describing the part of a large file that does not fit in a prompt
+    """
+    return "\n".join(
+        f"- {chunk['name']} (lines {chunk['start_line']}-{chunk['end_line']})"
+        for chunk in chunks
+        if chunk["name"] and chunk["start_line"] > after_line
+    )
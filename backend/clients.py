@@ -0,0 +1,242 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, TypeVar
+from metrics import log_event
+
+# A client that could not be created is not retried for this long (seconds)
+CLIENT_RETRY_INTERVAL = float(os.getenv("CLIENT_RETRY_INTERVAL", "30"))
+# Threads for the remaining blocking clients (Weaviate, SQLite indexes, git)
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "16"))
+# Keep-alive connection pool of the async Groq client
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "50"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "20"))
+
+T = TypeVar("T")
+
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+_blocking_executor_lock = threading.Lock()
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+
+def _get_blocking_executor() -> ThreadPoolExecutor:
+    global _blocking_executor
+    with _blocking_executor_lock:
+        if _blocking_executor is None:
+            _blocking_executor = ThreadPoolExecutor(
+                max_workers=BLOCKING_WORKERS, thread_name_prefix="codepulse-blocking"
+            )
+        return _blocking_executor
+
+
+async def run_blocking(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Run a blocking call (sync SDK client, SQLite, git) on the dedicated bounded
+    executor, with the caller's context (e.g. metrics timings). Provider API
+    calls use the async clients instead and never take one of these threads.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await loop.run_in_executor(_get_blocking_executor(), call)
+
+
+def shutdown_blocking_executor():
+    global _blocking_executor
+    with _blocking_executor_lock:
+        if _blocking_executor is not None:
+            _blocking_executor.shutdown(wait=False, cancel_futures=True)
+            _blocking_executor = None
+
+
+def load_env():
+    """
+    Load the .env file into the environment (once per process)
+    """
+    global _env_loaded
+    with _env_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_loaded = True
+
+
+class ClientRegistry:
+    def __init__(self):
+        """
+        SDK clients created on first use: importing a module does not import
+        the SDKs or open network connections. Clients are built once (per
+        name, under a lock), can be warmed up ahead of time and are closed
+        with the app.
+        """
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._closers: Dict[str, Callable[[Any], None]] = {}
+        self._clients: Dict[str, Any] = {}
+        self._errors: Dict[str, str] = {}
+        self._failed_at: Dict[str, float] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any], close: Optional[Callable[[Any], None]] = None):
+        with self._lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+            if close is not None:
+                self._closers[name] = close
+
+    def override(self, name: str, client: Any):
+        """
+        Use the given client instead of building one (e.g. fakes in benchmarks)
+        """
+        with self._lock:
+            self._locks.setdefault(name, threading.Lock())
+            self._clients[name] = client
+            self._errors.pop(name, None)
+            self._failed_at.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """
+        The client registered under name, built on first use. Raises the
+        factory's error if it cannot be created; it is retried after
+        CLIENT_RETRY_INTERVAL seconds.
+        """
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        if name not in self._locks:
+            raise KeyError(f"No client registered as {name}")
+        with self._locks[name]:
+            client = self._clients.get(name)
+            if client is None:
+                failed_at = self._failed_at.get(name)
+                if failed_at is not None and time.monotonic() - failed_at < CLIENT_RETRY_INTERVAL:
+                    raise RuntimeError(f"{name} client unavailable: {self._errors[name]}")
+                started = time.perf_counter()
+                try:
+                    client = self._factories[name]()
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    self._failed_at[name] = time.monotonic()
+                    log_event("client_unavailable", client=name, error=str(e))
+                    raise
+                self._clients[name] = client
+                self._errors.pop(name, None)
+                log_event("client_initialized", client=name, ms=round((time.perf_counter() - started) * 1000))
+            return client
+
+    def try_get(self, name: str) -> Optional[Any]:
+        """
+        Like get(), but returns None if the client cannot be created
+        """
+        try:
+            return self.get(name)
+        except Exception:
+            return None
+
+    async def aget(self, name: str) -> Any:
+        """
+        get() for coroutines: a client not created yet is built on the blocking
+        executor, so SDK imports and connections do not block the event loop
+        """
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        return await run_blocking(self.get, name)
+
+    async def atry_get(self, name: str) -> Optional[Any]:
+        try:
+            return await self.aget(name)
+        except Exception:
+            return None
+
+    def status(self) -> Dict[str, str]:
+        """
+        State of every client ("ready", "unavailable", "not initialized" or the
+        last error), without creating any
+        """
+        status = {}
+        for name in sorted(self._locks):
+            if name in self._clients:
+                # e.g. a vector store created without a connection
+                status[name] = "ready" if getattr(self._clients[name], "available", True) else "unavailable"
+            elif name in self._errors:
+                status[name] = f"error: {self._errors[name]}"
+            else:
+                status[name] = "not initialized"
+        return status
+
+    async def warm_up(self, names: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """
+        Create the given (default: all) clients concurrently
+        """
+        names = list(names or self._factories)
+        await asyncio.gather(*[self.atry_get(name) for name in names])
+        return {name: state for name, state in self.status().items() if name in names}
+
+    async def close(self):
+        """
+        Close every created client (closers may be coroutine functions)
+        """
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for name, client in clients.items():
+            closer = self._closers.get(name)
+            if closer is None:
+                continue
+            try:
+                if inspect.iscoroutinefunction(closer):
+                    await closer(client)
+                else:
+                    await run_blocking(closer, client)
+            except Exception as e:
+                print(f"Error closing {name} client: {e}")
+
+
+registry = ClientRegistry()
+
+
+def _genai():
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai
+
+
+def _groq():
+    import httpx
+    from groq import AsyncGroq
+    return AsyncGroq(
+        api_key=os.getenv("GROQ_API_KEY"),
+        http_client=httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=GROQ_MAX_CONNECTIONS, max_keepalive_connections=GROQ_MAX_KEEPALIVE
+            ),
+        ),
+    )
+
+
+async def _close_groq(client):
+    await client.close()
+
+
+def _vector_store():
+    from vector_store import create_vector_store
+    return create_vector_store()
+
+
+def _assemblyai():
+    import assemblyai as aai
+    aai.settings.api_key = os.getenv("AAI_TOKEN")
+    return aai
+
+
+registry.register("genai", _genai)
+registry.register("groq", _groq, close=_close_groq)
+registry.register("vector_store", _vector_store, close=lambda store: store.close())
+registry.register("assemblyai", _assemblyai)
@@ -1,12 +1,19 @@
-import cohere
 import os
-import dotenv
+from clients import registry, load_env
 
-dotenv.load_dotenv()
-co = cohere.Client(os.getenv("COHERE_API_KEY"))
+load_env()
+
+
+def _cohere():
+    import cohere
+    return cohere.Client(os.getenv("COHERE_API_KEY"))
+
+
+registry.register("cohere", _cohere)
 
 
 def chat_cohere(chat_history, message, documents):
+    co = registry.get("cohere")
     response = co.chat(message=message, chat_history=chat_history, documents=documents)
     answer = response.text
     return answer
@@ -0,0 +1,307 @@
+import asyncio
+import os
+import re
+import subprocess
+from typing import List, Optional
+import httpx
+from summary_cache import SummaryCache, cache_key
+from GithubLoader import open_mirror
+from _gemini import summarise_commit, combine_commit_summaries, COMMIT_SUMMARY_MODEL
+from metrics import timed, record_cache, log_event
+from clients import run_blocking
+
+# Bump whenever the commit prompts or the map-reduce split change
+COMMIT_PROMPT_VERSION = "v1"
+# Largest diff excerpt sent in one summarization request (characters)
+MAX_DIFF_PART_CHARS = int(os.getenv("COMMIT_DIFF_PART_CHARS", "12000"))
+# Files whose diffs are not worth summarizing line by line
+_NOISE_PATTERNS = re.compile(
+    r"(^|/)(package-lock\.json|yarn\.lock|pnpm-lock\.yaml|poetry\.lock|Cargo\.lock|go\.sum)$"
+    r"|\.min\.(js|css)$|\.map$"
+)
+_FAILED = "Unable to summarize commit changes"
+# Only full commit SHAs are cached: a branch, tag or short SHA can point elsewhere later
+_COMMIT_SHA = re.compile(r"[0-9a-f]{40}")
+# Commits summarized at once by a batch request (diffs are computed in threads;
+# Groq requests are paced by the shared rate limiter)
+COMMIT_BATCH_CONCURRENCY = int(os.getenv("COMMIT_BATCH_CONCURRENCY", "8"))
+MAX_BATCH_COMMITS = int(os.getenv("MAX_BATCH_COMMITS", "500"))
+
+# Commits never change, so their summaries are cached forever, keyed by commit SHA
+commit_cache = SummaryCache(table="commit_summaries")
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Shared HTTP client, so GitHub requests reuse pooled connections
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            follow_redirects=True,
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def is_commit_sha(value: str) -> bool:
+    return _COMMIT_SHA.fullmatch(value.strip().lower()) is not None
+
+
+def commit_cache_key(commit_sha: str) -> str:
+    return cache_key(commit_sha.strip().lower(), COMMIT_SUMMARY_MODEL, COMMIT_PROMPT_VERSION)
+
+
+def parse_diff(diff: str) -> List[dict]:
+    """
+    Split a unified (git) diff into one entry per file: {"path", "patch", "binary"}
+    """
+    files = []
+    current = None
+    for line in diff.splitlines(keepends=True):
+        if line.startswith("diff --git "):
+            match = re.match(r"diff --git a/(.*?) b/(.*)$", line.rstrip("\n"))
+            current = {"path": match.group(2) if match else line[11:].strip(), "lines": [], "binary": False}
+            files.append(current)
+        elif current is None:
+            # Preamble (e.g. the commit message of a format-patch); not part of any file
+            continue
+        elif line.startswith("+++ ") and not line.startswith("+++ /dev/null"):
+            current["path"] = line[4:].strip().removeprefix("b/")
+        elif line.startswith("Binary files "):
+            current["binary"] = True
+        current["lines"].append(line)
+    return [
+        {"path": f["path"], "patch": "".join(f["lines"]), "binary": f["binary"]}
+        for f in files
+    ]
+
+
+def _split_patch(patch: str, limit: int) -> List[str]:
+    """
+    Split one file's patch at hunk boundaries into pieces under limit characters,
+    repeating the file header on every piece
+    """
+    header, _, body = patch.partition("\n@@")
+    if not body:
+        return [patch[i:i + limit] for i in range(0, len(patch), limit)]
+    header += "\n"
+    hunks = ["@@" + hunk for hunk in ("\n@@" + body).split("\n@@") if hunk]
+    pieces = []
+    current = ""
+    for hunk in hunks:
+        hunk = hunk if hunk.endswith("\n") else hunk + "\n"
+        if current and len(header) + len(current) + len(hunk) > limit:
+            pieces.append(header + current)
+            current = ""
+        # A single hunk over the limit is cut; the rest of it is still summarized in its own piece
+        while len(header) + len(hunk) > limit:
+            room = max(limit - len(header), 1000)
+            pieces.append(header + hunk[:room])
+            hunk = hunk[room:]
+        current += hunk
+    if current:
+        pieces.append(header + current)
+    return pieces
+
+
+def split_diff(diff: str, limit: int = MAX_DIFF_PART_CHARS) -> List[str]:
+    """
+    Group the per-file patches of a diff into parts of at most limit characters.
+    Binary files and lock/minified files are reduced to a one-line mention.
+    """
+    parts = []
+    current = ""
+    for file in parse_diff(diff):
+        patch = file["patch"]
+        if file["binary"] or _NOISE_PATTERNS.search(file["path"]):
+            patch = f"diff --git a/{file['path']} b/{file['path']}\n(generated or binary file changed, diff omitted)\n"
+        for piece in (_split_patch(patch, limit) if len(patch) > limit else [patch]):
+            if current and len(current) + len(piece) > limit:
+                parts.append(current)
+                current = ""
+            current += piece
+    if current:
+        parts.append(current)
+    return parts
+
+
+async def summarise_diff(diff: str) -> str:
+    """
+    Summarize a whole diff with map-reduce: parts of the diff (grouped per
+    file) are summarized concurrently, then merged into one summary
+    """
+    parts = split_diff(diff)
+    if not parts:
+        return "No file changes in this commit"
+    with timed("commit_summary"):
+        if len(parts) == 1:
+            return await summarise_commit(parts[0])
+        log_event("commit_diff_split", parts=len(parts), chars=len(diff))
+        summaries = await asyncio.gather(*[summarise_commit(part) for part in parts])
+        if any(summary == _FAILED for summary in summaries):
+            return _FAILED
+        return await combine_commit_summaries(summaries)
+
+
+async def summarise_commit_diff(commit_sha: str, diff: str) -> str:
+    """
+    Summarize the diff of the given commit, using and filling the commit cache
+    (only when commit_sha is a full SHA)
+    """
+    if not is_commit_sha(commit_sha):
+        return await summarise_diff(diff)
+    key = commit_cache_key(commit_sha)
+    cached = await run_blocking(commit_cache.get, key)
+    record_cache("commit_summary", cached is not None)
+    if cached is not None:
+        return cached
+    summary = await summarise_diff(diff)
+    if summary != _FAILED:
+        await run_blocking(commit_cache.set, key, summary)
+    return summary
+
+
+async def fetch_commit_diff(github_url: str, commit_sha: str) -> str:
+    headers = {"Accept": "application/vnd.github.v3.diff"}
+    token = os.getenv("GITHUB_PERSONAL_ACCESS_TOKEN")
+    if token:
+        headers["Authorization"] = f"token {token}"
+    response = await get_http_client().get(
+        f"{github_url.rstrip('/')}/commit/{commit_sha}.diff", headers=headers
+    )
+    response.raise_for_status()
+    return response.text
+
+
+async def summarise_github_commit(github_url: str, commit_sha: str) -> str:
+    """
+    Summary of a commit of a GitHub repository; cached summaries are returned
+    without fetching the diff. commit_sha may also be a ref or a short SHA,
+    which is summarized without the cache.
+    """
+    if is_commit_sha(commit_sha):
+        cached = await run_blocking(commit_cache.get, commit_cache_key(commit_sha))
+        if cached is not None:
+            record_cache("commit_summary", True)
+            return cached
+    with timed("commit_fetch"):
+        diff = await fetch_commit_diff(github_url, commit_sha)
+    return await summarise_commit_diff(commit_sha, diff)
+
+
+def list_commits(repo, rev_range: Optional[str] = None, last: Optional[int] = None) -> List[dict]:
+    """
+    Commits of rev_range (e.g. "v1.0..main", default HEAD), newest first
+    """
+    # git would parse a leading "-" as a rev-list option
+    if rev_range and rev_range.startswith("-"):
+        raise ValueError(f"Invalid revision range: {rev_range}")
+    if last is not None and last < 1:
+        raise ValueError(f"last must be at least 1, got {last}")
+    max_count = MAX_BATCH_COMMITS if last is None else min(last, MAX_BATCH_COMMITS)
+    return [
+        {
+            "sha": commit.hexsha,
+            "message": commit.message.strip(),
+            "author": commit.author.name,
+            "date": commit.committed_datetime.isoformat(),
+            "parent": commit.parents[0].hexsha if commit.parents else None,
+        }
+        for commit in repo.iter_commits(rev_range or "HEAD", max_count=max_count)
+    ]
+
+
+def prefetch_commit_blobs(repo, commits: List[dict]) -> int:
+    """
+    Fetch the blobs the diffs of the commits need in one request. The mirror
+    is blobless, and git would otherwise fetch the missing blobs of every
+    commit from the remote while diffing it. Returns the number of blobs asked for.
+    """
+    if not commits:
+        return 0
+    # Trees are in the mirror, so listing the changed blobs needs no network
+    listing = subprocess.run(
+        ["git", "-C", repo.git_dir, "diff-tree", "--stdin", "-r", "--root", "--no-commit-id", "--no-renames", "--no-abbrev"],
+        input="".join(f"{c['sha']} {c['parent'] or ''}\n" for c in commits),
+        capture_output=True, text=True, check=True,
+    ).stdout
+    blobs = set()
+    for line in listing.splitlines():
+        # :<old mode> <new mode> <old blob> <new blob> <status>\t<path>
+        fields = line.split("\t", 1)[0].split()
+        if len(fields) < 4 or not line.startswith(":"):
+            continue
+        for mode, blob in ((fields[0][1:], fields[2]), (fields[1], fields[3])):
+            # Submodule entries point to commits of another repository
+            if mode != "160000" and blob.strip("0"):
+                blobs.add(blob)
+    if blobs:
+        subprocess.run(
+            ["git", "-C", repo.git_dir, "-c", "fetch.negotiationAlgorithm=noop", "fetch", "origin",
+             "--no-tags", "--no-write-fetch-head", "--recurse-submodules=no", "--filter=blob:none", "--stdin"],
+            input="\n".join(sorted(blobs)) + "\n", capture_output=True, text=True, check=True,
+        )
+    return len(blobs)
+
+
+def local_commit_diff(repo, sha: str, parent: Optional[str]) -> str:
+    """
+    Diff of a commit against its first parent, computed from the local mirror
+    """
+    if parent is None:
+        return repo.git.diff_tree("-p", "--root", "--no-color", "--no-commit-id", sha)
+    return repo.git.diff(parent, sha, "--no-color")
+
+
+async def summarise_commit_range(
+    github_url: str, rev_range: Optional[str] = None, last: Optional[int] = None
+) -> List[dict]:
+    """
+    Summarize every commit of a range from the repository's local mirror.
+    Cached commits are returned as they are; the blobs the others need are
+    fetched in one batch, then their diffs are computed locally and
+    summarized concurrently.
+    """
+    with timed("clone"):
+        repo = await run_blocking(open_mirror, github_url)
+    commits = await run_blocking(list_commits, repo, rev_range, last)
+    cached_summaries = await run_blocking(
+        lambda: {commit["sha"]: commit_cache.get(commit_cache_key(commit["sha"])) for commit in commits}
+    )
+    uncached = [commit for commit in commits if cached_summaries[commit["sha"]] is None]
+    if uncached:
+        try:
+            with timed("commit_blob_fetch"):
+                blobs = await run_blocking(prefetch_commit_blobs, repo, uncached)
+            log_event("commit_blobs_fetched", github_url=github_url, commits=len(uncached), blobs=blobs)
+        except subprocess.CalledProcessError as e:
+            # Not fatal: git fetches whatever is still missing while diffing
+            print(f"Prefetching commit blobs failed: {e.stderr or e}")
+    slots = asyncio.Semaphore(COMMIT_BATCH_CONCURRENCY)
+
+    async def summarise(commit: dict):
+        cached = cached_summaries[commit["sha"]]
+        if cached is not None:
+            record_cache("commit_summary", True)
+            return {**commit, "summary": cached, "cached": True}
+        async with slots:
+            with timed("commit_diff"):
+                diff = await run_blocking(local_commit_diff, repo, commit["sha"], commit["parent"])
+            summary = await summarise_commit_diff(commit["sha"], diff)
+        return {**commit, "summary": summary, "cached": False}
+
+    results = await asyncio.gather(*[summarise(commit) for commit in commits])
+    cached = sum(1 for result in results if result["cached"])
+    log_event("commits_summarized", github_url=github_url, commits=len(results), cached=cached)
+    return results
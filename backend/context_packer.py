@@ -0,0 +1,137 @@
+import os
+from typing import List, Optional, Tuple
+import numpy as np
+from rate_limiter import estimate_tokens
+
+# Prompt tokens available for retrieved code context, per answering model
+CONTEXT_BUDGETS = {
+    "gemini": int(os.getenv("CONTEXT_TOKENS_GEMINI", "6000")),
+    "groq": int(os.getenv("CONTEXT_TOKENS_GROQ", "2500")),
+}
+# Candidates fetched from the vector store before re-ranking
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "20"))
+# Maximal marginal relevance trade-off: 1.0 ranks by relevance only
+MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Candidates at least this similar to an already selected one are dropped
+DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.95"))
+# A snippet is only truncated to fit if at least this many tokens of it remain
+MIN_SNIPPET_TOKENS = 150
+
+CONTEXT_HEADER = "Here is relevant code context from the repository:\n\n"
+
+
+def _normalized(vectors: List[List[float]]) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def mmr_order(
+    docs: List[dict],
+    query_vector: Optional[List[float]],
+    lambda_: float = MMR_LAMBDA,
+    duplicate_similarity: float = DUPLICATE_SIMILARITY,
+) -> List[dict]:
+    """
+    Re-rank retrieved documents by maximal marginal relevance and drop near-duplicates.
+    Documents without an 'embedding' (keyword-only hits) keep their fused
+    rank; the embedded ones are re-ranked among the remaining positions.
+    Exact duplicate contents are always removed.
+    """
+    seen = set()
+    unique = []
+    for doc in docs:
+        fingerprint = (doc.get("content") or "").strip()
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        unique.append(doc)
+
+    if query_vector is None:
+        return unique
+    embedded = [doc for doc in unique if doc.get("embedding") and len(doc["embedding"]) == len(query_vector)]
+    if not embedded:
+        return unique
+
+    vectors = _normalized([doc["embedding"] for doc in embedded])
+    relevance = vectors @ _normalized([query_vector])[0]
+    similarity = vectors @ vectors.T
+
+    selected: List[int] = []
+    remaining = list(range(len(embedded)))
+    while remaining:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining), dtype=np.float32)
+        scores = lambda_ * relevance[remaining] - (1 - lambda_) * redundancy
+        best = int(np.argmax(scores))
+        index = remaining.pop(best)
+        if redundancy[best] >= duplicate_similarity:
+            continue
+        selected.append(index)
+
+    # Fill the embedded documents' positions in MMR order; dropped duplicates leave no gap
+    reranked = iter([embedded[i] for i in selected])
+    embedded_ids = {id(doc) for doc in embedded}
+    ordered = []
+    for doc in unique:
+        if id(doc) not in embedded_ids:
+            ordered.append(doc)
+            continue
+        following = next(reranked, None)
+        if following is not None:
+            ordered.append(following)
+    return ordered
+
+
+def format_snippet(doc: dict, content: Optional[str] = None) -> str:
+    location = doc.get("source", "")
+    if doc.get("start_line"):
+        location += f" (lines {doc['start_line']}-{doc['end_line']})"
+    content = doc.get("content", "") if content is None else content
+    return f"--- File: {location} ---\nSummary: {doc.get('summary', '')}\nContent:\n{content}\n\n"
+
+
+def pack_context(
+    docs: List[dict],
+    query_vector: Optional[List[float]],
+    budget_tokens: int,
+) -> Tuple[str, dict]:
+    """
+    Build the code context for a prompt within budget_tokens: candidates are
+    re-ranked with MMR and added best first while they fit; a snippet that
+    doesn't fit is truncated when enough budget is left for it to be useful,
+    which fills the budget.
+    Returns the context and stats (tokens used, documents used/dropped).
+    """
+    ranked = mmr_order(docs, query_vector)
+    used = estimate_tokens(CONTEXT_HEADER)
+    snippets = []
+    for doc in ranked:
+        snippet = format_snippet(doc)
+        tokens = estimate_tokens(snippet)
+        if used + tokens <= budget_tokens:
+            snippets.append(snippet)
+            used += tokens
+            continue
+        overhead = estimate_tokens(format_snippet(doc, ""))
+        room = budget_tokens - used - overhead
+        if room >= MIN_SNIPPET_TOKENS:
+            snippet = format_snippet(doc, doc.get("content", "")[:(room - 1) * 4] + "\n...")
+            snippets.append(snippet)
+            used += estimate_tokens(snippet)
+            break
+        # Too little room to truncate this one usefully; a shorter snippet may still fit
+
+    stats = {
+        "candidates": len(docs),
+        "duplicates_dropped": len(docs) - len(ranked),
+        "documents": len(snippets),
+        "context_tokens": used if snippets else 0,
+        "budget_tokens": budget_tokens,
+    }
+    if not snippets:
+        return "", stats
+    return CONTEXT_HEADER + "".join(snippets), stats
@@ -0,0 +1,114 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]],
+        max_batch_size: int = 100,
+        max_batch_chars: int = 200_000,
+        max_text_chars: int = 8_000,
+        max_concurrency: int = 4,
+        max_wait: float = 0.005,
+    ):
+        """
+        Coalesces embedding requests into provider batch calls.
+
+        embed_batch: coroutine embedding a list of texts in a single request
+        max_batch_size / max_batch_chars: provider limits for one request
+        max_text_chars: longer texts are truncated to the provider's input limit
+        max_concurrency: maximum number of batch requests in flight
+        max_wait: how long a partial batch waits for more texts before being sent
+
+        Identical texts that are pending or already in flight share one request.
+        """
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_batch_chars = max_batch_chars
+        self.max_text_chars = max_text_chars
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._flush_handle = None
+        self._tasks = set()
+        # Counters, useful to see how much batching and de-duplication save
+        self.requests = 0
+        self.texts_sent = 0
+        self.deduplicated = 0
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed the given texts, returning one vector per text in the same order
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            text = text[:self.max_text_chars]
+            future = self._in_flight.get(text)
+            if future is None:
+                future = loop.create_future()
+                # Mark the exception as retrieved so failures shared by several
+                # waiters don't log "exception was never retrieved"
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                self._in_flight[text] = future
+                if self._pending and (
+                    len(self._pending) >= self.max_batch_size
+                    or self._pending_chars + len(text) > self.max_batch_chars
+                ):
+                    self._flush()
+                self._pending.append(text)
+                self._pending_chars += len(text)
+            else:
+                self.deduplicated += 1
+            futures.append(future)
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._pending and self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        # Shielded: a cancelled caller must not cancel the futures other callers share
+        return list(await asyncio.gather(*[asyncio.shield(future) for future in futures]))
+
+    def _flush(self):
+        """
+        Send the pending texts as one batch request
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending, self._pending_chars = self._pending, [], 0
+        task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[str]):
+        try:
+            async with self._semaphore:
+                self.requests += 1
+                self.texts_sent += len(batch)
+                vectors = await self.embed_batch(batch)
+            if len(vectors) != len(batch):
+                raise ValueError(f"Expected {len(batch)} embeddings, got {len(vectors)}")
+            for text, vector in zip(batch, vectors):
+                future = self._in_flight.pop(text, None)
+                if future is not None and not future.done():
+                    future.set_result(vector)
+        except Exception as e:
+            for text in batch:
+                future = self._in_flight.pop(text, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+        finally:
+            # Cancelled (e.g. at shutdown): cancel the batch's futures instead of
+            # leaving their waiters, and later callers of the same texts, hanging
+            for text in batch:
+                future = self._in_flight.get(text)
+                if future is not None and not future.done():
+                    del self._in_flight[text]
+                    future.cancel()
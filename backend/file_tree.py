@@ -0,0 +1,148 @@
+import os
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+from summary_cache import SummaryCache, cache_key
+from metrics import record_cache
+
+# Directories deeper than this are shown as one summary node
+FILE_TREE_MAX_DEPTH = int(os.getenv("FILE_TREE_MAX_DEPTH", "4"))
+# Entries shown per directory; the rest are folded into a "more" node
+FILE_TREE_MAX_CHILDREN = int(os.getenv("FILE_TREE_MAX_CHILDREN", "20"))
+# Upper bound on the nodes of a graph, whatever the repository size
+FILE_TREE_MAX_NODES = int(os.getenv("FILE_TREE_MAX_NODES", "400"))
+# Bump whenever the graph format changes so cached graphs are rebuilt
+FILE_TREE_VERSION = "v1"
+
+# Graphs of already rendered commits
+graph_cache = SummaryCache(table="file_tree_graphs")
+
+
+class _Dir:
+    __slots__ = ("name", "depth", "dirs", "files", "total_files")
+
+    def __init__(self, name: str, depth: int):
+        self.name = name
+        self.depth = depth
+        self.dirs: Dict[str, "_Dir"] = {}
+        self.files: List[str] = []
+        # Files in this directory and all of its subdirectories
+        self.total_files = 0
+
+    def entries(self) -> list:
+        """
+        Subdirectories then files, each sorted by name
+        """
+        return [self.dirs[name] for name in sorted(self.dirs)] + sorted(self.files)
+
+
+def _build_trie(paths: Iterable[str]) -> _Dir:
+    root = _Dir("", 0)
+    for path in paths:
+        parts = [part for part in path.split("/") if part]
+        if not parts:
+            continue
+        node = root
+        node.total_files += 1
+        for part in parts[:-1]:
+            child = node.dirs.get(part)
+            if child is None:
+                child = node.dirs[part] = _Dir(part, node.depth + 1)
+            node = child
+            node.total_files += 1
+        node.files.append(parts[-1])
+    return root
+
+
+def _expanded_dirs(root: _Dir, max_depth: int, max_children: int, max_nodes: int) -> set:
+    """
+    Directories whose entries are shown, chosen breadth first until the node
+    budget is spent, so the top levels are always complete
+    """
+    expanded = set()
+    nodes = 1
+    queue = deque([root])
+    while queue:
+        node = queue.popleft()
+        if node is not root and node.depth >= max_depth:
+            continue
+        entries = node.entries()
+        shown = entries[:max_children]
+        cost = len(shown) + (len(entries) > len(shown))
+        if node is not root and nodes + cost > max_nodes:
+            continue
+        expanded.add(id(node))
+        nodes += cost
+        queue.extend(entry for entry in shown if isinstance(entry, _Dir))
+    return expanded
+
+
+def _label(text: str) -> str:
+    return '"' + text.replace('"', "#quot;") + '"'
+
+
+def _plural(count: int, word: str, plural: Optional[str] = None) -> str:
+    return f"{count} {word if count == 1 else plural or word + 's'}"
+
+
+def generate_file_tree_graph(
+    file_tree: Iterable[str],
+    root_label: str = "/",
+    max_depth: Optional[int] = None,
+    max_children: Optional[int] = None,
+    max_nodes: Optional[int] = None,
+) -> str:
+    """
+    Mermaid flowchart of the repository's files. Paths are merged into a trie,
+    so every directory is one node with a unique id and every edge appears
+    once. Directories deeper than max_depth, or left over once max_nodes are
+    used, become a single node with their file count; directories with more
+    than max_children entries list the first ones and a summary of the rest.
+    """
+    max_depth = FILE_TREE_MAX_DEPTH if max_depth is None else max_depth
+    max_children = FILE_TREE_MAX_CHILDREN if max_children is None else max_children
+    max_nodes = FILE_TREE_MAX_NODES if max_nodes is None else max_nodes
+
+    root = _build_trie(file_tree)
+    expanded = _expanded_dirs(root, max_depth, max_children, max_nodes)
+    lines = ["graph TD;", f"    n0[{_label(root_label)}]"]
+    ids = 1
+    queue = deque([(root, "n0")])
+    while queue:
+        node, node_id = queue.popleft()
+        entries = node.entries()
+        for entry in entries[:max_children]:
+            child_id = f"n{ids}"
+            ids += 1
+            if not isinstance(entry, _Dir):
+                label = entry
+            elif id(entry) in expanded:
+                label = f"{entry.name}/"
+                queue.append((entry, child_id))
+            else:
+                label = f"{entry.name}/ ({_plural(entry.total_files, 'file')})"
+            lines.append(f"    {node_id}-->{child_id}[{_label(label)}]")
+        hidden = entries[max_children:]
+        if hidden:
+            hidden_files = sum(entry.total_files if isinstance(entry, _Dir) else 1 for entry in hidden)
+            label = f"... {_plural(len(hidden), 'more entry', 'more entries')} ({_plural(hidden_files, 'file')})"
+            lines.append(f"    {node_id}-->n{ids}[{_label(label)}]")
+            ids += 1
+    return "\n".join(lines) + "\n"
+
+
+def file_tree_graph_for_commit(commit_sha: Optional[str], file_tree: List[str], root_label: str = "/") -> str:
+    """
+    generate_file_tree_graph, cached per commit (the file tree of a commit never changes)
+    """
+    if not commit_sha:
+        return generate_file_tree_graph(file_tree, root_label)
+    key = cache_key(
+        commit_sha, root_label, FILE_TREE_VERSION,
+        f"{FILE_TREE_MAX_DEPTH}:{FILE_TREE_MAX_CHILDREN}:{FILE_TREE_MAX_NODES}",
+    )
+    graph = graph_cache.get(key)
+    record_cache("file_tree_graph", graph is not None)
+    if graph is None:
+        graph = generate_file_tree_graph(file_tree, root_label)
+        graph_cache.set(key, graph)
+    return graph
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+from summary_cache import CACHE_DIR
+
+
+class IndexState:
+    def __init__(self, path: Optional[str] = None):
+        """
+        Records, per namespace, the last indexed commit and the blob SHA of every
+        indexed file, so a re-index only has to process what changed since then
+        """
+        self.path = path or os.path.join(CACHE_DIR, "index_state.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS namespaces (
+                namespace TEXT PRIMARY KEY,
+                commit_sha TEXT,
+                indexed_at REAL DEFAULT (strftime('%s','now'))
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                namespace TEXT NOT NULL,
+                source TEXT NOT NULL,
+                blob_sha TEXT NOT NULL,
+                PRIMARY KEY (namespace, source)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def get_commit(self, namespace: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT commit_sha FROM namespaces WHERE namespace = ?", (namespace,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_manifest(self, namespace: str) -> Dict[str, str]:
+        """
+        Return {source: blob_sha} for every file indexed in the namespace
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, blob_sha FROM files WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return dict(rows)
+
+    def save(self, namespace: str, commit_sha: str, manifest: Dict[str, str]):
+        """
+        Replace the recorded state of the namespace in a single transaction
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM files WHERE namespace = ?", (namespace,))
+                self._conn.executemany(
+                    "INSERT INTO files (namespace, source, blob_sha) VALUES (?, ?, ?)",
+                    [(namespace, source, sha) for source, sha in manifest.items()],
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO namespaces (namespace, commit_sha, indexed_at) "
+                    "VALUES (?, ?, strftime('%s','now'))",
+                    (namespace, commit_sha),
+                )
+
+    def clear(self, namespace: str):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM files WHERE namespace = ?", (namespace,))
+                self._conn.execute("DELETE FROM namespaces WHERE namespace = ?", (namespace,))
+
+
+def diff_manifests(
+    previous: Dict[str, str], current: Dict[str, str]
+) -> Tuple[List[str], List[str]]:
+    """
+    Compare two {source: blob_sha} manifests.
+    Returns (sources added or modified, sources deleted)
+    """
+    changed = [source for source, sha in current.items() if previous.get(source) != sha]
+    removed = [source for source in previous if source not in current]
+    return changed, removed
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+from metrics import JOBS_RUNNING, start_timings, log_event
+
+# Number of indexing jobs that may run at once; further jobs wait in the queue
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+# Finished jobs are kept this long (seconds) so their result can be fetched
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+
+
+class Job:
+    def __init__(self, kind: str, params: dict):
+        """
+        A background job and its progress. Runners report progress by setting
+        the stage and counters, or by tracking an IngestionPipeline.
+        """
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = "queued"
+        self.stage = "queued"
+        self.counters: Dict[str, int] = {}
+        self.result = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._pipeline = None
+        self._leader: Optional["Job"] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def track(self, pipeline):
+        """
+        Report the stage and counters of the given pipeline while it runs
+        """
+        self._pipeline = pipeline
+
+    def follow(self, leader: "Job"):
+        """
+        Report the progress of leader, the job doing the work this job waits for
+        (e.g. an indexing run of the same repository that was already in flight)
+        """
+        self._leader = leader
+
+    def _eta(self, counters: dict) -> Optional[float]:
+        """
+        Estimate the remaining indexing time from the store rate so far.
+        Only available once the loader has seen every file.
+        """
+        pipeline = self._pipeline
+        if pipeline is None or pipeline.started_at is None or pipeline.stage != "indexing":
+            return None
+        if not pipeline.loaded:
+            return None
+        done = counters.get("stored", 0)
+        total = counters.get("files_changed", 0)
+        elapsed = time.monotonic() - pipeline.started_at
+        if done == 0 or elapsed <= 0:
+            return None
+        return round((total - done) / (done / elapsed), 1)
+
+    def snapshot(self) -> dict:
+        if self._leader is not None and not self.finished:
+            leader = self._leader.snapshot()
+            stage, counters, eta = leader["stage"], leader["progress"], leader["eta_seconds"]
+        else:
+            stage, counters = self.stage, dict(self.counters)
+            if self._pipeline is not None and self.stage == "indexing":
+                stage = self._pipeline.stage
+                counters.update(self._pipeline.counters)
+            eta = self._eta(counters)
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": stage,
+            "progress": counters,
+            "eta_seconds": eta,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    def __init__(self, max_concurrent_jobs: int = MAX_CONCURRENT_JOBS, ttl: float = JOB_TTL):
+        """
+        Runs jobs in the background with a bounded number of concurrent jobs,
+        so indexing runs cannot starve the requests served by the same process
+        """
+        self.ttl = ttl
+        self._jobs: Dict[str, Job] = {}
+        self._keys: Dict[str, str] = {}
+        self._slots = asyncio.Semaphore(max_concurrent_jobs)
+
+    def submit(
+        self, kind: str, runner: Callable[[Job], Awaitable], key: Optional[str] = None, **params
+    ) -> Job:
+        """
+        Queue runner(job) for execution and return the job straight away.
+        key: while a job submitted with the same key is unfinished, that job is
+        returned instead of starting another one
+        """
+        self._purge()
+        if key is not None:
+            running = self._jobs.get(self._keys.get(key))
+            if running is not None and not running.finished:
+                return running
+        job = Job(kind, params)
+        self._jobs[job.id] = job
+        if key is not None:
+            self._keys[key] = job.id
+        job._task = asyncio.create_task(self._run(job, runner))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: Job):
+        """
+        Wait for the job to finish and return its result, or raise its error.
+        The job keeps running if the waiter is cancelled.
+        """
+        await asyncio.shield(job._task)
+        if job.status == "failed":
+            raise RuntimeError(job.error)
+        return job.result
+
+    async def _run(self, job: Job, runner: Callable[[Job], Awaitable]):
+        async with self._slots:
+            job.status = "running"
+            job.stage = "starting"
+            job.started_at = time.time()
+            JOBS_RUNNING.inc()
+            # The job's stage timings are logged when it finishes, not with the request that queued it
+            timings = start_timings()
+            try:
+                job.result = await runner(job)
+                job.status = "succeeded"
+                job.stage = "done"
+            except Exception as e:
+                print(f"Job {job.id} failed: {e}")
+                job.error = str(e)
+                job.status = "failed"
+                job.stage = "failed"
+            finally:
+                job.finished_at = time.time()
+                job._pipeline = None
+                JOBS_RUNNING.dec()
+                log_event(
+                    "job",
+                    job_id=job.id,
+                    kind=job.kind,
+                    status=job.status,
+                    duration_ms=round((job.finished_at - job.started_at) * 1000),
+                    stages=timings,
+                )
+
+    async def events(self, job: Job, interval: float = 1.0, keepalive: float = 15.0):
+        """
+        Server-Sent Events stream of job progress; ends when the job finishes
+        """
+        last = None
+        last_sent = time.monotonic()
+        while True:
+            snapshot = job.snapshot()
+            comparable = {k: v for k, v in snapshot.items() if k != "eta_seconds"}
+            if comparable != last:
+                last = comparable
+                last_sent = time.monotonic()
+                event = "done" if job.finished else "progress"
+                yield f"event: {event}\ndata: {json.dumps(snapshot)}\n\n"
+            elif time.monotonic() - last_sent > keepalive:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            if job.finished:
+                return
+            await asyncio.sleep(interval)
+
+    def _purge(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > self.ttl:
+                del self._jobs[job_id]
+        for key, job_id in list(self._keys.items()):
+            if job_id not in self._jobs:
+                del self._keys[key]
@@ -0,0 +1,261 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+from summary_cache import CACHE_DIR
+from vector_store import collection_name, document_id
+
+# Root directory of the per-namespace lexical indexes
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", os.path.join(CACHE_DIR, "lexical"))
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal rank fusion constant
+RRF_K = 60
+
+# Document properties kept with the index so lexical hits can be used as context
+_PROPERTIES = ("source", "content", "summary", "name", "chunk", "start_line", "end_line")
+
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[0-9]+")
+_SUBWORD = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+# Identifier-like query terms: snake_case, camelCase, dotted names, paths, calls
+_LEXICAL_TERM = re.compile(
+    r"`[^`]+`|\b\w+_\w+\b|\b[a-z]+[A-Z]\w*\b|\b\w+\.\w+\b|\w+/\w+|\b\w+\(\)"
+)
+_STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from",
+    "how", "i", "in", "is", "it", "of", "on", "or", "the", "this", "to", "used", "uses",
+    "what", "where", "which", "who", "why", "with", "me", "find", "show", "defined",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased words of the text; identifiers also yield their snake_case and
+    camelCase parts, so "serialise_github_url" matches a query for "github url"
+    """
+    tokens = []
+    for word in _WORD.findall(text):
+        tokens.append(word.lower())
+        parts = [part.lower() for piece in word.split("_") for part in _SUBWORD.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def query_terms(query: str) -> List[str]:
+    return sorted({token for token in tokenize(query) if token not in _STOP_WORDS and len(token) > 1})
+
+
+def looks_lexical(query: str) -> bool:
+    """
+    Whether the query names code (identifiers, file names, paths), so keyword
+    search alone is expected to find the right documents
+    """
+    return bool(_LEXICAL_TERM.search(query))
+
+
+def reciprocal_rank_fusion(result_lists: List[List[dict]], limit: int, k: int = RRF_K) -> List[dict]:
+    """
+    Merge ranked result lists: each document scores the sum of 1 / (k + rank)
+    over the lists it appears in. Properties (e.g. 'embedding') are merged.
+    """
+    fused: Dict[tuple, dict] = {}
+    scores: Counter = Counter()
+    for results in result_lists:
+        for rank, doc in enumerate(results, 1):
+            key = (doc.get("source"), doc.get("chunk"))
+            scores[key] += 1 / (k + rank)
+            merged = fused.setdefault(key, {})
+            for name, value in doc.items():
+                if merged.get(name) is None:
+                    merged[name] = value
+    ranked = []
+    for key, score in scores.most_common(limit):
+        doc = fused[key]
+        doc["score"] = score
+        ranked.append(doc)
+    return ranked
+
+
+class _LexicalNamespace:
+    def __init__(self, path: str):
+        """
+        BM25 inverted index of one namespace: a postings table of
+        (term, document, term frequency) and the document lengths
+        """
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                properties TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS docs_source ON docs (source);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+            """
+        )
+        self.conn.commit()
+
+    def _delete_ids(self, ids: List[str]):
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            self.conn.execute(f"DELETE FROM postings WHERE doc_id IN ({placeholders})", batch)
+            self.conn.execute(f"DELETE FROM docs WHERE id IN ({placeholders})", batch)
+
+    def _ids_of_sources(self, sources: List[str]) -> List[str]:
+        ids = []
+        for i in range(0, len(sources), 500):
+            batch = sources[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            ids.extend(row[0] for row in self.conn.execute(
+                f"SELECT id FROM docs WHERE source IN ({placeholders})", batch
+            ))
+        return ids
+
+    def replace(self, documents: List[dict]):
+        with self.conn:
+            self._delete_ids(self._ids_of_sources(sorted({doc["source"] for doc in documents})))
+            for doc in documents:
+                doc_id = doc.get("id") or document_id(doc["source"], doc.get("chunk"))
+                text = " ".join(
+                    str(doc.get(name) or "") for name in ("source", "name", "summary", "content")
+                )
+                counts = Counter(tokenize(text))
+                properties = {name: doc.get(name) for name in _PROPERTIES if name in doc}
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO docs (id, source, length, properties) VALUES (?, ?, ?, ?)",
+                    (doc_id, doc["source"], sum(counts.values()), json.dumps(properties)),
+                )
+                self.conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+                self.conn.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in counts.items()],
+                )
+
+    def delete_sources(self, sources: List[str]):
+        with self.conn:
+            self._delete_ids(self._ids_of_sources(list(sources)))
+
+    def prune(self, keep_sources: set) -> int:
+        stale = [
+            doc_id for doc_id, source in self.conn.execute("SELECT id, source FROM docs")
+            if source not in keep_sources
+        ]
+        with self.conn:
+            self._delete_ids(stale)
+        return len(stale)
+
+    def search(self, query: str, limit: int) -> List[dict]:
+        terms = query_terms(query)
+        if not terms:
+            return []
+        total, average_length = self.conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+        if not total:
+            return []
+        average_length = average_length or 1
+
+        placeholders = ",".join("?" * len(terms))
+        frequencies = dict(self.conn.execute(
+            f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", terms
+        ))
+        scores: Counter = Counter()
+        rows = self.conn.execute(
+            f"""SELECT p.term, p.doc_id, p.tf, d.length FROM postings p
+                JOIN docs d ON d.id = p.doc_id WHERE p.term IN ({placeholders})""",
+            terms,
+        )
+        for term, doc_id, tf, length in rows:
+            df = frequencies[term]
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+            scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        top = scores.most_common(limit)
+        if not top:
+            return []
+        found = dict(self.conn.execute(
+            f"SELECT id, properties FROM docs WHERE id IN ({','.join('?' * len(top))})",
+            [doc_id for doc_id, _ in top],
+        ))
+        docs = []
+        for doc_id, score in top:
+            if doc_id in found:
+                doc = json.loads(found[doc_id])
+                doc["score"] = score
+                docs.append(doc)
+        return docs
+
+
+class LexicalIndex:
+    def __init__(self, root: str = LEXICAL_INDEX_DIR):
+        """
+        Local BM25 keyword index over file chunks (path, name, summary and content),
+        one SQLite file per namespace. Built during ingestion next to the vector
+        store, so retrieval works without the embedding API.
+        """
+        self.root = root
+        self._namespaces: Dict[str, _LexicalNamespace] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, namespace: str) -> str:
+        name = re.sub(r"[^A-Za-z0-9_]", "_", collection_name(namespace))
+        return os.path.join(self.root, f"{name}.sqlite3")
+
+    def _get(self, namespace: str, create: bool = True) -> Optional[_LexicalNamespace]:
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            if ns is None:
+                if not create and not os.path.exists(self._path(namespace)):
+                    return None
+                os.makedirs(self.root, exist_ok=True)
+                ns = _LexicalNamespace(self._path(namespace))
+                self._namespaces[namespace] = ns
+            return ns
+
+    def exists(self, namespace: str) -> bool:
+        return namespace in self._namespaces or os.path.exists(self._path(namespace))
+
+    def replace(self, namespace: str, documents: List[dict]):
+        """
+        Replace every indexed chunk of the sources present in documents
+        """
+        ns = self._get(namespace)
+        with ns.lock:
+            ns.replace(documents)
+
+    def delete_sources(self, namespace: str, sources: List[str]):
+        ns = self._get(namespace, create=False)
+        if ns is not None:
+            with ns.lock:
+                ns.delete_sources(sources)
+
+    def prune(self, namespace: str, keep_sources: set) -> int:
+        ns = self._get(namespace)
+        with ns.lock:
+            return ns.prune(keep_sources)
+
+    def search(self, namespace: str, query: str, limit: int = 5) -> List[dict]:
+        """
+        Return the best BM25 matches for the query, best first, with a 'score'
+        """
+        ns = self._get(namespace, create=False)
+        if ns is None:
+            return []
+        with ns.lock:
+            return ns.search(query, limit)
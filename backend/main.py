@@ -1,16 +1,72 @@
-from dotenv import load_dotenv
 import os
 import asyncio
-from fastapi import FastAPI
-from pydantic import BaseModel
-from GithubLoader import GithubLoader
-import hashlib
-from _gemini import getSummary, getEmbeddings, ask, summarise_commit, ensure_collection_exists, store_embeddings
-from assembly import transcribe_file, ask_meeting
-
-load_dotenv()
-
-app = FastAPI()
+import time
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Dict, Optional
+from contextlib import asynccontextmanager
+from GithubLoader import GithubLoader, cleanup_checkouts
+from file_tree import file_tree_graph_for_commit
+from index_state import IndexState
+from pipeline import IngestionPipeline
+from jobs import Job, JobManager
+from _gemini import ask, ask_stream, ensure_collection_exists, collection_exists, warm_query_embeddings
+from assembly import transcribe_file, ask_meeting, ask_meeting_stream
+from streaming import sse_answer
+from commit_summary import MAX_BATCH_COMMITS, summarise_github_commit, summarise_commit_range, close_http_client
+from git import GitCommandError
+from metrics import HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS, start_timings, log_event, render_metrics
+from clients import registry, load_env, run_blocking, shutdown_blocking_executor
+from single_flight import indexing_flights, namespace_write_locks
+import httpx
+
+load_env()
+
+# Remove leftover checkouts and unused mirrors on a schedule (seconds)
+CHECKOUT_CLEANUP_INTERVAL = float(os.getenv("CHECKOUT_CLEANUP_INTERVAL", "3600"))
+CHECKOUT_MAX_AGE = float(os.getenv("CHECKOUT_MAX_AGE", "3600"))
+MIRROR_MAX_AGE = float(os.getenv("MIRROR_MAX_AGE", str(7 * 24 * 3600)))
+# SDK clients to create in the background at startup (comma-separated, e.g.
+# "genai,groq,vector_store"); the others are created on first use
+WARM_UP_CLIENTS = [name for name in os.getenv("WARM_UP_CLIENTS", "").split(",") if name.strip()]
+
+
+async def cleanup_checkouts_periodically():
+    while True:
+        try:
+            removed = await run_blocking(cleanup_checkouts, CHECKOUT_MAX_AGE, MIRROR_MAX_AGE)
+            if removed:
+                print(f"Removed {removed} stale checkouts and mirrors")
+        except Exception as e:
+            print(f"Error cleaning up checkouts: {e}")
+        await asyncio.sleep(CHECKOUT_CLEANUP_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.clients = registry
+    if WARM_UP_CLIENTS:
+        asyncio.create_task(registry.warm_up([name.strip() for name in WARM_UP_CLIENTS]))
+    cleanup_task = asyncio.create_task(cleanup_checkouts_periodically())
+    # The onboarding questions are asked for every repository; embed them once up front
+    asyncio.create_task(warm_query_embeddings(ONBOARDING_QUESTIONS))
+    yield
+    cleanup_task.cancel()
+    await close_http_client()
+    await registry.close()
+    shutdown_blocking_executor()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Last indexed commit and file manifest per namespace, for incremental re-indexing
+index_state = IndexState()
+
+# Background indexing jobs, run in a bounded pool
+job_manager = JobManager()
+# Job of the indexing run in flight per namespace, followed by the jobs that join it
+_indexing_jobs: Dict[str, Job] = {}
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -23,6 +79,67 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    """
+    Record the latency of every request and log it with its per-stage timings.
+    Streaming responses are measured until their headers are sent.
+    """
+    if request.url.path in ("/metrics", "/health"):
+        return await call_next(request)
+    timings = start_timings()
+    started = time.perf_counter()
+    status = 500
+    HTTP_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        duration = time.perf_counter() - started
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.labels(request.method, path, str(status)).observe(duration)
+        log_event(
+            "request",
+            method=request.method,
+            path=path,
+            status=status,
+            duration_ms=round(duration * 1000, 1),
+            stages=timings,
+        )
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics: stage latencies, provider tokens/retries/429s, cache hit rates, concurrency
+    """
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/health")
+async def health():
+    """
+    Liveness and client status; does not create any client
+    """
+    return {"status": "ok", "clients": registry.status()}
+
+
+@app.post("/warm-up")
+async def warm_up():
+    """
+    Create every SDK client (imports and connections) now instead of on first use
+    """
+    clients = await registry.warm_up()
+    return {
+        "status": "ok" if all(state == "ready" for state in clients.values()) else "degraded",
+        "clients": clients,
+    }
+
+
 class GenerateDocumentationRequest(BaseModel):
     github_url: str
 
@@ -46,102 +163,84 @@ def serialise_github_url(url):
     return sanitized
 
 
-def generate_file_tree_graph(file_tree):
-    graph = "graph TD;\n"
+# Questions answered for every repository to build its onboarding documentation
+ONBOARDING_QUESTIONS = [
+    "What is the project about?",
+    "How can I get started with this project?",
+    "What does the project's repository contain?",
+    "Are there any coding standards or guidelines I should follow?",
+    "What dependencies, packages, APIs, or libraries does the project use? Look into the package.json file.",
+    "How can I build and compile the project?",
+    "What should I know about testing in this project?",
+    "How can I contribute to the project?",
+    "How are issues tracked in this project?",
+    "What's the version control strategy for this project?",
+    "Tell me about the project's CI/CD pipeline.",
+    "Where should I add documentation and comments in the codebase?",
+]
+
+
+async def run_documentation(github_url: str, job: Job) -> dict:
+    """
+    Index the repository and generate its documentation and file tree graph,
+    reporting progress on the given job. A request for a repository that is
+    already being indexed waits for that run's result instead of starting another.
+    """
+    namespace = serialise_github_url(github_url)
+    if indexing_flights.running(namespace):
+        leader = _indexing_jobs.get(namespace)
+        if leader is not None and leader is not job:
+            job.follow(leader)
+    else:
+        _indexing_jobs[namespace] = job
+
+    async def lead():
+        try:
+            return await _run_documentation(github_url, namespace, job)
+        finally:
+            if _indexing_jobs.get(namespace) is job:
+                del _indexing_jobs[namespace]
+
+    return await indexing_flights.do(namespace, lead)
+
+
+async def _run_documentation(github_url: str, namespace: str, job: Job) -> dict:
+    # Incremental re-indexing: only files whose content changed since the last
+    # indexed commit go through the pipeline. Without previous state (or if the
+    # collection was dropped) every file is processed and unknown objects are pruned.
+    previous_commit = await run_blocking(index_state.get_commit, namespace)
+    previous_manifest = (
+        await run_blocking(index_state.get_manifest, namespace)
+        if await run_blocking(collection_exists, namespace) else {}
+    )
+    log_event("indexing", github_url=github_url, last_commit=previous_commit)
 
-    for item in file_tree:
-        if "/" in item:
-            parent_dir, current_dir = item.rsplit("/", 1)
-            graph += f"    {parent_dir}-->{current_dir}\n"
+    # Ensure collection exists
+    await run_blocking(ensure_collection_exists, namespace)
+
+    # Stream files through summarize -> embed -> store
+    pipeline = IngestionPipeline(GithubLoader(), github_url, namespace, previous_manifest)
+    job.stage = "indexing"
+    job.track(pipeline)
+    if await pipeline.run():
+        async with namespace_write_locks.hold(namespace):
+            await run_blocking(index_state.save, namespace, pipeline.head_commit, pipeline.indexed_manifest)
+    job.counters.update(pipeline.counters)
+    mermaid_graph = await run_blocking(
+        file_tree_graph_for_commit, pipeline.head_commit, pipeline.file_tree, github_url.rstrip("/").split("/")[-1]
+    )
 
-    return graph
+    questions = ONBOARDING_QUESTIONS
+    job.stage = "answering questions"
+    job.counters["questions_total"] = len(questions)
+    job.counters["questions_answered"] = 0
 
+    async def answer(question):
+        response = await ask(question, namespace)
+        job.counters["questions_answered"] += 1
+        return response
 
-@app.post("/generate_documentation")
-async def generate_documentation(body: GenerateDocumentationRequest):
-    github_loader = GithubLoader()
-    loader = github_loader.load(body.github_url)
-    raw_documents = loader.load()
-    file_tree = [i.metadata["source"] for i in raw_documents]
-    mermaid_graph = generate_file_tree_graph(file_tree)
-
-    print(f"Processing {len(raw_documents)} files from repository")
-    
-    # Process summaries in batches to avoid rate limits
-    BATCH_SIZE = 10
-    summaries = []
-    
-    for i in range(0, len(raw_documents), BATCH_SIZE):
-        batch = raw_documents[i:i + BATCH_SIZE]
-        batch_num = (i // BATCH_SIZE) + 1
-        total_batches = (len(raw_documents) + BATCH_SIZE - 1) // BATCH_SIZE
-        
-        print(f"Processing batch {batch_num}/{total_batches} ({len(batch)} files)...")
-        
-        batch_summaries = await asyncio.gather(
-            *[getSummary(doc.metadata["source"], doc.page_content) for doc in batch]
-        )
-        summaries.extend(batch_summaries)
-        
-        # Add delay between batches to respect rate limits (except for last batch)
-        if i + BATCH_SIZE < len(raw_documents):
-            print("Waiting 2 seconds before next batch...")
-            await asyncio.sleep(2)
-    
-    print(f"Generated {len(summaries)} summaries")
-    
-    for i, doc in enumerate(raw_documents):
-        doc.metadata["summary"] = summaries[i]
-
-    embeddings = await asyncio.gather(
-        *[getEmbeddings(doc.metadata["summary"]) for doc in raw_documents]
-    )
-    print("got summary")
-    for i, doc in enumerate(raw_documents):
-        doc.metadata["embedding"] = embeddings[i]
-    print("got embeddings")
-
-    # Store embeddings in Weaviate vector database
-    namespace = serialise_github_url(body.github_url)
-    
-    # Ensure collection exists
-    ensure_collection_exists(namespace)
-    
-    # Prepare documents for storage
-    documents_to_store = []
-    for doc in raw_documents:
-        documents_to_store.append({
-            "source": doc.metadata["source"],
-            "content": doc.page_content,
-            "summary": doc.metadata["summary"],
-            "embedding": doc.metadata["embedding"]
-        })
-    
-    # Store in Weaviate
-    await store_embeddings(documents_to_store, namespace)
-    print(f"Stored {len(documents_to_store)} documents in Weaviate")
-    
-
-    questions = [
-        "What is the project about?",
-        "How can I get started with this project?",
-        "What does the project's repository contain?",
-        "Are there any coding standards or guidelines I should follow?",
-        "What dependencies, packages, APIs, or libraries does the project use? Look into the package.json file.",
-        "How can I build and compile the project?",
-        "What should I know about testing in this project?",
-        "How can I contribute to the project?",
-        "How are issues tracked in this project?",
-        "What's the version control strategy for this project?",
-        "Tell me about the project's CI/CD pipeline.",
-        "Where should I add documentation and comments in the codebase?",
-    ]
-    answers = await asyncio.gather(
-        *[
-            ask(question, serialise_github_url(body.github_url))
-            for question in questions
-        ]
-    )
+    answers = await asyncio.gather(*[answer(question) for question in questions])
     # documentation = {}
     # for i, question in enumerate(questions):
     #     documentation[question] = answers[i]
@@ -149,7 +248,7 @@ async def generate_documentation(body: GenerateDocumentationRequest):
     for i, question in enumerate(questions):
         documentation.append({"question": question, "answer": answers[i]})
 
-    projectName = body.github_url.split("/")[-1]
+    projectName = github_url.split("/")[-1]
     documentation = f"""<h1>{projectName}</h1>
   <ul>
   <li><a href="#introduction">Introduction</a></li>
@@ -191,10 +290,89 @@ async def generate_documentation(body: GenerateDocumentationRequest):
     return {"documentation": documentation, "mermaid": mermaid_graph}
 
 
+@app.post("/generate_documentation")
+async def generate_documentation(body: GenerateDocumentationRequest):
+    """
+    Synchronous variant of /jobs/generate_documentation: the run takes one of
+    the job manager's slots like any other, and the response is its result
+    """
+    job = job_manager.submit(
+        "generate_documentation",
+        lambda job: run_documentation(body.github_url, job),
+        key=serialise_github_url(body.github_url),
+        github_url=body.github_url,
+    )
+    return await job_manager.wait(job)
+
+
+@app.post("/jobs/generate_documentation")
+async def submit_documentation_job(body: GenerateDocumentationRequest):
+    """
+    Start indexing and documentation generation in the background.
+    Poll /jobs/{job_id} or stream /jobs/{job_id}/events, then fetch /jobs/{job_id}/result
+    """
+    # A repository already being indexed returns the running job
+    job = job_manager.submit(
+        "generate_documentation",
+        lambda job: run_documentation(body.github_url, job),
+        key=serialise_github_url(body.github_url),
+        github_url=body.github_url,
+    )
+    return {"job_id": job.id, "status": job.status}
+
+
+def _get_job(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return _get_job(job_id).snapshot()
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = _get_job(job_id)
+    return StreamingResponse(
+        job_manager.events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = _get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return job.result
+
+
 @app.post("/ask")
 async def query(body: AskRequest):
-    response = await ask(body.query, serialise_github_url(body.github_url))
-    return {"message": response}
+    context_stats = {}
+    response = await ask(body.query, serialise_github_url(body.github_url), context_stats)
+    return {"message": response, "context": context_stats}
+
+
+@app.post("/ask/stream")
+async def query_stream(body: AskRequest):
+    """
+    Answer as Server-Sent Events: 'token' events while the answer is generated,
+    then a 'done' event with the time to first token and the context stats
+    """
+    context_stats = {}
+    chunks = ask_stream(body.query, serialise_github_url(body.github_url), context_stats)
+    return StreamingResponse(
+        sse_answer(chunks, "ask", context_stats),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 class summariseCommitBody(BaseModel):
@@ -203,21 +381,40 @@ class summariseCommitBody(BaseModel):
 
 
 @app.post("/summarise-commit")
-def summariseCommits(body: summariseCommitBody):
-    import requests
-
-    response = requests.get(
-        f"{body.github_url}/commit/{body.commitHash}.diff",
-        headers={
-            "Accept": "application/vnd.github.v3.diff",
-            "Authorization": f"token {os.getenv('GITHUB_PERSONAL_ACCESS_TOKEN')}",
-        },
-    )
-    summary = summarise_commit(str(response.content[:10000]))
+async def summariseCommits(body: summariseCommitBody):
+    try:
+        summary = await summarise_github_commit(body.github_url, body.commitHash)
+    except httpx.HTTPError as e:
+        print(f"Error fetching commit diff: {e}")
+        raise HTTPException(status_code=502, detail=f"Could not fetch the commit diff: {e}")
     print("summary for commit", summary)
     return {"summary": summary}
 
 
+class summariseCommitRangeBody(BaseModel):
+    github_url: str
+    # A revision range such as "v1.0..main"; defaults to the history of HEAD
+    range: Optional[str] = Field(None, pattern=r"^[^-]")
+    # Only the last N commits of the range
+    last: int = Field(50, ge=1, le=MAX_BATCH_COMMITS)
+
+
+@app.post("/summarise-commits")
+async def summariseCommitRange(body: summariseCommitRangeBody):
+    """
+    Summarize a range of commits in one call, with diffs computed from the
+    local mirror of the repository; already summarized commits come from the cache
+    """
+    try:
+        commits = await summarise_commit_range(body.github_url, body.range, body.last)
+    except GitCommandError as e:
+        print(f"Error reading commits: {e}")
+        raise HTTPException(status_code=400, detail=f"Could not read commits: {e.stderr or e}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"commits": commits}
+
+
 class transcribeMeetingBody(BaseModel):
     url: str
 
@@ -241,6 +438,16 @@ async def askMeeting(body: askMeetingBody):
     return {"answer": response}
 
 
+@app.post("/ask-meeting/stream")
+async def askMeetingStream(body: askMeetingBody):
+    chunks = ask_meeting_stream(body.url, body.query, body.quote)
+    return StreamingResponse(
+        sse_answer(chunks, "ask-meeting"),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # async def main():
 #     embeddings = await asyncio.gather(*[getEmbeddings(text) for text in texts])
 #     print(len(embeddings))
@@ -0,0 +1,132 @@
+import contextvars
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+logger = logging.getLogger("codepulse")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "codepulse_stage_seconds",
+    "Latency of a pipeline or request stage (clone, load, chunking, summary, embedding, "
+    "vector_store_write, retrieval, generation, ...)",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter("codepulse_stage_errors_total", "Stage runs that raised", ["stage"])
+STAGE_IN_PROGRESS = Gauge("codepulse_stage_in_progress", "Stage runs currently in progress", ["stage"])
+
+PROVIDER_REQUESTS = Counter("codepulse_provider_requests_total", "Requests sent to a provider", ["provider"])
+PROVIDER_TOKENS = Counter(
+    "codepulse_provider_tokens_total",
+    "Tokens exchanged with a provider (direction: sent or received)",
+    ["provider", "direction"],
+)
+PROVIDER_RETRIES = Counter("codepulse_provider_retries_total", "Requests retried after a 429", ["provider"])
+PROVIDER_RATE_LIMITED = Counter("codepulse_provider_rate_limited_total", "429 responses", ["provider"])
+RATE_LIMIT_SCALE = Gauge(
+    "codepulse_rate_limit_scale", "Current fraction of the configured rate a limiter allows", ["provider"]
+)
+
+CACHE_REQUESTS = Counter("codepulse_cache_requests_total", "Cache lookups (result: hit or miss)", ["cache", "result"])
+SUMMARIES_SKIPPED = Counter(
+    "codepulse_summaries_skipped_total",
+    "File summaries produced without an LLM request (reason: template or duplicate)",
+    ["reason"],
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "codepulse_http_request_seconds",
+    "Latency of HTTP requests until the response starts",
+    ["method", "route", "status"],
+    buckets=_LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge("codepulse_http_requests_in_flight", "HTTP requests being handled")
+JOBS_RUNNING = Gauge("codepulse_jobs_running", "Background jobs currently running")
+SINGLE_FLIGHT_SHARED = Counter(
+    "codepulse_single_flight_shared_total",
+    "Calls that attached to an identical computation already in flight (flight: indexing or ask)",
+    ["flight"],
+)
+
+# Stage timings of the current request or job: {stage: {"count": n, "ms": total}}
+_timings: contextvars.ContextVar[Optional[Dict[str, dict]]] = contextvars.ContextVar(
+    "codepulse_timings", default=None
+)
+
+
+def start_timings() -> Dict[str, dict]:
+    """
+    Start collecting stage timings for the current request or job (and the
+    tasks and threads it starts)
+    """
+    timings: Dict[str, dict] = {}
+    _timings.set(timings)
+    return timings
+
+
+def observe(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        entry = timings.setdefault(stage, {"count": 0, "ms": 0.0})
+        entry["count"] += 1
+        entry["ms"] = round(entry["ms"] + seconds * 1000, 1)
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Time a stage: latency histogram, in-progress gauge, error counter and the
+    current request's timings
+    """
+    STAGE_IN_PROGRESS.labels(stage).inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except GeneratorExit:
+        # A stream closed early by its consumer is not a failure
+        raise
+    except BaseException:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_IN_PROGRESS.labels(stage).dec()
+        observe(stage, time.perf_counter() - started)
+
+
+def record_tokens(provider: str, sent: Optional[int] = None, received: Optional[int] = None):
+    if sent:
+        PROVIDER_TOKENS.labels(provider, "sent").inc(sent)
+    if received:
+        PROVIDER_TOKENS.labels(provider, "received").inc(received)
+
+
+def record_cache(cache: str, hit: bool, count: int = 1):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc(count)
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """
+    Structured log line: one JSON object per event
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, default=str))
+
+
+def render_metrics():
+    """
+    Current metrics in the Prometheus text format, with its content type
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,352 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+from summary_cache import git_blob_sha
+from blob_store import blob_store, text_digest
+from chunking import chunk_file, chunker_key, file_outline
+from triage import template_summary
+from index_state import diff_manifests
+from _gemini import EMBEDDING_MODEL, getSummary, getEmbeddingsBatch, store_embeddings
+from metrics import SUMMARIES_SKIPPED, timed, observe, log_event, record_cache
+from clients import run_blocking
+
+# Stage sizing; queues between stages are bounded so memory stays flat
+SUMMARY_WORKERS = int(os.getenv("PIPELINE_SUMMARY_WORKERS", "8"))
+EMBED_BATCH_SIZE = int(os.getenv("PIPELINE_EMBED_BATCH_SIZE", "50"))
+STORE_BATCH_SIZE = int(os.getenv("PIPELINE_STORE_BATCH_SIZE", "100"))
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "64"))
+# Processes used to parse files into chunks
+CHUNK_WORKERS = int(os.getenv("PIPELINE_CHUNK_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_DONE = object()
+_chunk_pool = None
+
+
+def _get_chunk_pool() -> ProcessPoolExecutor:
+    global _chunk_pool
+    if _chunk_pool is None:
+        _chunk_pool = ProcessPoolExecutor(max_workers=CHUNK_WORKERS)
+    return _chunk_pool
+
+
+async def chunk_document(source: str, content: str) -> List[dict]:
+    """
+    Split a file into chunks in the process pool, so parsing doesn't hold the event loop
+    """
+    global _chunk_pool
+    loop = asyncio.get_running_loop()
+    with timed("chunking"):
+        try:
+            return await loop.run_in_executor(_get_chunk_pool(), chunk_file, source, content)
+        except BrokenProcessPool:
+            _chunk_pool = None
+            return await run_blocking(chunk_file, source, content)
+
+
+async def chunk_blob(source: str, content: str, blob_sha: str) -> List[dict]:
+    """
+    Chunks of a file, rebuilt from the global blob store when the same content
+    was chunked before by any repository
+    """
+    chunker = chunker_key(source)
+    chunks = await run_blocking(blob_store.get_chunks, blob_sha, chunker, content)
+    record_cache("chunk_layout", chunks is not None)
+    if chunks is None:
+        chunks = await chunk_document(source, content)
+        await run_blocking(blob_store.set_chunks, blob_sha, chunker, chunks)
+    return chunks
+
+
+def embedding_text(doc: dict) -> str:
+    """
+    Text embedded for a chunk: its location, the file summary and the code itself
+    """
+    header = f"{doc['source']} lines {doc['start_line']}-{doc['end_line']}"
+    if doc.get("name"):
+        header += f" ({doc['name']})"
+    return f"{header}\n{doc['summary']}\n{doc['content']}"
+
+
+class IngestionPipeline:
+    def __init__(self, github_loader, github_url: str, namespace: str, previous_manifest: Dict[str, str]):
+        """
+        Streams a repository into the vector store:
+        load -> chunk + summarize -> embed -> store, with bounded queues between stages.
+        Each file is split into function/class chunks that are embedded and
+        stored separately; a file's chunks always travel through the stages together.
+
+        Files are read one at a time from the checkout and unchanged files
+        (same blob SHA as in previous_manifest) are dropped right away, so only
+        changed files travel through the pipeline. Embedding and storing run
+        concurrently with summarization. Chunk layouts, summaries and chunk
+        embeddings are looked up by blob SHA in the global stores first, so
+        content indexed by another repository (e.g. the upstream of a fork)
+        costs no parsing or provider calls.
+        """
+        self.github_loader = github_loader
+        self.github_url = github_url
+        self.namespace = namespace
+        self.previous_manifest = previous_manifest
+        self.file_tree: List[str] = []
+        self.manifest: Dict[str, str] = {}
+        self.failed_sources = set()
+        self.removed_sources: List[str] = []
+        self.stage = "pending"
+        self.counters = {
+            "files_loaded": 0,
+            "files_changed": 0,
+            "summarized": 0,
+            # LLM summary requests saved by triage: template summaries and identical files
+            "summaries_templated": 0,
+            "summaries_deduplicated": 0,
+            "llm_calls_avoided": 0,
+            "chunks": 0,
+            # Chunk embeddings taken from the global blob store
+            "embeddings_reused": 0,
+            "embedded": 0,
+            "stored": 0,
+        }
+        self.started_at = None
+        # Summary request per blob SHA, shared by the files with that content
+        self._blob_summaries: Dict[str, asyncio.Future] = {}
+        # True once the loader has read every file
+        self.loaded = False
+        self._stop = threading.Event()
+
+    @property
+    def head_commit(self) -> Optional[str]:
+        return self.github_loader.head_commit
+
+    @property
+    def indexed_manifest(self) -> Dict[str, str]:
+        """
+        Manifest to record as indexed; failed files are left out so they are retried
+        """
+        return {
+            source: sha for source, sha in self.manifest.items()
+            if source not in self.failed_sources
+        }
+
+    async def run(self) -> bool:
+        """
+        Run the pipeline. Returns False if removed files could not be deleted,
+        in which case the index state should not be recorded. Files that could
+        not be summarized or stored are left out of indexed_manifest.
+        """
+        self.started_at = time.monotonic()
+        self.stage = "cloning"
+        with timed("clone"):
+            loader = await run_blocking(self.github_loader.load, self.github_url)
+
+        self.stage = "indexing"
+        load_queue = asyncio.Queue(QUEUE_SIZE)
+        embed_queue = asyncio.Queue(QUEUE_SIZE)
+        store_queue = asyncio.Queue(max(1, QUEUE_SIZE // EMBED_BATCH_SIZE))
+        loop = asyncio.get_running_loop()
+
+        producer = asyncio.ensure_future(run_blocking(self._produce, loader, load_queue, loop))
+        summarizers = [
+            asyncio.create_task(self._summarize(load_queue, embed_queue))
+            for _ in range(SUMMARY_WORKERS)
+        ]
+        embedder = asyncio.create_task(self._embed(embed_queue, store_queue))
+        storer = asyncio.create_task(self._store(store_queue))
+
+        async def summarize_stage():
+            await asyncio.gather(*summarizers)
+            await embed_queue.put(_DONE)
+
+        summarize_task = asyncio.create_task(summarize_stage())
+        try:
+            # Fails fast if any stage fails, so no stage is left blocked on a full queue
+            await asyncio.gather(producer, summarize_task, embedder, storer)
+        except BaseException:
+            self._stop.set()
+            for task in [*summarizers, summarize_task, embedder, storer, *self._blob_summaries.values()]:
+                task.cancel()
+            # The loader thread cannot be cancelled; it sees the stop flag within a
+            # second, and the checkout it reads from is only removed once it returned
+            await asyncio.gather(producer, return_exceptions=True)
+            raise
+        finally:
+            # Every file has been read; the checkout is no longer needed
+            await run_blocking(self.github_loader.cleanup)
+
+        self.stage = "finalizing"
+        _, self.removed_sources = diff_manifests(self.previous_manifest, self.manifest)
+        ok = True
+        if self.removed_sources or not self.previous_manifest:
+            ok = await store_embeddings(
+                [],
+                self.namespace,
+                removed_sources=self.removed_sources,
+                keep_sources=None if self.previous_manifest else list(self.manifest),
+            )
+        self.stage = "done"
+        log_event(
+            "indexed",
+            namespace=self.namespace,
+            removed=len(self.removed_sources),
+            failed=len(self.failed_sources),
+            seconds=round(time.monotonic() - self.started_at, 1),
+            **self.counters,
+        )
+        return ok
+
+    def _put(self, queue: asyncio.Queue, item, loop):
+        """
+        Put an item on an asyncio queue from the loader thread, with backpressure
+        """
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                return future.result(timeout=1)
+            except concurrent.futures.TimeoutError:
+                if self._stop.is_set():
+                    future.cancel()
+                    raise RuntimeError("Pipeline stopped")
+
+    def _produce(self, loader, load_queue: asyncio.Queue, loop):
+        try:
+            started = time.perf_counter()
+            for doc in loader.lazy_load():
+                # Time spent reading and filtering the files up to this one
+                observe("load", time.perf_counter() - started)
+                source = doc.metadata["source"]
+                blob_sha = doc.metadata.get("blob_sha") or git_blob_sha(doc.page_content)
+                doc.metadata["blob_sha"] = blob_sha
+                self.file_tree.append(source)
+                self.manifest[source] = blob_sha
+                self.counters["files_loaded"] += 1
+                if self.previous_manifest.get(source) == blob_sha:
+                    started = time.perf_counter()
+                    continue
+                self.counters["files_changed"] += 1
+                self._put(load_queue, doc, loop)
+                started = time.perf_counter()
+            self.loaded = True
+        finally:
+            if not self._stop.is_set():
+                self._put(load_queue, _DONE, loop)
+
+    async def _summarize(self, load_queue: asyncio.Queue, embed_queue: asyncio.Queue):
+        while True:
+            doc = await load_queue.get()
+            if doc is _DONE:
+                # Let the other workers see the end of the stream too
+                await load_queue.put(_DONE)
+                return
+            source = doc.metadata["source"]
+            content = doc.page_content
+            blob_sha = doc.metadata["blob_sha"]
+            chunks = await chunk_blob(source, content, blob_sha)
+            summary = template_summary(source, content, chunks)
+            if summary is not None:
+                self._avoided_llm_call("template")
+            else:
+                summary = await self._summarize_blob(source, content, blob_sha, chunks)
+            if summary.startswith("Unable to generate summary"):
+                self.failed_sources.add(source)
+            self.counters["summarized"] += 1
+            self.counters["chunks"] += len(chunks)
+            for chunk in chunks:
+                chunk["source"] = source
+                chunk["blob_sha"] = blob_sha
+                chunk["summary"] = summary
+            await embed_queue.put(chunks)
+
+    def _avoided_llm_call(self, reason: str):
+        self.counters["summaries_templated" if reason == "template" else "summaries_deduplicated"] += 1
+        self.counters["llm_calls_avoided"] += 1
+        SUMMARIES_SKIPPED.labels(reason).inc()
+
+    async def _summarize_blob(self, source: str, content: str, blob_sha: str, chunks: List[dict]) -> str:
+        """
+        LLM summary of a file's content; files with the same content (copies,
+        vendored duplicates) share one request within the run
+        """
+        task = self._blob_summaries.get(blob_sha)
+        if task is not None:
+            self._avoided_llm_call("duplicate")
+            return await task
+        # Describe what the summary prompt's 10,000 character excerpt leaves out
+        outline = file_outline(chunks, after_line=content[:10000].count("\n") + 1)
+        task = asyncio.ensure_future(getSummary(source, content, blob_sha, outline))
+        self._blob_summaries[blob_sha] = task
+        return await task
+
+    async def _embed(self, embed_queue: asyncio.Queue, store_queue: asyncio.Queue):
+        done = False
+        while not done:
+            # Batch whole files, up to EMBED_BATCH_SIZE chunks (a larger file goes alone)
+            files = []
+            size = 0
+            item = await embed_queue.get()
+            while item is not _DONE:
+                files.append(item)
+                size += len(item)
+                if size >= EMBED_BATCH_SIZE:
+                    break
+                try:
+                    item = embed_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+            done = item is _DONE
+            if files:
+                chunks = [chunk for file_chunks in files for chunk in file_chunks]
+                embeddings = await self._embed_chunks(chunks)
+                for chunk, embedding in zip(chunks, embeddings):
+                    chunk["embedding"] = embedding
+                self.counters["embedded"] += len(files)
+                await store_queue.put(files)
+        await store_queue.put(_DONE)
+
+    async def _embed_chunks(self, chunks: List[dict]) -> List[List[float]]:
+        """
+        Embeddings of the chunks: vectors already in the global blob store are
+        reused, only the others are requested and then added to the store
+        """
+        texts = [embedding_text(chunk) for chunk in chunks]
+        keys = [(chunk["blob_sha"], text_digest(text)) for chunk, text in zip(chunks, texts)]
+        stored = await run_blocking(blob_store.get_embeddings, EMBEDDING_MODEL, keys)
+        missing = [i for i, key in enumerate(keys) if key not in stored]
+        record_cache("chunk_embedding", True, len(keys) - len(missing))
+        record_cache("chunk_embedding", False, len(missing))
+        self.counters["embeddings_reused"] += len(keys) - len(missing)
+        if missing:
+            vectors = await getEmbeddingsBatch([texts[i] for i in missing])
+            new = {}
+            for i, vector in zip(missing, vectors):
+                stored[keys[i]] = vector
+                if not any(vector):
+                    # Failed requests come back as zero vectors: keep the file out
+                    # of the manifest so the next run embeds it again
+                    self.failed_sources.add(chunks[i]["source"])
+                elif chunks[i]["source"] not in self.failed_sources:
+                    new[keys[i]] = vector
+            if new:
+                await run_blocking(blob_store.set_embeddings, EMBEDDING_MODEL, new)
+        return [stored[key] for key in keys]
+
+    async def _store(self, store_queue: asyncio.Queue):
+        pending = []
+        pending_files = 0
+        while True:
+            files = await store_queue.get()
+            if files is not _DONE:
+                for file_chunks in files:
+                    pending.extend(file_chunks)
+                pending_files += len(files)
+            if pending and (files is _DONE or len(pending) >= STORE_BATCH_SIZE):
+                if not await store_embeddings(pending, self.namespace):
+                    self.failed_sources.update(doc["source"] for doc in pending)
+                self.counters["stored"] += pending_files
+                pending = []
+                pending_files = 0
+            if files is _DONE:
+                return
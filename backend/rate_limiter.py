@@ -0,0 +1,227 @@
+import asyncio
+import os
+import re
+import time
+from typing import Awaitable, Callable, Dict, Optional
+from metrics import (
+    PROVIDER_RATE_LIMITED, PROVIDER_REQUESTS, PROVIDER_RETRIES, RATE_LIMIT_SCALE, observe,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate for rate limiting (~4 characters per token)
+    """
+    return max(1, len(text) // 4)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    error_str = str(error).lower()
+    return (
+        "rate_limit" in error_str
+        or "rate limit" in error_str
+        or "429" in error_str
+        or "quota" in error_str
+        or "resource_exhausted" in error_str
+    )
+
+
+def parse_retry_after(error: Exception) -> Optional[float]:
+    """
+    Extract the suggested wait time (in seconds) from a provider error, if any.
+    Understands Retry-After headers, Groq's "Please try again in 1m2.5s" and
+    Gemini's "retry_delay { seconds: 37 }"
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        retry_after = headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+
+    error_str = str(error)
+    match = re.search(r"try again in (?:(\d+)m)?([\d.]+)(ms|s)", error_str)
+    if match:
+        minutes = float(match.group(1) or 0)
+        value = float(match.group(2))
+        if match.group(3) == "ms":
+            value /= 1000
+        return minutes * 60 + value
+    match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", error_str)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        burst_seconds: float = 10.0,
+        min_scale: float = 0.1,
+    ):
+        """
+        Token-bucket rate limiter enforcing requests-per-minute and
+        tokens-per-minute limits for one provider.
+
+        Buckets hold at most burst_seconds worth of quota, so callers are paced
+        at a steady rate instead of bursting and then stalling. The refill rate
+        is scaled down multiplicatively on every 429 and recovers additively on
+        every successful call (AIMD), and retry-after hints pause the limiter.
+        """
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.burst_seconds = burst_seconds
+        self.min_scale = min_scale
+        self.scale = 1.0
+        self._requests = self._request_capacity
+        self._tokens = self._token_capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        # Counters
+        self.total_requests = 0
+        self.total_tokens = 0
+        self.rate_limited = 0
+
+    @property
+    def _request_capacity(self) -> float:
+        return max(1.0, self.requests_per_minute / 60 * self.burst_seconds)
+
+    @property
+    def _token_capacity(self) -> float:
+        return max(1.0, self.tokens_per_minute / 60 * self.burst_seconds)
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(
+            self._request_capacity,
+            self._requests + elapsed * self.requests_per_minute / 60 * self.scale,
+        )
+        self._tokens = min(
+            self._token_capacity,
+            self._tokens + elapsed * self.tokens_per_minute / 60 * self.scale,
+        )
+
+    async def acquire(self, tokens: int = 1) -> int:
+        """
+        Wait until one request of the given (estimated) token size may be sent.
+        Waiters are served in FIFO order. Returns the tokens charged.
+        """
+        # A request larger than the bucket would wait forever: it only waits for a
+        # full bucket, and is still charged in full (the bucket goes into debt)
+        needed = min(tokens, self._token_capacity)
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._blocked_until - time.monotonic()
+                if wait <= 0:
+                    if self._requests >= 1 and self._tokens >= needed:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        self.total_requests += 1
+                        self.total_tokens += tokens
+                        PROVIDER_REQUESTS.labels(self.name).inc()
+                        observe(f"rate_limit_wait_{self.name}", time.monotonic() - started)
+                        return tokens
+                    request_rate = self.requests_per_minute / 60 * self.scale
+                    token_rate = self.tokens_per_minute / 60 * self.scale
+                    wait = max(
+                        (1 - self._requests) / request_rate,
+                        (needed - self._tokens) / token_rate,
+                    )
+                await asyncio.sleep(max(wait, 0.01))
+
+    def record_success(self, charged_tokens: int = 0, actual_tokens: Optional[int] = None):
+        """
+        Recover the rate after a successful call and correct the token bucket
+        with the provider-reported usage, when available: charged_tokens is
+        what acquire() took for the call
+        """
+        self.scale = min(1.0, self.scale + 0.05)
+        RATE_LIMIT_SCALE.labels(self.name).set(self.scale)
+        if actual_tokens is not None:
+            difference = actual_tokens - charged_tokens
+            self._tokens -= difference
+            self.total_tokens += difference
+
+    def record_rate_limited(self, retry_after: Optional[float] = None):
+        """
+        Back off after a 429: halve the rate and pause until the retry-after hint
+        """
+        self.rate_limited += 1
+        self.scale = max(self.min_scale, self.scale / 2)
+        PROVIDER_RATE_LIMITED.labels(self.name).inc()
+        RATE_LIMIT_SCALE.labels(self.name).set(self.scale)
+        self._tokens = min(self._tokens, 0)
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable],
+        estimated_tokens: int,
+        max_retries: int = 3,
+        usage: Optional[Callable[[object], Optional[int]]] = None,
+    ):
+        """
+        Run call() under the rate limit, retrying on rate limit errors.
+        usage extracts the actual token count from the response, if available.
+        estimated_tokens should include the expected output tokens.
+        """
+        for attempt in range(max_retries):
+            charged = await self.acquire(estimated_tokens)
+            try:
+                response = await call()
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                retry_after = parse_retry_after(e) or 2 ** attempt
+                self.record_rate_limited(retry_after)
+                if attempt == max_retries - 1:
+                    raise
+                print(f"⚠️ {self.name} rate limited, retrying in {retry_after:.1f}s...")
+                PROVIDER_RETRIES.labels(self.name).inc()
+                continue
+            actual_tokens = None
+            if usage is not None:
+                try:
+                    actual_tokens = usage(response)
+                except Exception:
+                    actual_tokens = None
+            self.record_success(charged, actual_tokens)
+            return response
+
+
+# Per-provider limits; override with environment variables
+_DEFAULT_LIMITS = {
+    "groq": (float(os.getenv("GROQ_RPM", "30")), float(os.getenv("GROQ_TPM", "6000"))),
+    "gemini": (float(os.getenv("GEMINI_RPM", "10")), float(os.getenv("GEMINI_TPM", "250000"))),
+    "gemini_embedding": (
+        float(os.getenv("GEMINI_EMBEDDING_RPM", "1500")),
+        float(os.getenv("GEMINI_EMBEDDING_TPM", "1000000")),
+    ),
+}
+
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def get_limiter(provider: str) -> RateLimiter:
+    """
+    Return the shared rate limiter for the given provider
+    """
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        requests_per_minute, tokens_per_minute = _DEFAULT_LIMITS[provider]
+        limiter = RateLimiter(provider, requests_per_minute, tokens_per_minute)
+        _limiters[provider] = limiter
+    return limiter
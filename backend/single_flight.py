@@ -0,0 +1,69 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+from metrics import SINGLE_FLIGHT_SHARED, log_event
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        """
+        Coalesces concurrent calls with the same key: the first caller starts
+        the work, callers arriving while it runs wait for the same result (or
+        error). The work runs as its own task, so a caller going away does not
+        cancel it for the others.
+        """
+        self.name = name
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def running(self, key: Hashable) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> T:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(work())
+            self._tasks[key] = task
+
+            def forget(done: asyncio.Task):
+                if self._tasks.get(key) is done:
+                    del self._tasks[key]
+                # Nobody may be awaiting any more; don't log "exception never retrieved"
+                if not done.cancelled():
+                    done.exception()
+
+            task.add_done_callback(forget)
+        else:
+            SINGLE_FLIGHT_SHARED.labels(self.name).inc()
+            log_event("single_flight_shared", flight=self.name, key=str(key))
+        return await asyncio.shield(task)
+
+
+class KeyedLock:
+    def __init__(self):
+        """
+        One asyncio lock per key, created on demand and dropped when unused
+        """
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._users: Dict[Hashable, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+
+# Indexing runs per namespace, answers per (namespace, normalized question)
+indexing_flights = SingleFlight("indexing")
+ask_flights = SingleFlight("ask")
+# Serializes writes to a namespace's vector store collection, lexical index and index state
+namespace_write_locks = KeyedLock()
@@ -0,0 +1,39 @@
+import json
+import time
+from typing import AsyncIterator, Optional
+from metrics import observe, log_event
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def sse_answer(
+    chunks: AsyncIterator[str], label: str, stats: Optional[dict] = None
+) -> AsyncIterator[str]:
+    """
+    Server-Sent Events stream of an answer: a 'token' event per piece of text,
+    then a 'done' event with the time to first token, total time and stats
+    (read once the answer is complete, so producers may fill it while streaming)
+    """
+    started = time.monotonic()
+    first_token = None
+    try:
+        async for text in chunks:
+            if first_token is None:
+                first_token = time.monotonic()
+            yield sse_event("token", {"text": text})
+    except Exception as e:
+        print(f"Error streaming {label}: {e}")
+        yield sse_event("error", {"error": str(e)})
+        return
+    total = time.monotonic() - started
+    ttft = None if first_token is None else first_token - started
+    timing = {
+        "ttft_ms": None if ttft is None else round(ttft * 1000),
+        "total_ms": round(total * 1000),
+    }
+    if ttft is not None:
+        observe(f"ttft_{label}", ttft)
+    log_event("streamed", endpoint=label, **timing)
+    yield sse_event("done", {**timing, **(stats or {})})
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+# Default location of the on-disk caches; override with CODEPULSE_CACHE_DIR
+CACHE_DIR = os.getenv(
+    "CODEPULSE_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "codepulse"),
+)
+
+
+def git_blob_sha(content) -> str:
+    """
+    Compute the git blob SHA-1 of the given file content, identical to
+    `git hash-object`, so cache keys match the blob ids stored in the repo
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    header = f"blob {len(content)}\0".encode("utf-8")
+    return hashlib.sha1(header + content).hexdigest()
+
+
+def cache_key(*parts: str) -> str:
+    """
+    Build a cache key from its parts (e.g. blob sha, model name, prompt version)
+    """
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    def __init__(self, path: Optional[str] = None, table: str = "summaries"):
+        """
+        Persistent, content-addressed key/value store backed by SQLite.
+        Safe to share between threads; every write is committed immediately.
+        """
+        self.path = path or os.path.join(CACHE_DIR, "summaries.sqlite3")
+        self.table = table
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL DEFAULT (strftime('%s','now')))"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                (key, value),
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
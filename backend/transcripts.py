@@ -0,0 +1,271 @@
+import asyncio
+import json
+import os
+import time
+import re
+from typing import List, Optional
+from urllib.parse import unquote, urlparse, urlunparse
+from clients import registry, run_blocking
+
+# Transcription backend: "assemblyai", or "local" (transcript files, works offline; opt-in)
+MEETING_TRANSCRIBER = os.getenv("MEETING_TRANSCRIBER", "assemblyai")
+# The local transcriber only reads transcripts under this directory...
+MEETING_TRANSCRIPT_DIR = os.getenv("MEETING_TRANSCRIPT_DIR", "")
+# ...or downloads them from these hosts (comma-separated; none by default)
+MEETING_TRANSCRIPT_HOSTS = frozenset(
+    host.strip().lower() for host in os.getenv("MEETING_TRANSCRIPT_HOSTS", "").split(",") if host.strip()
+)
+# Segments group consecutive utterances up to this long (seconds) and this many characters
+MEETING_SEGMENT_SECONDS = int(os.getenv("MEETING_SEGMENT_SECONDS", "60"))
+MEETING_SEGMENT_CHARS = int(os.getenv("MEETING_SEGMENT_CHARS", "1500"))
+# AssemblyAI jobs are polled this often (seconds), and given up on after the timeout
+MEETING_POLL_SECONDS = float(os.getenv("MEETING_POLL_SECONDS", "3"))
+MEETING_TRANSCRIPTION_TIMEOUT = float(os.getenv("MEETING_TRANSCRIPTION_TIMEOUT", "3600"))
+
+_TRANSCRIPT_EXTENSIONS = (".vtt", ".srt", ".json", ".txt")
+_TIMESTAMP = r"(?:(\d+):)?(\d{1,2}):(\d{2})(?:[.,](\d{1,3}))?"
+_CUE_TIMING = re.compile(rf"^\s*{_TIMESTAMP}\s*-->\s*{_TIMESTAMP}", re.MULTILINE)
+_TIMED_LINE = re.compile(rf"^\s*\[?{_TIMESTAMP}\]?\s+(.*)$")
+_SPEAKER = re.compile(r"^([A-Z][\w .'-]{0,40}):\s+(.*)$")
+_VOICE_TAG = re.compile(r"<v(?:\.[^ >]*)?\s+([^>]+)>")
+_TAG = re.compile(r"<[^>]+>")
+
+
+def _ms(hours, minutes, seconds, fraction) -> int:
+    fraction = (fraction or "0").ljust(3, "0")
+    return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(fraction)
+
+
+def _utterance(start_ms: int, end_ms: int, text: str, speaker: Optional[str] = None) -> dict:
+    return {"start_ms": start_ms, "end_ms": end_ms, "speaker": speaker, "text": " ".join(text.split())}
+
+
+def _parse_json(text: str) -> List[dict]:
+    """
+    A list of {start, end, text, speaker} in milliseconds, or an object with
+    such a list under "utterances" (the AssemblyAI export format)
+    """
+    data = json.loads(text)
+    items = data
+    if isinstance(data, dict):
+        items = data.get("utterances") or data.get("segments") or []
+    return [
+        _utterance(int(item["start"]), int(item["end"]), item["text"], item.get("speaker"))
+        for item in items
+        if item.get("text")
+    ]
+
+
+def _parse_cues(text: str) -> List[dict]:
+    """
+    WebVTT and SRT cues, with <v Speaker> voice tags
+    """
+    utterances = []
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        match = _CUE_TIMING.match(lines[i])
+        i += 1
+        if match is None:
+            continue
+        groups = match.groups()
+        cue = []
+        while i < len(lines) and lines[i].strip():
+            cue.append(lines[i].strip())
+            i += 1
+        body = " ".join(cue)
+        voice = _VOICE_TAG.search(body)
+        speaker = voice.group(1).strip() if voice else None
+        body = _TAG.sub("", body)
+        if speaker is None:
+            named = _SPEAKER.match(body)
+            if named:
+                speaker, body = named.groups()
+        if body.strip():
+            utterances.append(_utterance(_ms(*groups[:4]), _ms(*groups[4:]), body, speaker))
+    return utterances
+
+
+def _parse_timed_lines(text: str) -> List[dict]:
+    """
+    Plain text with a timestamp at the start of each utterance
+    ("[00:01:02] Alice: ..."); untimed lines continue the previous utterance,
+    which ends where the next one starts
+    """
+    utterances = []
+    for line in text.splitlines():
+        match = _TIMED_LINE.match(line)
+        if match:
+            groups = match.groups()
+            body, speaker = groups[4], None
+            named = _SPEAKER.match(body)
+            if named:
+                speaker, body = named.groups()
+            start = _ms(*groups[:4])
+            if utterances:
+                utterances[-1]["end_ms"] = max(utterances[-1]["start_ms"], start)
+            utterances.append(_utterance(start, start, body, speaker))
+        elif line.strip() and utterances:
+            utterances[-1]["text"] += " " + " ".join(line.split())
+    if utterances:
+        # Assume about 150 words per minute for the last utterance
+        last = utterances[-1]
+        last["end_ms"] = last["start_ms"] + len(last["text"].split()) * 400
+    return [u for u in utterances if u["text"]]
+
+
+def parse_transcript(text: str, name: str = "") -> List[dict]:
+    """
+    Utterances ({start_ms, end_ms, speaker, text}) of a WebVTT, SRT, JSON or
+    timestamped plain-text transcript, in chronological order
+    """
+    stripped = text.lstrip("\ufeff").lstrip()
+    if name.endswith(".json") or stripped.startswith(("[{", "{")):
+        utterances = _parse_json(stripped)
+    elif _CUE_TIMING.search(stripped[:2000]) or stripped.startswith("WEBVTT"):
+        utterances = _parse_cues(stripped)
+    else:
+        utterances = _parse_timed_lines(stripped)
+    return sorted(utterances, key=lambda u: u["start_ms"])
+
+
+def segment_transcript(
+    utterances: List[dict], max_seconds: Optional[int] = None, max_chars: Optional[int] = None
+) -> List[dict]:
+    """
+    Group consecutive utterances into timestamped segments of at most
+    max_seconds and max_chars (a longer utterance makes a segment of its own)
+    """
+    max_ms = (MEETING_SEGMENT_SECONDS if max_seconds is None else max_seconds) * 1000
+    max_chars = MEETING_SEGMENT_CHARS if max_chars is None else max_chars
+    segments = []
+    current = None
+    for utterance in utterances:
+        line = f"{utterance['speaker']}: {utterance['text']}" if utterance.get("speaker") else utterance["text"]
+        if current is not None and (
+            utterance["end_ms"] - current["start_ms"] <= max_ms
+            and len(current["text"]) + len(line) < max_chars
+        ):
+            current["text"] += "\n" + line
+            current["end_ms"] = max(current["end_ms"], utterance["end_ms"])
+            continue
+        current = {
+            "segment": len(segments),
+            "start_ms": utterance["start_ms"],
+            "end_ms": utterance["end_ms"],
+            "text": line,
+        }
+        segments.append(current)
+    return segments
+
+
+def _transcript_candidates(url: str) -> List[str]:
+    """
+    The url itself when it is a transcript, else transcripts stored next to
+    the recording (meeting.mp3 -> meeting.vtt, meeting.srt, ...)
+    """
+    parsed = urlparse(url)
+    if parsed.path.lower().endswith(_TRANSCRIPT_EXTENSIONS):
+        return [url]
+    stem = os.path.splitext(parsed.path)[0]
+    return [
+        urlunparse(parsed._replace(path=stem + extension, query="", fragment=""))
+        for extension in _TRANSCRIPT_EXTENSIONS
+    ]
+
+
+def _resolve_local(location: str) -> Optional[str]:
+    """
+    Real path of a transcript under MEETING_TRANSCRIPT_DIR (location is relative
+    to it, or an absolute path / file:// URL inside it), or None if it points
+    anywhere else
+    """
+    if not MEETING_TRANSCRIPT_DIR:
+        return None
+    parsed = urlparse(location)
+    if parsed.scheme not in ("", "file"):
+        return None
+    root = os.path.realpath(MEETING_TRANSCRIPT_DIR)
+    path = os.path.realpath(os.path.join(root, unquote(parsed.path)))
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return path
+
+
+def _allowed_remote(location: str) -> bool:
+    parsed = urlparse(location)
+    return parsed.scheme in ("http", "https") and (parsed.hostname or "").lower() in MEETING_TRANSCRIPT_HOSTS
+
+
+def _read_local(path: str) -> Optional[str]:
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+class LocalTranscriber:
+    """
+    Stand-in for a speech-to-text service: reads the recording's transcript
+    (WebVTT, SRT, JSON or timestamped text) from the url itself or from a file
+    next to the recording. Works offline and costs nothing, so the rest of the
+    meeting pipeline can run without AssemblyAI.
+
+    Only files under MEETING_TRANSCRIPT_DIR are read, and transcripts are only
+    downloaded from the hosts in MEETING_TRANSCRIPT_HOSTS (redirects are not
+    followed): the url comes from the request body.
+    """
+    name = "local"
+
+    async def transcribe(self, url: str) -> List[dict]:
+        for candidate in _transcript_candidates(url):
+            if _allowed_remote(candidate):
+                import httpx
+                async with httpx.AsyncClient(timeout=30, follow_redirects=False) as client:
+                    response = await client.get(candidate)
+                text = response.text if response.status_code == 200 else None
+            else:
+                path = _resolve_local(candidate)
+                if path is None:
+                    raise ValueError(f"Transcript location not allowed: {url}")
+                text = await run_blocking(_read_local, path)
+            if text is not None:
+                return parse_transcript(text, urlparse(candidate).path.lower())
+        raise ValueError(f"No transcript found for {url}")
+
+
+class AssemblyAITranscriber:
+    """
+    Transcribes the recording with AssemblyAI (speaker labels on). The job is
+    submitted and then polled from the event loop: a long meeting does not
+    hold a blocking executor thread while AssemblyAI works on it.
+    """
+    name = "assemblyai"
+
+    async def transcribe(self, url: str) -> List[dict]:
+        # The SDK uploads local paths; only transcribe recordings it downloads itself
+        if urlparse(url).scheme not in ("http", "https"):
+            raise ValueError(f"Recording must be an http(s) URL: {url}")
+        aai = await registry.aget("assemblyai")
+        transcriber = aai.Transcriber(config=aai.TranscriptionConfig(speaker_labels=True))
+        transcript = await run_blocking(transcriber.submit, url)
+        deadline = time.monotonic() + MEETING_TRANSCRIPTION_TIMEOUT
+        while transcript.status in (aai.TranscriptStatus.queued, aai.TranscriptStatus.processing):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Transcription of {url} timed out")
+            await asyncio.sleep(MEETING_POLL_SECONDS)
+            transcript = await run_blocking(aai.Transcript.get_by_id, transcript.id)
+        if transcript.status == aai.TranscriptStatus.error:
+            raise RuntimeError(f"Transcription failed: {transcript.error}")
+        return [
+            _utterance(u.start, u.end, u.text, f"Speaker {u.speaker}" if u.speaker else None)
+            for u in transcript.utterances or []
+        ]
+
+
+def get_transcriber():
+    if MEETING_TRANSCRIBER == "assemblyai":
+        return AssemblyAITranscriber()
+    if MEETING_TRANSCRIBER == "local":
+        return LocalTranscriber()
+    raise ValueError(f"Unknown transcriber: {MEETING_TRANSCRIBER}")
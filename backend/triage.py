@@ -0,0 +1,174 @@
+import os
+import re
+from typing import List, Optional
+
+# Files with at most this many characters of code (comments and blank lines
+# excluded) get a template summary instead of an LLM one
+TRIAGE_MAX_CHARS = int(os.getenv("TRIAGE_MAX_CHARS", "120"))
+# Names listed in a template summary
+_MAX_NAMES = 20
+
+# Comment syntax per file extension (or file name): line comment prefixes and
+# the block comment delimiters. "#" is code in C-family files (#include,
+# #define) and "*" is a selector in CSS, so markers are never shared blindly;
+# files of other types only drop blank lines.
+_HASH = (("#",), None)
+_C_FAMILY = (("//",), ("/*", "*/"))
+_JS_FAMILY = (("//", "#!"), ("/*", "*/"))
+_COMMENT_SYNTAX = {
+    **dict.fromkeys(
+        (".py", ".pyi", ".pyw", ".sh", ".bash", ".zsh", ".fish", ".rb", ".pl", ".pm", ".r", ".jl",
+         ".ex", ".exs", ".yaml", ".yml", ".toml", ".cfg", ".conf", ".tf", ".cmake", ".ps1", ".coffee",
+         "Dockerfile", "Makefile", ".gitignore", ".dockerignore", ".gitattributes", ".editorconfig", ".env"),
+        _HASH,
+    ),
+    **dict.fromkeys(
+        (".c", ".h", ".cc", ".cpp", ".cxx", ".hpp", ".hh", ".hxx", ".m", ".mm", ".cs", ".java", ".kt",
+         ".kts", ".scala", ".groovy", ".gradle", ".go", ".rs", ".swift", ".dart", ".proto", ".zig",
+         ".scss", ".less"),
+        _C_FAMILY,
+    ),
+    **dict.fromkeys((".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx"), _JS_FAMILY),
+    ".css": ((), ("/*", "*/")),
+    ".php": (("//", "#"), ("/*", "*/")),
+    ".sql": (("--",), ("/*", "*/")),
+    ".lua": (("--",), ("--[[", "]]")),
+    ".hs": (("--",), ("{-", "-}")),
+    ".ini": ((";", "#"), None),
+    **dict.fromkeys((".html", ".htm", ".xml", ".svg", ".vue", ".md"), ((), ("<!--", "-->"))),
+}
+_NO_COMMENTS = ((), None)
+_GENERATED_MARKER = re.compile(
+    r"@generated|do not edit|code generated by|auto-?generated|"
+    r"generated by the protocol buffer compiler|this file was generated",
+    re.IGNORECASE,
+)
+_GENERATED_NAME = re.compile(
+    r"(_pb2(_grpc)?\.py|\.pb\.go|\.pb\.(cc|h)|\.g\.dart|\.designer\.cs|\.generated\.\w+|\.pyi|\.d\.ts)$"
+)
+# Statements of modules that only import and re-export other modules
+_PYTHON_REEXPORT = re.compile(r"^(from\s+(\S+)\s+import\s+.+|import\s+(\S+).*|__all__\s*=.*)$")
+_JS_REEXPORT = re.compile(
+    r"""^(export\s+(\*|\*\s+as\s+\w+|\{[^}]*\}|type\s+\{[^}]*\})\s+from\s+['"]([^'"]+)['"];?"""
+    r"""|import\s+.*\s+from\s+['"]([^'"]+)['"];?"""
+    r"""|module\.exports\s*=\s*require\(['"]([^'"]+)['"]\);?|export\s*\{[^}]*\};?|export\s+default\s+\w+;?"""
+    r"""|['"]use strict['"];?)$"""
+)
+
+
+def _comment_syntax(source: str):
+    name = os.path.basename(source)
+    extension = os.path.splitext(name)[1].lower()
+    return _COMMENT_SYNTAX.get(extension) or _COMMENT_SYNTAX.get(name, _NO_COMMENTS)
+
+
+def _code_lines(source: str, content: str) -> List[str]:
+    """
+    Lines of the file without blank lines and comments, using the comment
+    syntax of the file's language
+    """
+    prefixes, block = _comment_syntax(source)
+    lines = []
+    in_block = False
+    for line in content.splitlines():
+        line = line.strip()
+        if not in_block and block and line.startswith(block[0]):
+            line, in_block = line[len(block[0]):], True
+        if in_block:
+            if block[1] not in line:
+                continue
+            # Code after the end of a block comment still counts
+            line, in_block = line.split(block[1], 1)[1].strip(), False
+        if line and not line.startswith(prefixes):
+            lines.append(line)
+    return lines
+
+
+def _join_parenthesized(lines: List[str]) -> List[str]:
+    """
+    Join Python imports spread over several lines ("from x import (\\n a,\\n b\\n)")
+    """
+    joined = []
+    for line in lines:
+        if joined and joined[-1].count("(") > joined[-1].count(")"):
+            joined[-1] += " " + line
+        else:
+            joined.append(line)
+    return joined
+
+
+def _reexported_modules(source: str, lines: List[str]) -> Optional[List[str]]:
+    """
+    Modules a re-export module imports from, or None if the file does more than re-exporting
+    """
+    modules = []
+    if source.endswith(".py"):
+        for line in _join_parenthesized(lines):
+            match = _PYTHON_REEXPORT.match(line)
+            if match is None:
+                return None
+            module = match.group(2) or match.group(3)
+            if module:
+                modules.append(module.rstrip(","))
+    else:
+        # A barrel re-exports with "export ... from" (or module.exports = require());
+        # side-effect imports ("import './styles.css'") don't match, so such files are summarized
+        reexports = False
+        for line in lines:
+            match = _JS_REEXPORT.match(line)
+            if match is None:
+                return None
+            module = match.group(3) or match.group(4) or match.group(5)
+            if module:
+                modules.append(module)
+            reexports = reexports or bool(match.group(3) or match.group(5))
+        if not reexports:
+            return None
+    return list(dict.fromkeys(modules))
+
+
+def _names(chunks: List[dict]) -> str:
+    names = [chunk["name"] for chunk in chunks if chunk.get("name")]
+    listed = ", ".join(names[:_MAX_NAMES])
+    if len(names) > _MAX_NAMES:
+        listed += f" and {len(names) - _MAX_NAMES} more"
+    return listed
+
+
+def template_summary(source: str, content: str, chunks: List[dict]) -> Optional[str]:
+    """
+    Deterministic summary of a file that is not worth an LLM call: empty and
+    tiny files, modules that only re-export others, and generated code or
+    type stubs. Returns None for every other file.
+    """
+    name = os.path.basename(source)
+    directory = os.path.dirname(source) or "the repository root"
+    lines = _code_lines(source, content)
+
+    if not lines:
+        if name == "__init__.py":
+            return f"Empty `__init__.py` that marks `{directory}` as a Python package."
+        return f"`{source}` is empty (or only contains comments)."
+
+    if _GENERATED_NAME.search(name) or _GENERATED_MARKER.search(content[:1000]):
+        if name.endswith((".pyi", ".d.ts")):
+            summary = f"Type declarations `{source}` (no implementation)."
+        else:
+            summary = f"Generated file `{source}`, not meant to be edited by hand."
+        names = _names(chunks)
+        return summary + (f" It defines {names}." if names else "")
+
+    modules = _reexported_modules(source, lines)
+    if modules is not None:
+        if name == "__init__.py":
+            summary = f"Package initializer of `{directory}`"
+        else:
+            summary = f"`{source}` is an entry point module"
+        if modules:
+            return summary + " that re-exports names from " + ", ".join(f"`{m}`" for m in modules) + "."
+        return summary + " with imports only."
+
+    code = "\n".join(lines)
+    if len(code) <= TRIAGE_MAX_CHARS:
+        return f"Short file `{source}` ({len(lines)} line{'s' if len(lines) != 1 else ''} of code):\n{code}"
+    return None
@@ -0,0 +1,585 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from typing import Dict, List, Optional
+import numpy as np
+from summary_cache import CACHE_DIR
+
+# Weaviate Cloud cluster used by the default backend
+WEAVIATE_URL = os.getenv(
+    "WEAVIATE_URL", "https://opbbo1qysuwd9s67rowxg.c0.asia-southeast1.gcp.weaviate.cloud"
+)
+# Root directory of the embedded backend's per-namespace indexes
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", os.path.join(CACHE_DIR, "vectors"))
+# Namespaces with at least this many vectors are searched with an approximate (IVF) index
+ANN_THRESHOLD = int(os.getenv("VECTOR_ANN_THRESHOLD", "50000"))
+
+
+def document_id(source: str, chunk: Optional[int] = None) -> str:
+    """
+    Deterministic object id for a file (or one of its chunks), so re-indexing
+    overwrites it in place. Same value as weaviate.util.generate_uuid5(key).
+    """
+    key = source if chunk is None else f"{source}#{chunk}"
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, key))
+
+
+def collection_name(namespace: str) -> str:
+    """
+    Sanitize namespace to create valid Weaviate collection name
+    Remove all special characters: :, ., -, /
+    """
+    sanitized = namespace.replace(':', '_').replace('.', '_').replace('-', '_').replace('/', '_')
+    return f"CodeDoc_{sanitized}"
+
+
+class VectorStore:
+    """
+    Interface of the vector stores holding one collection of documents per
+    namespace. Documents are dicts with 'source', 'content', 'summary',
+    'embedding', optional chunk metadata ('chunk', 'start_line', 'end_line',
+    'name') and optionally 'id' (defaults to document_id(source, chunk)).
+    """
+    name = "base"
+    available = False
+
+    def namespace_exists(self, namespace: str) -> bool:
+        raise NotImplementedError
+
+    def ensure_namespace(self, namespace: str) -> bool:
+        raise NotImplementedError
+
+    def upsert(self, namespace: str, documents: List[dict]) -> bool:
+        raise NotImplementedError
+
+    def delete_sources(self, namespace: str, sources: List[str]):
+        raise NotImplementedError
+
+    def replace(self, namespace: str, documents: List[dict]) -> bool:
+        """
+        Replace every document of the sources present in documents (a file's
+        chunk count may have changed) with the given documents
+        """
+        self.delete_sources(namespace, sorted({doc.get("source", "") for doc in documents}))
+        return self.upsert(namespace, documents)
+
+    def prune(self, namespace: str, keep_sources: set) -> int:
+        """
+        Delete every document whose source is not in keep_sources; returns the number deleted
+        """
+        raise NotImplementedError
+
+    def search(
+        self, namespace: str, vector: List[float], limit: int = 5, include_vectors: bool = False
+    ) -> List[dict]:
+        """
+        Return the documents closest to the vector, best first, with a 'score'
+        (and their 'embedding' when include_vectors is set)
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class WeaviateVectorStore(VectorStore):
+    name = "weaviate"
+
+    def __init__(self, cluster_url: str = WEAVIATE_URL, api_key: Optional[str] = None):
+        # Collections whose source property is matched exactly (field tokenization)
+        self._exact_source: Dict[str, bool] = {}
+        try:
+            import weaviate
+            from weaviate.classes.config import Configure, Property, DataType, Tokenization
+            from weaviate.classes.query import Filter
+
+            self._Configure, self._Property, self._DataType = Configure, Property, DataType
+            self._Tokenization = Tokenization
+            self._Filter = Filter
+            self.client = weaviate.connect_to_weaviate_cloud(
+                cluster_url=cluster_url,
+                auth_credentials=weaviate.auth.AuthApiKey(api_key or os.getenv("WEAVIATE_API_KEY")),
+            )
+            self.available = True
+            print("Weaviate client initialized successfully")
+        except Exception as e:
+            print(f"Warning: Weaviate not available: {e}")
+            self.available = False
+            self.client = None
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+    def namespace_exists(self, namespace: str) -> bool:
+        if not self.available:
+            return False
+        return self.client.collections.exists(collection_name(namespace))
+
+    def ensure_namespace(self, namespace: str) -> bool:
+        if not self.available:
+            print("Weaviate not available, skipping collection creation")
+            return False
+        name = collection_name(namespace)
+
+        # Check if collection exists
+        if self.client.collections.exists(name):
+            print(f"Collection {name} already exists")
+            return True
+
+        # Create collection with proper schema
+        Property, DataType = self._Property, self._DataType
+        self.client.collections.create(
+            name=name,
+            properties=[
+                # Matched as a whole: word tokenization would make a filter on
+                # "src/a.py" match every path containing "src", "a" or "py"
+                Property(name="source", data_type=DataType.TEXT, tokenization=self._Tokenization.FIELD),
+                Property(name="content", data_type=DataType.TEXT),
+                Property(name="summary", data_type=DataType.TEXT),
+                Property(name="name", data_type=DataType.TEXT),
+                Property(name="chunk", data_type=DataType.INT),
+                Property(name="start_line", data_type=DataType.INT),
+                Property(name="end_line", data_type=DataType.INT),
+            ],
+            # Configure vectorizer to use custom embeddings
+            vectorizer_config=self._Configure.Vectorizer.none(),
+        )
+        self._exact_source[name] = True
+        print(f"Created collection: {name}")
+        return True
+
+    def upsert(self, namespace: str, documents: List[dict]) -> bool:
+        collection = self.client.collections.get(collection_name(namespace))
+        # Objects with the same id are replaced in place
+        with collection.batch.dynamic() as batch:
+            for doc in documents:
+                batch.add_object(
+                    properties={
+                        "source": doc.get("source", ""),
+                        "content": doc.get("content", "")[:10000],  # Limit content size
+                        "summary": doc.get("summary", ""),
+                        "name": doc.get("name", ""),
+                        "chunk": doc.get("chunk", 0),
+                        "start_line": doc.get("start_line", 0),
+                        "end_line": doc.get("end_line", 0),
+                    },
+                    vector=doc.get("embedding", []),
+                    uuid=doc.get("id") or document_id(doc.get("source", ""), doc.get("chunk")),
+                )
+        if collection.batch.failed_objects:
+            print(f"Failed to store {len(collection.batch.failed_objects)} documents")
+            return False
+        return True
+
+    def _source_is_exact(self, name: str) -> bool:
+        """
+        Whether filters on the collection's source property match whole paths.
+        Collections created before source used field tokenization split it
+        into words, so a filter would also match unrelated paths.
+        """
+        exact = self._exact_source.get(name)
+        if exact is None:
+            properties = self.client.collections.get(name).config.get().properties
+            exact = any(
+                prop.name == "source" and prop.tokenization == self._Tokenization.FIELD for prop in properties
+            )
+            if not exact:
+                print(f"Collection {name} tokenizes source into words; deleting by id (re-create it to speed this up)")
+            self._exact_source[name] = exact
+        return exact
+
+    def delete_sources(self, namespace: str, sources: List[str]):
+        self._delete_sources(namespace, sources)
+
+    def replace(self, namespace: str, documents: List[dict]) -> bool:
+        """
+        Write the documents first (objects keep their deterministic ids, so they
+        are overwritten in place), then delete the leftover chunks of the same
+        sources: a re-indexed file is never missing from search
+        """
+        if not self.upsert(namespace, documents):
+            return False
+        keep_ids: Dict[str, set] = {}
+        for doc in documents:
+            doc_id = doc.get("id") or document_id(doc.get("source", ""), doc.get("chunk"))
+            keep_ids.setdefault(doc.get("source", ""), set()).add(doc_id)
+        self._delete_sources(namespace, sorted(keep_ids), keep_ids)
+        return True
+
+    def _delete_sources(self, namespace: str, sources: List[str], keep_ids: Optional[Dict[str, set]] = None):
+        """
+        Delete every object of the sources, except the ids in keep_ids[source]
+        """
+        name = collection_name(namespace)
+        collection = self.client.collections.get(name)
+        keep_ids = keep_ids or {}
+        DELETE_BATCH_SIZE = 100
+        if self._source_is_exact(name):
+            Filter = self._Filter
+            for i in range(0, len(sources), DELETE_BATCH_SIZE):
+                batch = sources[i:i + DELETE_BATCH_SIZE]
+                if not any(keep_ids.get(source) for source in batch):
+                    where = Filter.by_property("source").contains_any(batch)
+                else:
+                    where = Filter.any_of([
+                        Filter.all_of([
+                            Filter.by_property("source").equal(source),
+                            *[Filter.by_id().not_equal(doc_id) for doc_id in sorted(keep_ids[source])],
+                        ]) if keep_ids.get(source) else Filter.by_property("source").equal(source)
+                        for source in batch
+                    ])
+                collection.data.delete_many(where=where)
+            return
+        wanted = set(sources)
+        ids = [
+            item.uuid for item in collection.iterator(return_properties=["source"])
+            if item.properties.get("source") in wanted
+            and str(item.uuid) not in keep_ids.get(item.properties.get("source"), ())
+        ]
+        for i in range(0, len(ids), DELETE_BATCH_SIZE):
+            collection.data.delete_many(where=self._Filter.by_id().contains_any(ids[i:i + DELETE_BATCH_SIZE]))
+
+    def prune(self, namespace: str, keep_sources: set) -> int:
+        collection = self.client.collections.get(collection_name(namespace))
+        stale = [
+            item.uuid for item in collection.iterator(return_properties=["source"])
+            if item.properties.get("source") not in keep_sources
+        ]
+        DELETE_BATCH_SIZE = 100
+        for i in range(0, len(stale), DELETE_BATCH_SIZE):
+            collection.data.delete_many(
+                where=self._Filter.by_id().contains_any(stale[i:i + DELETE_BATCH_SIZE])
+            )
+        return len(stale)
+
+    def search(
+        self, namespace: str, vector: List[float], limit: int = 5, include_vectors: bool = False
+    ) -> List[dict]:
+        name = collection_name(namespace)
+        if not self.client.collections.exists(name):
+            print(f"Collection {name} does not exist")
+            return []
+        collection = self.client.collections.get(name)
+        results = collection.query.near_vector(
+            near_vector=vector,
+            limit=limit,
+            return_properties=["source", "content", "summary", "name", "chunk", "start_line", "end_line"],
+            return_metadata=["distance"],
+            include_vector=include_vectors,
+        )
+        docs = []
+        for item in results.objects:
+            distance = item.metadata.distance if item.metadata else None
+            doc = dict(item.properties)
+            doc["score"] = None if distance is None else 1 - distance
+            if include_vectors and item.vector:
+                vector = item.vector.get("default") if isinstance(item.vector, dict) else item.vector
+                doc["embedding"] = list(vector) if vector is not None else None
+            docs.append(doc)
+        return docs
+
+
+class _LocalNamespace:
+    def __init__(self, path: str):
+        """
+        One namespace of the embedded store:
+        vectors.f32 holds L2-normalized float32 rows (memory-mapped for search),
+        meta.sqlite3 maps each row to its document id, source and properties.
+        Rows of deleted or replaced documents become tombstones until compaction.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(os.path.join(path, "meta.sqlite3"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                source TEXT NOT NULL,
+                properties TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS docs_source ON docs (source);
+            CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        self.conn.commit()
+        row = self.conn.execute("SELECT value FROM info WHERE key = 'dim'").fetchone()
+        self.dim = int(row[0]) if row else None
+        self._matrix = None
+        self._alive = None
+        self._ivf = None
+
+    @property
+    def rows(self) -> int:
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (4 * self.dim)
+
+    def _invalidate(self):
+        self._matrix = None
+        self._alive = None
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            rows = self.rows
+            if rows == 0:
+                self._matrix = np.zeros((0, self.dim or 0), dtype=np.float32)
+            else:
+                self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._matrix
+
+    def alive(self) -> np.ndarray:
+        """
+        Boolean mask of rows that belong to a live document
+        """
+        if self._alive is None:
+            mask = np.zeros(self.rows, dtype=bool)
+            live = [r for (r,) in self.conn.execute("SELECT row FROM docs")]
+            if live:
+                mask[np.array(live, dtype=np.int64)] = True
+            self._alive = mask
+        return self._alive
+
+    def upsert(self, documents: List[dict]):
+        if not documents:
+            return
+        vectors = np.asarray([doc["embedding"] for doc in documents], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self.conn.execute("INSERT OR REPLACE INTO info (key, value) VALUES ('dim', ?)", (str(self.dim),))
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+
+        start = self.rows
+        self._matrix = None  # release the memory map before appending
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with self.conn:
+            for offset, doc in enumerate(documents):
+                doc_id = doc.get("id") or document_id(doc.get("source", ""), doc.get("chunk"))
+                properties = {k: v for k, v in doc.items() if k not in ("embedding", "id")}
+                self.conn.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+                self.conn.execute(
+                    "INSERT INTO docs (row, id, source, properties) VALUES (?, ?, ?, ?)",
+                    (start + offset, doc_id, doc.get("source", ""), json.dumps(properties)),
+                )
+        self._invalidate()
+        self._maybe_compact()
+
+    def delete_sources(self, sources: List[str]):
+        with self.conn:
+            self.conn.executemany("DELETE FROM docs WHERE source = ?", [(s,) for s in sources])
+        self._invalidate()
+        self._maybe_compact()
+
+    def prune(self, keep_sources: set) -> int:
+        stale = [
+            (source,) for (source,) in self.conn.execute("SELECT DISTINCT source FROM docs")
+            if source not in keep_sources
+        ]
+        with self.conn:
+            deleted = self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            self.conn.executemany("DELETE FROM docs WHERE source = ?", stale)
+            deleted -= self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+        self._invalidate()
+        self._maybe_compact()
+        return deleted
+
+    def _maybe_compact(self):
+        """
+        Rewrite the vector file without tombstones once they make up over 30% of it
+        """
+        rows = self.rows
+        if rows == 0:
+            return
+        alive = self.alive()
+        if alive.sum() >= 0.7 * rows:
+            return
+        live_rows = np.flatnonzero(alive)
+        vectors = np.array(self.matrix()[live_rows])
+        tmp_path = self.vectors_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(vectors.tobytes())
+        self._matrix = None
+        with self.conn:
+            # Shift rows out of the way first so the primary key never collides
+            self.conn.execute("UPDATE docs SET row = -row - 1")
+            self.conn.executemany(
+                "UPDATE docs SET row = ? WHERE row = ?",
+                [(new, -int(old) - 1) for new, old in enumerate(live_rows)],
+            )
+            os.replace(tmp_path, self.vectors_path)
+        self._invalidate()
+        self._ivf = None
+
+    def search(self, vector: List[float], limit: int, include_vectors: bool = False) -> List[dict]:
+        if self.rows == 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0 or query.shape[0] != self.dim:
+            return []
+        query = query / norm
+        matrix, alive = self.matrix(), self.alive()
+
+        if alive.sum() >= ANN_THRESHOLD:
+            candidates = self._ivf_candidates(query)
+            scores = matrix[candidates] @ query
+            scores[~alive[candidates]] = -np.inf
+            rows = candidates
+        else:
+            scores = matrix @ query
+            scores[~alive] = -np.inf
+            rows = None
+
+        k = min(limit, int(np.isfinite(scores).sum()))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            hits = [(int(rows[i]), float(scores[i])) for i in top]
+        else:
+            hits = [(int(i), float(scores[i])) for i in top]
+        return self._fetch(hits, matrix if include_vectors else None)
+
+    def _fetch(self, hits, matrix: Optional[np.ndarray] = None) -> List[dict]:
+        placeholders = ",".join("?" * len(hits))
+        found = {
+            row: json.loads(properties)
+            for row, properties in self.conn.execute(
+                f"SELECT row, properties FROM docs WHERE row IN ({placeholders})",
+                [row for row, _ in hits],
+            )
+        }
+        docs = []
+        for row, score in hits:
+            if row in found:
+                doc = found[row]
+                doc["score"] = score
+                if matrix is not None:
+                    doc["embedding"] = matrix[row].tolist()
+                docs.append(doc)
+        return docs
+
+    def _ivf_candidates(self, query: np.ndarray, nprobe: int = 8) -> np.ndarray:
+        """
+        Inverted-file index: rows are clustered around k-means centroids and only
+        the rows of the nprobe closest clusters are scored. Rows appended after
+        the index was built are always scored, and the index is rebuilt once they
+        exceed 10% of it.
+        """
+        matrix = self.matrix()
+        rows = matrix.shape[0]
+        if self._ivf is None or rows - self._ivf["rows"] > 0.1 * self._ivf["rows"]:
+            self._ivf = self._build_ivf(matrix)
+        centroids, assignments, built = self._ivf["centroids"], self._ivf["assignments"], self._ivf["rows"]
+        closest = np.argsort(-(centroids @ query))[:nprobe]
+        candidates = np.flatnonzero(np.isin(assignments, closest))
+        return np.concatenate([candidates, np.arange(built, rows)])
+
+    @staticmethod
+    def _build_ivf(matrix: np.ndarray, iterations: int = 10) -> dict:
+        rows = matrix.shape[0]
+        clusters = max(1, int(np.sqrt(rows)))
+        rng = np.random.default_rng(0)
+        sample = np.array(matrix[rng.choice(rows, size=min(rows, clusters * 64), replace=False)])
+        centroids = sample[rng.choice(len(sample), size=clusters, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(clusters):
+                members = sample[labels == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+        assignments = np.empty(rows, dtype=np.int32)
+        CHUNK = 65536
+        for i in range(0, rows, CHUNK):
+            assignments[i:i + CHUNK] = np.argmax(np.asarray(matrix[i:i + CHUNK]) @ centroids.T, axis=1)
+        return {"centroids": centroids, "assignments": assignments, "rows": rows}
+
+
+class LocalVectorStore(VectorStore):
+    name = "local"
+    available = True
+
+    def __init__(self, root: str = LOCAL_VECTOR_DIR):
+        """
+        Embedded vector store: one memory-mapped float32 matrix and id table per
+        namespace, searched with batched NumPy dot products. Works offline.
+        """
+        self.root = root
+        self._namespaces: Dict[str, _LocalNamespace] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, namespace: str) -> str:
+        return os.path.join(self.root, re.sub(r"[^A-Za-z0-9_]", "_", collection_name(namespace)))
+
+    def _get(self, namespace: str) -> _LocalNamespace:
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            if ns is None:
+                ns = _LocalNamespace(self._path(namespace))
+                self._namespaces[namespace] = ns
+            return ns
+
+    def namespace_exists(self, namespace: str) -> bool:
+        return namespace in self._namespaces or os.path.isdir(self._path(namespace))
+
+    def ensure_namespace(self, namespace: str) -> bool:
+        self._get(namespace)
+        return True
+
+    def upsert(self, namespace: str, documents: List[dict]) -> bool:
+        ns = self._get(namespace)
+        with ns.lock:
+            ns.upsert(documents)
+        return True
+
+    def delete_sources(self, namespace: str, sources: List[str]):
+        ns = self._get(namespace)
+        with ns.lock:
+            ns.delete_sources(sources)
+
+    def replace(self, namespace: str, documents: List[dict]) -> bool:
+        ns = self._get(namespace)
+        with ns.lock:
+            ns.delete_sources(sorted({doc.get("source", "") for doc in documents}))
+            ns.upsert(documents)
+        return True
+
+    def prune(self, namespace: str, keep_sources: set) -> int:
+        ns = self._get(namespace)
+        with ns.lock:
+            return ns.prune(keep_sources)
+
+    def search(
+        self, namespace: str, vector: List[float], limit: int = 5, include_vectors: bool = False
+    ) -> List[dict]:
+        if not self.namespace_exists(namespace):
+            print(f"Namespace {namespace} does not exist")
+            return []
+        ns = self._get(namespace)
+        with ns.lock:
+            return ns.search(vector, limit, include_vectors)
+
+
+def create_vector_store(backend: Optional[str] = None) -> VectorStore:
+    """
+    Create the vector store selected by VECTOR_STORE ("weaviate" or "local")
+    """
+    backend = backend or os.getenv("VECTOR_STORE", "weaviate")
+    if backend == "local":
+        return LocalVectorStore()
+    if backend == "weaviate":
+        return WeaviateVectorStore()
+    raise ValueError(f"Unknown vector store backend: {backend}")